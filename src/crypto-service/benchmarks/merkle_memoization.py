@@ -0,0 +1,70 @@
+"""Benchmark digest memoization of the object-based Merkle tree.
+
+Compares the work needed to obtain a fresh root digest after a single leaf
+update: rebuilding the tree from scratch (the only option before digests were
+memoized) versus updating ``MerkleTreeLeaf.data`` in place and reading
+``root.digest`` again.
+
+Usage:
+    poetry run python benchmarks/merkle_memoization.py
+"""
+import hashlib
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, List, Tuple
+
+from crypto_service.app.utils import hashing, merkle
+
+
+class HashCounter(object):
+    def __init__(self) -> None:
+        self.count = 0
+
+    def sha256(self, data: Any = b"") -> Any:
+        self.count += 1
+        return hashlib.sha256(data)
+
+
+def measure(counter: HashCounter, fn: Callable[[], Any]) -> Tuple[int, float]:
+    counter.count = 0
+    start = time.perf_counter()
+    fn()
+    return counter.count, time.perf_counter() - start
+
+
+def make_leaves(count: int) -> List[merkle.MerkleTreeLeaf]:
+    return [merkle.MerkleTreeLeaf(i.to_bytes(32, "big")) for i in range(count)]
+
+
+def main() -> None:
+    counter = HashCounter()
+    hashing.hashlib = SimpleNamespace(sha256=counter.sha256)  # type: ignore
+
+    print(
+        "%8s | %18s | %18s | %18s"
+        % ("leaves", "initial root", "rebuild + root", "update + root")
+    )
+    for exponent in range(10, 17, 2):
+        leaves = make_leaves(2**exponent)
+        root = merkle.from_leaves(leaves)
+        initial = measure(counter, lambda: root.digest)
+
+        def rebuild() -> None:
+            updated = make_leaves(2**exponent)
+            updated[0] = merkle.MerkleTreeLeaf(b"\xff" * 32)
+            merkle.from_leaves(updated).digest
+
+        def update() -> None:
+            leaves[0].data = b"\xff" * 32
+            root.digest
+
+        rebuilt = measure(counter, rebuild)
+        updated = measure(counter, update)
+        print(
+            "%8d | %7d %8.4fs | %7d %8.4fs | %7d %8.4fs"
+            % ((2**exponent,) + initial + rebuilt + updated)
+        )
+
+
+if __name__ == "__main__":
+    main()
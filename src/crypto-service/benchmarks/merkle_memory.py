@@ -0,0 +1,60 @@
+"""Benchmark the memory taken by the nodes of the object-based Merkle tree.
+
+Builds trees with ``from_leaves`` and reports the traced allocations per node
+(leaves and inner nodes) after building the tree, after computing the root
+digest and after reading the leaves of the root. Leaf data is allocated before
+tracing starts, so only the tree itself is counted.
+
+Usage:
+    poetry run python benchmarks/merkle_memory.py
+"""
+import gc
+import tracemalloc
+from typing import Callable, List
+
+from crypto_service.app.utils import merkle
+
+
+def traced(fn: Callable[[], None]) -> int:
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    fn()
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0] - before
+
+
+def main() -> None:
+    print(
+        "%8s | %8s | %12s | %12s | %12s"
+        % ("leaves", "nodes", "build", "+ digests", "+ leaves")
+    )
+    for exponent in range(12, 17, 2):
+        count = 2**exponent
+        data = [i.to_bytes(32, "big") for i in range(count)]
+        nodes = 2 * count - 1
+        trees: List[merkle.MerkleTreeNode] = []
+
+        def build() -> None:
+            trees.append(
+                merkle.from_leaves([merkle.MerkleTreeLeaf(item) for item in data])
+            )
+
+        tracemalloc.start()
+        built = traced(build)
+        digests = traced(lambda: trees[0].digest and None)
+        leaves = traced(lambda: trees[0].leaves and None)
+        tracemalloc.stop()
+        print(
+            "%8d | %8d | %6.1f B/node | %6.1f B/node | %6.1f B/node"
+            % (
+                count,
+                nodes,
+                built / nodes,
+                (built + digests) / nodes,
+                (built + digests + leaves) / nodes,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
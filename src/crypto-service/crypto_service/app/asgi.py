@@ -4,7 +4,14 @@ import logging
 from fastapi import FastAPI
 from crypto_service.config import settings
 from crypto_service.app.router import root_api_router
-from crypto_service.app.utils import AiohttpClient
+from crypto_service.app.utils import (
+    AiohttpClient,
+    EncodingCache,
+    StoredTrees,
+    WorkExecutor,
+    flat_merkle,
+    hashing,
+)
 from crypto_service.app.exceptions import (
     HTTPException,
     http_exception_handler,
@@ -24,6 +31,23 @@ async def on_startup() -> None:
     """
     log.debug("Execute FastAPI startup event handler.")
     AiohttpClient.get_aiohttp_client()
+    hashing.configure_backend(settings.HASH_BACKEND)
+    flat_merkle.configure_parallelism(
+        settings.MERKLE_WORKERS, settings.MERKLE_PARALLEL_THRESHOLD
+    )
+    WorkExecutor.configure(
+        settings.EXECUTOR_TYPE,
+        settings.EXECUTOR_WORKERS,
+        settings.EXECUTOR_QUEUE_SIZE,
+    )
+    await EncodingCache.configure(
+        max_bytes=settings.ENCODING_CACHE_BYTES,
+        directory=settings.ENCODING_CACHE_DIR,
+        redis_url=settings.REDIS_URL if settings.USE_REDIS else None,
+        ttl=settings.ENCODING_CACHE_TTL,
+        disk_bytes=settings.ENCODING_CACHE_DIR_BYTES,
+    )
+    StoredTrees.configure(settings.TREE_STORE_DIR, settings.TREE_STORE_DIR_BYTES)
 
 
 async def on_shutdown() -> None:
@@ -36,6 +60,10 @@ async def on_shutdown() -> None:
     log.debug("Execute FastAPI shutdown event handler.")
     # Gracefully close utilities.
     await AiohttpClient.close_aiohttp_client()
+    await EncodingCache.close()
+    WorkExecutor.shutdown_executor()
+    flat_merkle.shutdown_pool()
+    hashing.shutdown_backend()
 
 
 def get_application() -> FastAPI:
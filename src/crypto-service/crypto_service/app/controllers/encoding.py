@@ -1,26 +1,172 @@
 """Application implementation - Encoding controller."""
+import asyncio
 import logging
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Header, Request, Response
+from crypto_service.app.exceptions import HTTPException
 from crypto_service.app.views import (
     EncodingResponse,
+    EncodingBatchResponse,
+    ErrorResponse,
     RootHashResponse,
     ComputationResultResponse,
 )
-from crypto_service.app.utils import encoding, merkle, bytes as bytess
+from crypto_service.app.utils import encoding, flat_merkle, merkle, bytes as bytess
+from crypto_service.app.utils import encoding_cache
+from crypto_service.app.utils.encoding_cache import EncodingCache
+from crypto_service.app.utils.profile import DEFAULT_PROFILE, EncodingProfile, Padding
+from crypto_service.app.utils.tree_store import StoredTrees
+from crypto_service.app.utils.work_executor import (
+    ExecutorSaturatedError,
+    WorkExecutor,
+)
 from pydantic import BaseModel
-from typing import List
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+OCTET_STREAM = "application/octet-stream"
+# OpenAPI description of the raw request body of the binary endpoints
+BINARY_BODY: Dict[str, Any] = {
+    "requestBody": {
+        "content": {OCTET_STREAM: {"schema": {"type": "string", "format": "binary"}}},
+        "required": True,
+    }
+}
+
+
+class Profile(BaseModel):
+    leaf_size: Optional[int] = None
+    slices_count: Optional[int] = None
+    padding: Padding = Padding.NONE
 
 
 class ComputationResult(BaseModel):
     result: int
     nonce: str
     key: str
+    profile: Profile = Profile()
+
+
+class ComputationResultBatch(BaseModel):
+    results: List[ComputationResult]
 
 
 router = APIRouter()
 log = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+
+def encode_data(
+    data: bytes,
+    key: bytes,
+    tree_dir: Optional[str] = None,
+    profile: EncodingProfile = DEFAULT_PROFILE,
+) -> Tuple[List[bytes], bytes]:
+    """Return the encoding vector and its root hash of data split into leaves.
+
+    The leaves are laid out by profile, two leaves by default. The encoded tree
+    is stored in tree_dir, if given.
+    """
+    encrypted_merkle_tree = encoding.encode_bytes(data, key, profile)
+    if tree_dir is not None:
+        StoredTrees.open(tree_dir).put(encrypted_merkle_tree)
+    # leaves are views into shared buffers, copy them for the process pool
+    return (
+        [bytes(leaf.data) for leaf in encrypted_merkle_tree.leaves],
+        encrypted_merkle_tree.digest,
+    )
+
+
+def encode_batch(
+    items: List[Tuple[bytes, bytes, EncodingProfile]], tree_dir: Optional[str] = None
+) -> List[Tuple[List[bytes], bytes]]:
+    # callers pass items sorted by key, items sharing a key that end up in the
+    # same batch are encoded one after another and hit the keystream cache
+    return [encode_data(data, key, tree_dir, profile) for data, key, profile in items]
+
+
+def tree_dir() -> Optional[str]:
+    # passed to the workers by path, the process pool cannot share the store
+    return StoredTrees.store.directory if StoredTrees.store else None
+
+
+def is_stored(root: bytes) -> bool:
+    # a cached encoding is only complete once its tree is stored as well
+    return StoredTrees.store is None or root in StoredTrees.store
+
+
+def compute_root(leaves: List[merkle.MerkleTreeLeaf]) -> bytes:
+    return flat_merkle.from_leaves(leaves).digest
+
+
+def decode_leaves(
+    leaves: List[merkle.MerkleTreeLeaf],
+    key: bytes,
+    profile: Optional[EncodingProfile] = None,
+) -> List[bytes]:
+    """Return the plaintext leaves of an encoding vector.
+
+    The data leaves have to match profile, if given.
+    """
+    decoded, _ = encoding.decode_mismatches(
+        flat_merkle.from_leaves(leaves),
+        key,
+        encoding.DecodeMode.FIRST_ERROR,
+        profile=profile,
+    )
+    # only DecodeMode.VERIFY_ONLY skips building the plaintext tree
+    assert decoded is not None
+    return [bytes(leaf.data) for leaf in decoded.leaves]
+
+
+async def run_off_loop(func: Callable[..., T], *args: Any) -> T:
+    """Run CPU-bound work in the WorkExecutor pool.
+
+    Raises:
+        HTTPException: If the pool is saturated.
+
+    """
+    try:
+        return await WorkExecutor.run(func, *args)
+    except ExecutorSaturatedError:
+        log.warning("WorkExecutor saturated, rejecting request.")
+        raise HTTPException(
+            status_code=503,
+            content=ErrorResponse(
+                code=503, message="Server is busy, please retry later."
+            ).dict(),
+            headers={"Retry-After": "1"},
+        )
+
+
+async def encode_cached(
+    data: bytes, key: bytes, profile: EncodingProfile = DEFAULT_PROFILE
+) -> Tuple[List[bytes], bytes]:
+    """Return the encoding of data, from the EncodingCache if possible."""
+    cache_key = encoding_cache.encoding_key(data, key, profile)
+    cached = await EncodingCache.get(cache_key)
+    if cached is not None:
+        encoded = encoding_cache.unpack_encoding(cached)
+        if is_stored(encoded[1]):
+            return encoded
+
+    encoded = await run_off_loop(encode_data, data, key, tree_dir(), profile)
+    await EncodingCache.set(cache_key, encoding_cache.pack_encoding(encoded))
+    return encoded
+
+
+async def compute_root_cached(leaves: List[merkle.MerkleTreeLeaf]) -> bytes:
+    """Return the root hash of leaves, from the EncodingCache if possible."""
+    # the key hashes all leaf data, which takes a while for large trees
+    cache_key = await run_off_loop(encoding_cache.root_key, leaves)
+    cached = await EncodingCache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    root = await run_off_loop(compute_root, leaves)
+    await EncodingCache.set(cache_key, root)
+    return root
+
 
 @router.post(
     "/encoding",
@@ -32,22 +178,91 @@ log = logging.getLogger(__name__)
 async def make_encoding(computation_result: ComputationResult) -> EncodingResponse:
     """Make encoding from merkle tree leaves.
 
+    Result and nonce are split into two 32 byte leaves unless the request
+    carries another encoding profile.
+
     Returns:
         response (EncodingResponse): EncodingResponse model object instance.
 
+    Raises:
+        HTTPException: If result and nonce do not fit the encoding profile.
+
     """
     log.info("Started POST /encoding")
 
     result = int.to_bytes(computation_result.result, 32, "big")
     nonce = bytes.fromhex(computation_result.nonce)
     key = bytes.fromhex(computation_result.key)
+    profile = profile_for(computation_result, result + nonce)
+
+    encoded, root = await encode_cached(result + nonce, key, profile)
 
-    plain_merkle_tree = merkle.from_bytes(result + nonce)
-    encrypted_merkle_tree = encoding.encode(plain_merkle_tree, key)
+    leafs = [leaf.hex() for leaf in encoded]
 
-    leafs = [leaf.data.hex() for leaf in encrypted_merkle_tree.leaves]
+    return EncodingResponse(encoding=leafs, root=root.hex())
 
-    return EncodingResponse(encoding=leafs, root=encrypted_merkle_tree.digest.hex())
+
+@router.post(
+    "/encoding/batch",
+    tags=["encoding"],
+    response_model=EncodingBatchResponse,
+    summary="Creates encodings of many computation results.",
+    status_code=200,
+)
+async def make_encoding_batch(
+    batch: ComputationResultBatch,
+) -> EncodingBatchResponse:
+    """Make encodings of many computation results in one request.
+
+    Cached encodings are served from the EncodingCache. The other results are
+    sorted by key and split into one batch per WorkExecutor worker.
+
+    Returns:
+        response (EncodingBatchResponse): EncodingBatchResponse model object
+            instance, encodings are in request order.
+
+    Raises:
+        HTTPException: If the WorkExecutor pool is saturated.
+
+    """
+    log.info("Started POST /encoding/batch (%d results)", len(batch.results))
+
+    items = []
+    for item in batch.results:
+        data = int.to_bytes(item.result, 32, "big") + bytes.fromhex(item.nonce)
+        items.append((data, bytes.fromhex(item.key), profile_for(item, data)))
+    cache_keys = [encoding_cache.encoding_key(*item) for item in items]
+    found: Dict[int, Tuple[List[bytes], bytes]] = {}
+    for i, cache_key in enumerate(cache_keys):
+        cached = await EncodingCache.get(cache_key)
+        if cached is not None:
+            encoded = encoding_cache.unpack_encoding(cached)
+            if is_stored(encoded[1]):
+                found[i] = encoded
+
+    missing = [i for i in range(len(items)) if i not in found]
+    order = sorted(missing, key=lambda i: items[i][1])
+    chunk_size = max(1, -(-len(order) // WorkExecutor.workers))
+    chunks = [order[i : i + chunk_size] for i in range(0, len(order), chunk_size)]
+
+    results = await asyncio.gather(
+        *[
+            run_off_loop(encode_batch, [items[i] for i in chunk], tree_dir())
+            for chunk in chunks
+        ]
+    )
+    for chunk, chunk_results in zip(chunks, results):
+        for i, result in zip(chunk, chunk_results):
+            found[i] = result
+            await EncodingCache.set(cache_keys[i], encoding_cache.pack_encoding(result))
+
+    encodings: Dict[int, EncodingResponse] = {}
+    for i, (leaves, root) in found.items():
+        encodings[i] = EncodingResponse(
+            encoding=[leaf.hex() for leaf in leaves], root=root.hex()
+        )
+
+    return EncodingBatchResponse(encodings=[encodings[i] for i in range(len(items))])
 
 
 class Leafs(BaseModel):
@@ -81,15 +296,16 @@ async def make_encoding(leafs: Leafs) -> RootHashResponse:
         [merkle.MerkleTreeHashLeaf(bytes.fromhex(leaf)) for leaf in leafs.hash_leafs]
     )
 
-    merkle_tree = merkle.from_leaves(hex_leafs)
+    root = await compute_root_cached(hex_leafs)
 
-    return RootHashResponse(root=merkle_tree.digest.hex())
+    return RootHashResponse(root=root.hex())
 
 
-class Leafs(BaseModel):
+class EncodedLeafs(BaseModel):
     leafs: List[str]
     hash_leafs: List[str]
     key: str
+    profile: Profile = Profile()
 
 
 @router.post(
@@ -99,16 +315,19 @@ class Leafs(BaseModel):
     summary="Decodes computation result.",
     status_code=200,
 )
-async def make_encoding(leafs: Leafs) -> ComputationResultResponse:
+async def make_encoding(leafs: EncodedLeafs) -> ComputationResultResponse:
     """Decode computation result with symmetric key.
 
+    The data leaves have to match the profile the result was encoded with.
+
     Returns:
         response (ComputationResultResponse): ComputationResultResponse model object instance.
 
     Raises:
         HTTPException: If applications has enabled Redis and can not connect
-            to it. NOTE! This is the custom exception, not to be mistaken with
-            FastAPI.HTTPException class.
+            to it, or if the leaves do not match the profile. NOTE! This is the
+            custom exception, not to be mistaken with FastAPI.HTTPException
+            class.
 
     """
     log.info("Started POST /decode")
@@ -119,13 +338,194 @@ async def make_encoding(leafs: Leafs) -> ComputationResultResponse:
     )
 
     key = bytes.fromhex(leafs.key)
+    profile = EncodingProfile(**leafs.profile.dict())
 
-    merkle_tree = merkle.from_leaves(hex_leafs)
-    decoded = encoding.decode(merkle_tree, key)
-    result = int.from_bytes(decoded[0].children[0].data, "big")
+    try:
+        decoded = await run_off_loop(decode_leaves, hex_leafs, key, profile)
+    except ValueError as error:
+        raise bad_request(str(error))
+    # the result is the first 32 byte word, the rest of the leaf is the nonce
+    result = int.from_bytes(decoded[0][:32], "big")
 
     return ComputationResultResponse(
         result=result,
-        decoded=[leaf.data.hex() for leaf in decoded[0].leaves],
-        encoding=[leaf.data.hex() for leaf in merkle_tree.leaves],
+        decoded=[leaf.hex() for leaf in decoded],
+        encoding=[leaf.data.hex() for leaf in hex_leafs],
+    )
+
+
+def bad_request(message: str) -> HTTPException:
+    return HTTPException(
+        status_code=400,
+        content=ErrorResponse(code=400, message=message).dict(),
+    )
+
+
+def profile_for(computation_result: ComputationResult, data: bytes) -> EncodingProfile:
+    """Return the requested encoding profile of data.
+
+    Raises:
+        HTTPException: If data does not fit the profile.
+
+    """
+    profile = EncodingProfile(**computation_result.profile.dict())
+    try:
+        profile.layout(len(data))
+    except ValueError as error:
+        raise bad_request(str(error))
+    return profile
+
+
+def leaves_from_buffer(
+    buffer: bytes, leaf_count: int, leaf_size: int
+) -> List[merkle.MerkleTreeLeaf]:
+    """Split a binary request body into Merkle tree leaves.
+
+    The body holds ``leaf_count`` data leaves of ``leaf_size`` bytes followed by
+    32 byte hash leaves.
+
+    Raises:
+        HTTPException: If the body does not match the given framing.
+
+    """
+    data_size = leaf_count * leaf_size
+    if (
+        leaf_count < 0
+        or leaf_size <= 0
+        or leaf_size % 32 != 0
+        or len(buffer) < data_size
+        or (len(buffer) - data_size) % 32 != 0
+    ):
+        raise bad_request("Request body does not match X-Leaf-Count and X-Leaf-Size.")
+
+    leaves = [
+        merkle.MerkleTreeLeaf(buffer[i : i + leaf_size])
+        for i in range(0, data_size, leaf_size)
+    ]
+    leaves.extend(
+        merkle.MerkleTreeHashLeaf(buffer[i : i + 32])
+        for i in range(data_size, len(buffer), 32)
+    )
+    return leaves
+
+
+@router.post(
+    "/encoding/binary",
+    tags=["encoding"],
+    response_class=Response,
+    summary="Creates binary encoding from merkle tree leaves.",
+    status_code=200,
+)
+async def make_binary_encoding(computation_result: ComputationResult) -> Response:
+    """Make encoding from merkle tree leaves and return it as raw bytes.
+
+    The response body is the concatenated encoding vector. The root hash and
+    the framing of the body are returned in the X-Merkle-Root, X-Leaf-Count
+    and X-Leaf-Size headers.
+
+    Returns:
+        response (Response): application/octet-stream response.
+
+    """
+    log.info("Started POST /encoding/binary")
+
+    result = int.to_bytes(computation_result.result, 32, "big")
+    nonce = bytes.fromhex(computation_result.nonce)
+    key = bytes.fromhex(computation_result.key)
+    profile = profile_for(computation_result, result + nonce)
+
+    encoded, root = await encode_cached(result + nonce, key, profile)
+
+    return Response(
+        content=b"".join(encoded),
+        media_type=OCTET_STREAM,
+        headers={
+            "X-Merkle-Root": root.hex(),
+            "X-Leaf-Count": str(len(encoded) // 2),
+            "X-Leaf-Size": str(len(encoded[0])),
+        },
+    )
+
+
+@router.post(
+    "/root/binary",
+    tags=["encoding"],
+    response_class=Response,
+    summary="Creates root hash from binary merkle tree leaves.",
+    status_code=200,
+    openapi_extra=BINARY_BODY,
+)
+async def make_binary_root(
+    request: Request,
+    x_leaf_count: int = Header(),
+    x_leaf_size: int = Header(32),
+) -> Response:
+    """Make root hash from merkle tree leaves sent as raw bytes.
+
+    The request body holds X-Leaf-Count data leaves of X-Leaf-Size bytes each,
+    followed by 32 byte hash leaves. The response body is the raw root hash.
+
+    Returns:
+        response (Response): application/octet-stream response.
+
+    Raises:
+        HTTPException: If the request body does not match the headers.
+
+    """
+    log.info("Started POST /root/binary")
+
+    leaves = leaves_from_buffer(await request.body(), x_leaf_count, x_leaf_size)
+    try:
+        root = await compute_root_cached(leaves)
+    except ValueError as error:
+        raise bad_request(str(error))
+
+    return Response(content=root, media_type=OCTET_STREAM)
+
+
+@router.post(
+    "/decode/binary",
+    tags=["encoding"],
+    response_class=Response,
+    summary="Decodes binary computation result.",
+    status_code=200,
+    openapi_extra=BINARY_BODY,
+)
+async def make_binary_decode(
+    request: Request,
+    x_key: str = Header(),
+    x_leaf_count: int = Header(),
+    x_leaf_size: int = Header(32),
+    x_slices_count: Optional[int] = Header(None),
+    x_padding: Padding = Header(Padding.NONE),
+) -> Response:
+    """Decode computation result sent as raw bytes with symmetric key.
+
+    The request body is framed as for /root/binary and X-Key holds the hex
+    encoded key. X-Slices-Count and X-Padding give the profile the result was
+    encoded with, its leaf size is X-Leaf-Size. The response body is the
+    concatenated plaintext, the result taken from its first leaf is returned
+    in the X-Result header.
+
+    Returns:
+        response (Response): application/octet-stream response.
+
+    Raises:
+        HTTPException: If the request body does not match the headers.
+
+    """
+    log.info("Started POST /decode/binary")
+
+    leaves = leaves_from_buffer(await request.body(), x_leaf_count, x_leaf_size)
+    profile = EncodingProfile(x_leaf_size, x_slices_count, x_padding)
+    try:
+        key = bytes.fromhex(x_key)
+        plaintext = await run_off_loop(decode_leaves, leaves, key, profile)
+    except ValueError as error:
+        raise bad_request(str(error))
+
+    return Response(
+        content=b"".join(plaintext),
+        media_type=OCTET_STREAM,
+        headers={"X-Result": str(int.from_bytes(plaintext[0][:32], "big"))},
     )
@@ -0,0 +1,210 @@
+"""Application implementation - Trees controller."""
+import logging
+from typing import List
+
+from fastapi import APIRouter, Query
+from pydantic import BaseModel
+from crypto_service.config import settings
+from crypto_service.app.controllers.encoding import run_off_loop
+from crypto_service.app.exceptions import HTTPException
+from crypto_service.app.utils.tree_store import (
+    MappedMerkleTree,
+    StoredTrees,
+    TreeStoreError,
+)
+from crypto_service.app.views import (
+    ErrorResponse,
+    MultiProofNode,
+    MultiProofResponse,
+    ProofBatchResponse,
+    ProofResponse,
+)
+
+
+router = APIRouter()
+log = logging.getLogger(__name__)
+
+
+class LeafIndices(BaseModel):
+    indices: List[int]
+
+
+def not_found(message: str) -> HTTPException:
+    return HTTPException(
+        status_code=404,
+        content=ErrorResponse(code=404, message=message).dict(),
+    )
+
+
+def tree_directory() -> str:
+    # only called after get_tree found the tree, so trees are stored
+    assert StoredTrees.store is not None
+    return StoredTrees.store.directory
+
+
+def get_tree(root: str) -> MappedMerkleTree:
+    """Return the stored tree with the given hex encoded root hash.
+
+    Raises:
+        HTTPException: If trees are not stored, the tree is unknown or its
+            file cannot be read.
+
+    """
+    try:
+        if StoredTrees.store is None:
+            raise KeyError(root)
+        return StoredTrees.store.get(bytes.fromhex(root))
+    except (KeyError, ValueError):
+        raise not_found("Tree %s is not stored." % root)
+    except TreeStoreError as error:
+        log.error("Cannot read stored tree %s: %s", root, error)
+        raise HTTPException(
+            status_code=500,
+            content=ErrorResponse(
+                code=500, message="Tree %s cannot be read." % root
+            ).dict(),
+        )
+
+
+def check_indices(tree: MappedMerkleTree, indices: List[int]) -> None:
+    if len(indices) > settings.TREE_PROOF_MAX_INDICES:
+        raise HTTPException(
+            status_code=400,
+            content=ErrorResponse(
+                code=400,
+                message="Too many leaf indices, at most %d are allowed."
+                % settings.TREE_PROOF_MAX_INDICES,
+            ).dict(),
+        )
+    if not all(0 <= index < tree.leaf_count for index in indices):
+        raise HTTPException(
+            status_code=400,
+            content=ErrorResponse(
+                code=400,
+                message="Leaf index out of range, the tree has %d leaves."
+                % tree.leaf_count,
+            ).dict(),
+        )
+
+
+def stored_tree(directory: str, root: str) -> MappedMerkleTree:
+    # runs in the WorkExecutor, process pools cannot share the store
+    return StoredTrees.open(directory).get(bytes.fromhex(root))
+
+
+def make_proof(tree: MappedMerkleTree, root: str, index: int) -> ProofResponse:
+    return ProofResponse(
+        root=root,
+        index=index,
+        leaf=tree.leaf_data(index).hex(),
+        leaf_digest=tree.node_digest(0, index).hex(),
+        proof=[digest.hex() for digest in tree.get_proof_by_index(index)],
+    )
+
+
+def make_proofs(directory: str, root: str, indices: List[int]) -> List[ProofResponse]:
+    tree = stored_tree(directory, root)
+    return [make_proof(tree, root, index) for index in indices]
+
+
+def make_multiproof(
+    directory: str, root: str, indices: List[int]
+) -> MultiProofResponse:
+    tree = stored_tree(directory, root)
+    return MultiProofResponse(
+        root=root,
+        depth=tree.depth,
+        indices=indices,
+        leaves=[tree.leaf_data(index).hex() for index in indices],
+        leaf_digests=[tree.node_digest(0, index).hex() for index in indices],
+        nodes=[
+            MultiProofNode(level=level, index=index, digest=digest.hex())
+            for level, index, digest in tree.get_multiproof(indices)
+        ],
+    )
+
+
+@router.get(
+    "/trees/{root}/proof",
+    tags=["trees"],
+    response_model=ProofResponse,
+    summary="Returns the Merkle proof of a leaf of a stored tree.",
+    status_code=200,
+)
+async def get_proof(root: str, index: int = Query(...)) -> ProofResponse:
+    """Return the Merkle proof of a leaf of a stored encoding.
+
+    Trees are stored by the encoding endpoints if FASTAPI_TREE_STORE_DIR is
+    set.
+
+    Returns:
+        response (ProofResponse): ProofResponse model object instance.
+
+    Raises:
+        HTTPException: If the tree is not stored or the index is out of range.
+
+    """
+    log.info("Started GET /trees/%s/proof", root)
+
+    tree = get_tree(root)
+    check_indices(tree, [index])
+
+    proofs = await run_off_loop(make_proofs, tree_directory(), root, [index])
+    return proofs[0]
+
+
+@router.post(
+    "/trees/{root}/proofs",
+    tags=["trees"],
+    response_model=ProofBatchResponse,
+    summary="Returns the Merkle proofs of many leaves of a stored tree.",
+    status_code=200,
+)
+async def get_proofs(root: str, leaf_indices: LeafIndices) -> ProofBatchResponse:
+    """Return the Merkle proofs of many leaves of a stored encoding.
+
+    Returns:
+        response (ProofBatchResponse): ProofBatchResponse model object instance.
+
+    Raises:
+        HTTPException: If the tree is not stored or an index is out of range.
+
+    """
+    log.info("Started POST /trees/%s/proofs", root)
+
+    tree = get_tree(root)
+    check_indices(tree, leaf_indices.indices)
+
+    proofs = await run_off_loop(
+        make_proofs, tree_directory(), root, leaf_indices.indices
+    )
+    return ProofBatchResponse(root=root, proofs=proofs)
+
+
+@router.post(
+    "/trees/{root}/multiproof",
+    tags=["trees"],
+    response_model=MultiProofResponse,
+    summary="Returns a Merkle multiproof for many leaves of a stored tree.",
+    status_code=200,
+)
+async def get_multiproof(root: str, leaf_indices: LeafIndices) -> MultiProofResponse:
+    """Return a single Merkle multiproof for many leaves of a stored encoding.
+
+    Digests shared by the individual proofs or derivable from the requested
+    leaves are only included once or not at all.
+
+    Returns:
+        response (MultiProofResponse): MultiProofResponse model object instance.
+
+    Raises:
+        HTTPException: If the tree is not stored or an index is out of range.
+
+    """
+    log.info("Started POST /trees/%s/multiproof", root)
+
+    tree = get_tree(root)
+    check_indices(tree, leaf_indices.indices)
+    indices = sorted(set(leaf_indices.indices))
+
+    return await run_off_loop(make_multiproof, tree_directory(), root, indices)
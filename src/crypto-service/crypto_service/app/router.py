@@ -9,8 +9,10 @@ Resources:
 from fastapi import APIRouter
 from crypto_service.app.controllers import ready
 from crypto_service.app.controllers import encoding
+from crypto_service.app.controllers import trees
 
 root_api_router = APIRouter(prefix="/api")
 
 root_api_router.include_router(ready.router, tags=["ready"])
 root_api_router.include_router(encoding.router, tags=["encoding"])
+root_api_router.include_router(trees.router, tags=["trees"])
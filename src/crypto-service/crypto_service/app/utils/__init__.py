@@ -5,6 +5,9 @@ Resources:
 
 """
 from crypto_service.app.utils.aiohttp_client import AiohttpClient
+from crypto_service.app.utils.encoding_cache import EncodingCache
+from crypto_service.app.utils.tree_store import StoredTrees
+from crypto_service.app.utils.work_executor import WorkExecutor
 
 
-__all__ = ("AiohttpClient")
+__all__ = ("AiohttpClient", "EncodingCache", "StoredTrees", "WorkExecutor")
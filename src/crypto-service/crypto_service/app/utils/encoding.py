@@ -17,20 +17,52 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import enum
+import itertools
 import math
-import hashlib
-from typing import List, Tuple, Type
-from eth_abi.packed import encode_packed
-from crypto_service.app.utils.xor import xor_crypt
+from typing import (
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+)
+from crypto_service.app.utils.hashing import (
+    DIGEST_SIZE,
+    hash_leaf,
+    hash_leaves,
+    hash_pair,
+    hash_pairs,
+    zero_leaf_digest,
+)
+from crypto_service.app.utils.keystream import PAD_SIZE, keystream, pad
+from crypto_service.app.utils.xor import xor_crypt, xor_into
 from crypto_service.app.utils.merkle import (
     MerkleTreeNode,
     MerkleTreeLeaf,
     MerkleTreeHashLeaf,
+)
+from crypto_service.app.utils.flat_merkle import (
+    FlatMerkleTree,
+    MerkleTree,
+    from_bytes,
     from_leaves,
 )
+from crypto_service.app.utils.profile import DEFAULT_PROFILE, EncodingProfile
 
 
 B032 = b"\x00" * 32
+# number of claimed digests compared per step while looking for mismatches
+MISMATCH_BLOCK_SIZE = 1024
+
+
+class DecodeMode(str, enum.Enum):
+    FULL = "full"
+    FIRST_ERROR = "first-error"
+    VERIFY_ONLY = "verify-only"
 
 
 class DecodingError(Exception):
@@ -61,36 +93,70 @@ class LeafDigestMismatchError(NodeDigestMismatchError):
     pass
 
 
+class DigestMismatch(NamedTuple):
+    # positions in the encoded vector: first child and claimed parent digest
+    index_in: int
+    index_out: int
+
+
 def crypt(value: bytes, index: int, key: bytes) -> bytes:
-    return xor_crypt(
-        value,
-        hashlib.sha256(encode_packed(["uint256", "bytes32"], [index, key])).digest(),
-    )
+    return xor_crypt(value, pad(index, key))
 
 
-def encode(root: MerkleTreeNode, key: bytes) -> MerkleTreeNode:
-    leaves_enc = [
-        crypt(leaf.data, index, key) for index, leaf in enumerate(root.leaves)
-    ]
-    digests_enc = [
-        crypt(digest, 2 * len(leaves_enc) + index, key)
-        for index, digest in enumerate(root.digests_pack)
-    ]
-    return from_leaves(
-        [MerkleTreeLeaf(x) for x in leaves_enc]
-        + [MerkleTreeHashLeaf(x) for x in digests_enc]
-        + [MerkleTreeHashLeaf(B032)]
+def crypt_all(values: Sequence[bytes], start_index: int, key: bytes) -> bytearray:
+    # crypt(values[i], start_index + i, key) for all values, the results are
+    # returned concatenated in one buffer that is XORed in place (see split)
+    pads = keystream(key, start_index, start_index + len(values))
+    buffer = bytearray().join(values)
+    if all(len(value) == PAD_SIZE for value in values):
+        xor_into(memoryview(buffer), pads)
+        return buffer
+    # longer values repeat their pad, like xor_crypt does
+    view = memoryview(buffer)
+    offset = 0
+    for i, value in enumerate(values):
+        size = len(value)
+        block = pads[i * PAD_SIZE : (i + 1) * PAD_SIZE]
+        xor_into(view[offset : offset + size], (block * -(-size // PAD_SIZE))[:size])
+        offset += size
+    return buffer
+
+
+def crypt_zeros(count: int, size: int, start_index: int, key: bytes) -> bytes:
+    # crypt of count zero values of size bytes, which are their repeated pads
+    pads = keystream(key, start_index, start_index + count)
+    if size == PAD_SIZE:
+        return pads
+    repeat = -(-size // PAD_SIZE)
+    return b"".join(
+        [
+            (pads[i : i + PAD_SIZE] * repeat)[:size]
+            for i in range(0, len(pads), PAD_SIZE)
+        ]
     )
 
 
-def encode_forge_first_leaf(root: MerkleTreeNode, key: bytes) -> MerkleTreeNode:
-    leaf_data = [leaf.data for leaf in root.leaves]
-    leaf_data[0] = b"\0" * len(leaf_data[0])
-    leaf_data_enc = [crypt(data, index, key) for index, data in enumerate(leaf_data)]
-    digests_enc = [
-        crypt(digest, 2 * len(leaf_data_enc) + index, key)
-        for index, digest in enumerate(root.digests_pack)
-    ]
+def split(buffer: bytes, sizes: Iterable[int]) -> List[memoryview]:
+    # views into buffer, the chunks share its memory
+    view = memoryview(buffer)
+    chunks: List[memoryview] = []
+    offset = 0
+    for size in sizes:
+        chunks.append(view[offset : offset + size])
+        offset += size
+    return chunks
+
+
+def _encode(leaf_data: List[bytes], digests: List[bytes], key: bytes) -> FlatMerkleTree:
+    # leaves missing up to len(digests) + 1 are zero leaves like the last one,
+    # their ciphertext is taken from the keystream without building them
+    count = len(digests) + 1
+    size = len(leaf_data[-1])
+    buffer = crypt_all(leaf_data, 0, key)
+    buffer += crypt_zeros(count - len(leaf_data), size, len(leaf_data), key)
+    sizes = [len(data) for data in leaf_data] + [size] * (count - len(leaf_data))
+    leaf_data_enc = split(buffer, sizes)
+    digests_enc = split(crypt_all(digests, 2 * count, key), [32] * len(digests))
     return from_leaves(
         [MerkleTreeLeaf(x) for x in leaf_data_enc]
         + [MerkleTreeHashLeaf(x) for x in digests_enc]
@@ -98,94 +164,172 @@ def encode_forge_first_leaf(root: MerkleTreeNode, key: bytes) -> MerkleTreeNode:
     )
 
 
-def encode_forge_first_leaf_first_hash(
-    root: MerkleTreeNode, key: bytes
-) -> MerkleTreeNode:
+def _leaf_data(root: MerkleTree, count: int = 0) -> List[bytes]:
+    # padding leaves are only part of the digests of a tree, _encode adds
+    # their ciphertext; forgeries that change them get at least count leaves
     leaf_data = [leaf.data for leaf in root.leaves]
+    zero = bytes(len(leaf_data[-1]))
+    return leaf_data + [zero] * (count - len(leaf_data))
+
+
+def _leaf_digests(leaf_data: Sequence[memoryview]) -> bytes:
+    # trailing padding leaves decrypt to zeros, their digest is cached, the
+    # other leaves are hashed in batches
+    zero = bytes(len(leaf_data[-1]))
+    end = len(leaf_data)
+    while end and leaf_data[end - 1] == zero:
+        end -= 1
+    padding = zero_leaf_digest(len(zero)) * (len(leaf_data) - end)
+    return hash_leaves(leaf_data[:end]) + padding
+
+
+def encode(root: MerkleTree, key: bytes) -> FlatMerkleTree:
+    return _encode(_leaf_data(root), root.digests_pack, key)
+
+
+def encode_bytes(
+    data: bytes, key: bytes, profile: EncodingProfile = DEFAULT_PROFILE
+) -> FlatMerkleTree:
+    return encode(from_bytes(data, profile=profile), key)
+
+
+def encode_forge_first_leaf(root: MerkleTree, key: bytes) -> FlatMerkleTree:
+    leaf_data = _leaf_data(root)
     leaf_data[0] = b"\0" * len(leaf_data[0])
-    leaf_data_enc = [crypt(data, index, key) for index, data in enumerate(leaf_data)]
+    return _encode(leaf_data, root.digests_pack, key)
+
+
+def encode_forge_first_leaf_first_hash(root: MerkleTree, key: bytes) -> FlatMerkleTree:
     digests = root.digests_pack
+    leaf_data = _leaf_data(root, 2)
+    leaf_data[0] = b"\0" * len(leaf_data[0])
     digests[0] = MerkleTreeNode(
         MerkleTreeLeaf(leaf_data[0]), MerkleTreeLeaf(leaf_data[1])
     ).digest
-    digests_enc = [
-        crypt(digest, 2 * len(leaf_data_enc) + index, key)
-        for index, digest in enumerate(digests)
-    ]
-    return from_leaves(
-        [MerkleTreeLeaf(x) for x in leaf_data_enc]
-        + [MerkleTreeHashLeaf(x) for x in digests_enc]
-        + [MerkleTreeHashLeaf(B032)]
-    )
+    return _encode(leaf_data, digests, key)
 
 
-def decode(
-    root: MerkleTreeNode, key: bytes
-) -> Tuple[MerkleTreeNode, List[NodeDigestMismatchError]]:
+def _mismatch_offsets(leaf_level: bytes, expected: bytes) -> Iterator[int]:
+    # offsets of the claimed digests that do not match, in ascending order. The
+    # plaintext leaf level is checked against leaf_level, every other claimed
+    # digest against the hash of its two claimed children, which are all
+    # claimed digests but the root. Blocks are hashed lazily so callers that
+    # only want the first mismatch stop early.
+    block = MISMATCH_BLOCK_SIZE * DIGEST_SIZE
+    children = memoryview(expected)[:-DIGEST_SIZE]
+    for start in range(0, len(expected), block):
+        stop = min(start + block, len(expected))
+        if stop <= len(leaf_level):
+            actual = leaf_level[start:stop]
+        elif start >= len(leaf_level):
+            offset = 2 * (start - len(leaf_level))
+            actual = hash_pairs(children[offset : offset + 2 * (stop - start)])
+        else:
+            actual = leaf_level[start:] + hash_pairs(
+                children[: 2 * (stop - len(leaf_level))]
+            )
+        if actual == expected[start:stop]:
+            continue
+        for i in range(0, stop - start, DIGEST_SIZE):
+            if (
+                actual[i : i + DIGEST_SIZE]
+                != expected[start + i : start + i + DIGEST_SIZE]
+            ):
+                yield (start + i) // DIGEST_SIZE
+
+
+def decode_mismatches(
+    root: MerkleTree,
+    key: bytes,
+    mode: DecodeMode = DecodeMode.FULL,
+    profile: Optional[EncodingProfile] = None,
+) -> Tuple[Optional[FlatMerkleTree], List[DigestMismatch]]:
+    """Decode an encoded tree and report mismatches as compact records.
+
+    ``FIRST_ERROR`` and ``VERIFY_ONLY`` stop at the first mismatch, so at most
+    one record is returned. ``VERIFY_ONLY`` does not build the plaintext tree
+    and returns None in its place. Use ``mismatch_error`` to build the full
+    error object of a mismatch. If a profile is given, the data leaves have to
+    match it.
+    """
     leaf_bytes_enc = root.leaves
     if not math.log2(len(leaf_bytes_enc)).is_integer():
         raise ValueError("Merkle Tree must have 2^x leaves")
     if leaf_bytes_enc[-1] != B032:
         raise ValueError("The provided Merkle Tree does not appear to be encoded")
 
-    errors: List[NodeDigestMismatchError] = []
-    digest_start_index = int(len(leaf_bytes_enc) / 2)
-    node_index = 0
-    digest_index = digest_start_index
-    nodes: List[MerkleTreeNode] = [
-        MerkleTreeLeaf(crypt(leaf_bytes_enc[i].data, i, key))
-        for i in range(0, digest_start_index)
+    digest_start_index = len(leaf_bytes_enc) // 2
+    leaf_data_enc = [leaf.data for leaf in leaf_bytes_enc[:digest_start_index]]
+    if profile is not None:
+        profile.check([len(data) for data in leaf_data_enc])
+    leaf_data = split(crypt_all(leaf_data_enc, 0, key), map(len, leaf_data_enc))
+    decoded: Optional[FlatMerkleTree] = None
+    if mode is DecodeMode.VERIFY_ONLY:
+        # a single leaf has no leaf level digests to check
+        leaf_level = b""
+        if len(leaf_data) > 1:
+            leaf_level = hash_pairs(_leaf_digests(leaf_data))
+    else:
+        decoded = from_leaves([MerkleTreeLeaf(x) for x in leaf_data])
+        leaf_level = bytes(decoded.level(1)) if decoded.depth else b""
+
+    # digests claimed by the encoding, in the same bottom-up order as digests_pack
+    digests_enc = [leaf.data for leaf in leaf_bytes_enc[digest_start_index:-1]]
+    if any(len(digest) != DIGEST_SIZE for digest in digests_enc):
+        raise ValueError("Encoded digests must be 32 bytes long")
+    expected = crypt_all(digests_enc, len(leaf_bytes_enc), key)
+
+    offsets = _mismatch_offsets(leaf_level, expected)
+    if mode is not DecodeMode.FULL:
+        offsets = itertools.islice(offsets, 1)
+    mismatches = [
+        DigestMismatch(2 * offset, digest_start_index + offset) for offset in offsets
     ]
-    while len(nodes) > 1:
-        nodes_new = []
-        for i in range(0, len(nodes), 2):
-            node = MerkleTreeNode(nodes[i], nodes[i + 1])
-            expected_digest = crypt(
-                leaf_bytes_enc[digest_index].data,
-                digest_start_index + digest_index,
-                key,
-            )
+    return decoded, mismatches
+
+
+def verify(root: MerkleTree, key: bytes) -> bool:
+    return not decode_mismatches(root, key, DecodeMode.VERIFY_ONLY)[1]
+
 
-            if node_index < digest_start_index:
-                error_type: Type[NodeDigestMismatchError] = LeafDigestMismatchError
-                actual_digest = node.digest
-            else:
-                error_type = NodeDigestMismatchError
-                actual_digest = hashlib.sha256(
-                    encode_packed(
-                        ["bytes32", "bytes32"],
-                        [
-                            crypt(
-                                leaf_bytes_enc[node_index].data,
-                                digest_start_index + node_index,
-                                key,
-                            ),
-                            crypt(
-                                leaf_bytes_enc[node_index + 1].data,
-                                digest_start_index + node_index + 1,
-                                key,
-                            ),
-                        ],
-                    )
-                ).digest()
-
-            if expected_digest != actual_digest:
-                errors.append(
-                    error_type(
-                        in1=leaf_bytes_enc[node_index],
-                        in2=leaf_bytes_enc[node_index + 1],
-                        out=leaf_bytes_enc[digest_index],
-                        index_in=node_index,
-                        index_out=digest_index,
-                        expected_digest=expected_digest,
-                        actual_digest=actual_digest,
-                    )
-                )
-
-            node_index += 2
-            digest_index += 1
-            nodes_new.append(node)
-
-        nodes = nodes_new
-
-    return nodes[0], errors
+def mismatch_error(
+    root: MerkleTree, key: bytes, mismatch: DigestMismatch
+) -> NodeDigestMismatchError:
+    leaves = root.leaves
+    digest_start_index = len(leaves) // 2
+    in1, in2 = leaves[mismatch.index_in], leaves[mismatch.index_in + 1]
+    out = leaves[mismatch.index_out]
+
+    if mismatch.index_in < digest_start_index:
+        error_type: Type[NodeDigestMismatchError] = LeafDigestMismatchError
+        actual_digest = hash_pair(
+            hash_leaf(crypt(in1.data, mismatch.index_in, key)),
+            hash_leaf(crypt(in2.data, mismatch.index_in + 1, key)),
+        )
+    else:
+        # digests are encrypted with index digest_start_index + their position
+        error_type = NodeDigestMismatchError
+        actual_digest = hash_pair(
+            crypt(in1.data, digest_start_index + mismatch.index_in, key),
+            crypt(in2.data, digest_start_index + mismatch.index_in + 1, key),
+        )
+
+    return error_type(
+        in1=in1,
+        in2=in2,
+        out=out,
+        index_in=mismatch.index_in,
+        index_out=mismatch.index_out,
+        expected_digest=crypt(out.data, digest_start_index + mismatch.index_out, key),
+        actual_digest=actual_digest,
+    )
+
+
+def decode(
+    root: MerkleTree,
+    key: bytes,
+    mode: DecodeMode = DecodeMode.FULL,
+    profile: Optional[EncodingProfile] = None,
+) -> Tuple[Optional[FlatMerkleTree], List[NodeDigestMismatchError]]:
+    decoded, mismatches = decode_mismatches(root, key, mode, profile)
+    return decoded, [mismatch_error(root, key, mismatch) for mismatch in mismatches]
@@ -0,0 +1,302 @@
+"""Content-addressed cache of encodings and root hashes.
+
+Entries are keyed by a SHA-256 digest of the request content, so a retried
+encoding or a leaf set seen before is answered without building any Merkle
+tree. The first tier is a size bounded in-memory LRU, an optional second tier
+persists entries in a directory or in Redis.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple, Union
+
+from starlette.concurrency import run_in_threadpool
+from crypto_service.app.utils.merkle import MerkleTreeHashLeaf, MerkleTreeLeaf
+from crypto_service.app.utils.profile import DEFAULT_PROFILE, EncodingProfile, Padding
+
+
+ENCODING_CACHE_BYTES = 64 * 1024 * 1024
+DISK_CACHE_BYTES = 1024 * 1024 * 1024
+# cache keys are hex encoded SHA-256 digests
+KEY_LENGTH = 64
+
+# encoding vector and root hash
+Encoding = Tuple[List[bytes], bytes]
+
+
+def encoding_key(
+    data: bytes, key: bytes, profile: EncodingProfile = DEFAULT_PROFILE
+) -> str:
+    layout = "%s:%s:%s" % (
+        profile.leaf_size,
+        profile.slices_count,
+        Padding(profile.padding).value,
+    )
+    return hashlib.sha256(
+        b"encoding" + bytes([len(key)]) + key + layout.encode() + b"\0" + data
+    ).hexdigest()
+
+
+def root_key(leaves: List[MerkleTreeLeaf]) -> str:
+    digest = hashlib.sha256(b"root")
+    for leaf in leaves:
+        # hash leaves and data leaves with the same bytes have different digests
+        digest.update(b"h" if isinstance(leaf, MerkleTreeHashLeaf) else b"d")
+        digest.update(len(leaf.data).to_bytes(4, "big"))
+        digest.update(leaf.data)
+    return digest.hexdigest()
+
+
+def pack_encoding(encoding: Encoding) -> bytes:
+    # root || data leaf size || data leaves || 32 byte hash leaves
+    leaves, root = encoding
+    return root + len(leaves[0]).to_bytes(4, "big") + b"".join(leaves)
+
+
+def unpack_encoding(value: bytes) -> Encoding:
+    root, leaf_size = value[:32], int.from_bytes(value[32:36], "big")
+    body = value[36:]
+    leaf_count = len(body) // (leaf_size + 32)
+    data_size = leaf_count * leaf_size
+    leaves = [body[i : i + leaf_size] for i in range(0, data_size, leaf_size)]
+    leaves.extend(body[i : i + 32] for i in range(data_size, len(body), 32))
+    return leaves, root
+
+
+class MemoryTier(object):
+    def __init__(self, max_bytes: int = ENCODING_CACHE_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self._size = 0
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, cache_key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._entries.get(cache_key)
+            if value is not None:
+                self._entries.move_to_end(cache_key)
+            return value
+
+    def set(self, cache_key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(cache_key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[cache_key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskTier(object):
+    # Entries are evicted least recently used first once they take more than
+    # max_bytes. The order is rebuilt from the file times on startup, reads
+    # touch the files to keep it across restarts.
+    def __init__(self, directory: str, max_bytes: int = DISK_CACHE_BYTES) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        files = []
+        for entry in os.scandir(directory):
+            if entry.is_file() and len(entry.name) == KEY_LENGTH:
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        with self._lock:
+            for _, cache_key, size in sorted(files):
+                self._entries[cache_key] = size
+                self._size += size
+            self._evict()
+
+    def _path(self, cache_key: str) -> str:
+        return os.path.join(self.directory, cache_key)
+
+    async def get(self, cache_key: str) -> Optional[bytes]:
+        return await run_in_threadpool(self._read, cache_key)
+
+    async def set(self, cache_key: str, value: bytes) -> None:
+        await run_in_threadpool(self._write, cache_key, value)
+
+    async def close(self) -> None:
+        pass
+
+    def _read(self, cache_key: str) -> Optional[bytes]:
+        path = self._path(cache_key)
+        try:
+            with open(path, "rb") as file:
+                value = file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._size -= self._entries.pop(cache_key, 0)
+            return None
+
+        with self._lock:
+            # entries written by other processes are adopted on first read
+            if cache_key not in self._entries:
+                self._entries[cache_key] = len(value)
+                self._size += len(value)
+            self._entries.move_to_end(cache_key)
+            self._evict()
+        return value
+
+    def _write(self, cache_key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        # write to a temporary file first so readers never see partial entries
+        fd, path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(value)
+            os.replace(path, self._path(cache_key))
+        except BaseException:
+            os.unlink(path)
+            raise
+        with self._lock:
+            self._size -= self._entries.pop(cache_key, 0)
+            self._entries[cache_key] = len(value)
+            self._size += len(value)
+            self._evict()
+
+    def _evict(self) -> None:
+        # called with the lock held
+        while self._size > self.max_bytes:
+            cache_key, size = self._entries.popitem(last=False)
+            self._size -= size
+            try:
+                os.remove(self._path(cache_key))
+            except FileNotFoundError:
+                pass
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class RedisTier(object):
+    def __init__(self, url: str, ttl: int) -> None:
+        # redis is an optional dependency, only needed with FASTAPI_USE_REDIS
+        from redis import asyncio as aioredis
+
+        self.client = aioredis.Redis.from_url(url)
+        self.ttl = ttl
+
+    async def get(self, cache_key: str) -> Optional[bytes]:
+        return await self.client.get(cache_key)
+
+    async def set(self, cache_key: str, value: bytes) -> None:
+        await self.client.set(cache_key, value, ex=self.ttl or None)
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+class EncodingCache(object):
+    """Encoding cache utility.
+
+    Utility class holding the encoding cache tiers for whole FastAPI
+    application scope. Failures of the second tier are logged and treated as
+    cache misses, so an unreachable Redis never fails a request.
+
+    Attributes:
+        memory (MemoryTier): In-memory LRU tier.
+        store (DiskTier | RedisTier, optional): Second tier.
+
+    """
+
+    memory: MemoryTier = MemoryTier()
+    store: Optional[Union[DiskTier, RedisTier]] = None
+    log: logging.Logger = logging.getLogger(__name__)
+
+    @classmethod
+    async def configure(
+        cls,
+        max_bytes: int = ENCODING_CACHE_BYTES,
+        directory: Optional[str] = None,
+        redis_url: Optional[str] = None,
+        ttl: int = 0,
+        disk_bytes: int = DISK_CACHE_BYTES,
+    ) -> None:
+        """Set up the cache tiers, replacing the current ones.
+
+        Args:
+            max_bytes (int): Size limit of the in-memory tier, 0 disables it.
+            directory (typing.Optional[str]): Directory of the disk tier.
+            redis_url (typing.Optional[str]): URL of the Redis tier, takes
+                precedence over directory.
+            ttl (int): Expiry of Redis entries in seconds, 0 never expires.
+            disk_bytes (int): Size limit of the disk tier.
+
+        """
+        await cls.close()
+        cls.memory = MemoryTier(max_bytes)
+        if redis_url:
+            try:
+                cls.store = RedisTier(redis_url, ttl)
+            except ImportError:
+                cls.log.warning(
+                    "Redis cache tier skipped, the redis package is not installed."
+                )
+        elif directory:
+            cls.store = await run_in_threadpool(DiskTier, directory, disk_bytes)
+
+    @classmethod
+    async def close(cls) -> None:
+        """Drop the cache tiers."""
+        if cls.store is not None:
+            await cls.store.close()
+            cls.store = None
+        cls.memory.clear()
+
+    @classmethod
+    async def get(cls, cache_key: str) -> Optional[bytes]:
+        """Look up an entry, promoting second tier hits into memory.
+
+        Args:
+            cache_key (str): Key from encoding_key or root_key.
+
+        Returns:
+            The cached value or None.
+
+        """
+        value = cls.memory.get(cache_key)
+        if value is None and cls.store is not None:
+            try:
+                value = await cls.store.get(cache_key)
+            except Exception as error:
+                cls.log.warning("Encoding cache lookup failed: %s", error)
+            if value is not None:
+                cls.memory.set(cache_key, value)
+        return value
+
+    @classmethod
+    async def set(cls, cache_key: str, value: bytes) -> None:
+        """Store an entry in all tiers.
+
+        Args:
+            cache_key (str): Key from encoding_key or root_key.
+            value (bytes): Value to store.
+
+        """
+        cls.memory.set(cache_key, value)
+        if cls.store is not None:
+            try:
+                await cls.store.set(cache_key, value)
+            except Exception as error:
+                cls.log.warning("Encoding cache store failed: %s", error)
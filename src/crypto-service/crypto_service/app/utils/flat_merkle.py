@@ -0,0 +1,363 @@
+"""Array-backed Merkle tree.
+
+``FlatMerkleTree`` offers the read API of ``merkle.MerkleTreeNode`` (``leaves``,
+``digest``, ``digests_pack``, ``digests_dfs``, ``get_proof``) but stores the
+digests of all levels in one contiguous buffer, bottom level first. Every node
+is hashed exactly once while the tree is built.
+
+Large trees can be built in parallel: the lower levels are split into perfect
+subtrees which are hashed in a process pool, then the subtree levels are
+copied into place and the remaining top levels are hashed serially. Use
+``configure_parallelism`` to set the worker count and the leaf count below
+which trees are always built serially. The pool is created on first use,
+usually from a thread of the request executor, so workers are started by a
+fork server (spawned where that is not available) rather than forked from the
+threaded server process. Workers select the hash backend that was active when
+the pool was created, so configure the backend before building trees.
+"""
+import math
+import multiprocessing
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+from crypto_service.app.utils.hashing import (
+    configure_worker_backend,
+    get_backend_name,
+    hash_many,
+    zero_subtree_digest,
+)
+from crypto_service.app.utils.merkle import (
+    MerkleTreeLeaf,
+    MerkleTreeNode,
+    leaf_digests_pack,
+    padded_depth,
+)
+from crypto_service.app.utils.profile import EncodingProfile
+
+
+DIGEST_SIZE = 32
+
+# (level, index, digest) of every node a verifier cannot derive by itself
+MultiProof = List[Tuple[int, int, bytes]]
+
+PARALLEL_WORKERS = 1
+PARALLEL_THRESHOLD = 2**14
+
+_pool: Optional[Executor] = None
+_pool_lock = threading.Lock()
+
+
+def configure_parallelism(workers: int, threshold: int = PARALLEL_THRESHOLD) -> None:
+    global PARALLEL_WORKERS, PARALLEL_THRESHOLD
+    if workers < 1:
+        raise ValueError("workers must be >= 1")
+    shutdown_pool()
+    PARALLEL_WORKERS = workers
+    PARALLEL_THRESHOLD = threshold
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+def mp_context() -> multiprocessing.context.BaseContext:
+    # forking a process with running threads can copy locks held by them
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def _get_pool() -> Executor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=PARALLEL_WORKERS,
+                mp_context=mp_context(),
+                initializer=configure_worker_backend,
+                initargs=(get_backend_name(),),
+            )
+        return _pool
+
+
+def _hash_level(src: memoryview, dst: memoryview) -> None:
+    dst[:] = hash_many(src[: 2 * len(dst)])
+
+
+def _hash_subtree(leaf_digests: bytes) -> bytes:
+    # all inner levels of the perfect subtree above leaf_digests, bottom-up
+    count = len(leaf_digests) // DIGEST_SIZE
+    levels = bytearray((count - 1) * DIGEST_SIZE)
+    src = memoryview(leaf_digests)
+    start = 0
+    while count > 1:
+        count //= 2
+        dst = memoryview(levels)[start : start + count * DIGEST_SIZE]
+        _hash_level(src, dst)
+        src = dst
+        start += count * DIGEST_SIZE
+    return bytes(levels)
+
+
+class FlatMerkleTree(object):
+    def __init__(
+        self,
+        leaves: Sequence[MerkleTreeLeaf],
+        workers: Optional[int] = None,
+        threshold: Optional[int] = None,
+        size: Optional[int] = None,
+    ) -> None:
+        # leaves beyond the given ones up to size (by default the next power
+        # of 2) are zero leaves like the last leaf, only their digests are kept
+        self._depth = padded_depth(len(leaves), size)
+        self._leaves = list(leaves)
+        self._size = 1 << self._depth
+        # node offset of every level, level 0 are the leaf digests
+        self._offsets = [0]
+        for level in range(self._depth):
+            self._offsets.append(self._offsets[-1] + (self._size >> level))
+        self._buffer = bytearray(DIGEST_SIZE * (2 * self._size - 1))
+
+        self._buffer[: len(self._leaves) * DIGEST_SIZE] = leaf_digests_pack(
+            self._leaves
+        )
+        self._pad(0)
+
+        workers = PARALLEL_WORKERS if workers is None else workers
+        threshold = PARALLEL_THRESHOLD if threshold is None else threshold
+        if workers > 1 and len(leaves) >= max(threshold, 2):
+            self._build_parallel(workers)
+        else:
+            self._build_serial(0)
+
+    def _real_count(self, level: int) -> int:
+        # nodes of level with at least one given leaf below them
+        return -(-len(self._leaves) >> level)
+
+    def _pad(self, level: int) -> None:
+        # fill in the digests of the zero subtrees of level without hashing
+        count = self._real_count(level)
+        if count < self._size >> level:
+            leaf_digest = self._leaves[-1].padding_digest()
+            digest = zero_subtree_digest(leaf_digest, level)
+            self.level(level)[count * DIGEST_SIZE :] = digest * (
+                (self._size >> level) - count
+            )
+
+    def _build_serial(self, first_level: int) -> None:
+        for level in range(first_level, self._depth):
+            count = self._real_count(level + 1)
+            target = self.level(level + 1)[: count * DIGEST_SIZE]
+            _hash_level(self.level(level), target)
+            self._pad(level + 1)
+
+    def _build_parallel(self, workers: int) -> None:
+        # split into a power of two number of subtrees, at least one per worker
+        subtrees = min(1 << math.ceil(math.log2(workers)), self._size)
+        height = self._depth - int(math.log2(subtrees))
+        size = self._size // subtrees * DIGEST_SIZE
+        # subtrees holding only padding are filled in by _pad
+        leaf_digests = self.level(0)[: self._real_count(height) * size]
+        chunks = [
+            bytes(leaf_digests[i : i + size]) for i in range(0, len(leaf_digests), size)
+        ]
+
+        for subtree, levels in enumerate(_get_pool().map(_hash_subtree, chunks)):
+            start = 0
+            for level in range(1, height + 1):
+                width = size >> level
+                target = self.level(level)
+                target[subtree * width : (subtree + 1) * width] = levels[
+                    start : start + width
+                ]
+                start += width
+        for level in range(1, height + 1):
+            self._pad(level)
+
+        self._build_serial(height)
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    @property
+    def leaves(self) -> List[MerkleTreeLeaf]:
+        return list(self._leaves)
+
+    def level(self, level: int) -> memoryview:
+        if not 0 <= level <= self._depth:
+            raise IndexError("Level out of range")
+        start = self._offsets[level] * DIGEST_SIZE
+        end = start + (self._size >> level) * DIGEST_SIZE
+        return memoryview(self._buffer)[start:end]
+
+    def node_digest(self, level: int, index: int) -> bytes:
+        if not 0 <= index < self._size >> level:
+            raise IndexError("Node index out of range")
+        start = (self._offsets[level] + index) * DIGEST_SIZE
+        return bytes(self._buffer[start : start + DIGEST_SIZE])
+
+    @property
+    def digest(self) -> bytes:
+        return bytes(self._buffer[-DIGEST_SIZE:])
+
+    @property
+    def digests_dfs(self) -> List[bytes]:
+        digests: List[bytes] = []
+        if self._depth == 0:
+            return digests
+        # post-order walk over (level, index) pairs of the inner nodes
+        stack = [(self._depth, 0, False)]
+        while stack:
+            level, index, visited = stack.pop()
+            if visited or level == 1:
+                digests.append(self.node_digest(level, index))
+                continue
+            stack.append((level, index, True))
+            stack.append((level - 1, 2 * index + 1, False))
+            stack.append((level - 1, 2 * index, False))
+        return digests
+
+    @property
+    def digests_pack(self) -> List[bytes]:
+        start = self._size * DIGEST_SIZE
+        return [
+            bytes(self._buffer[i : i + DIGEST_SIZE])
+            for i in range(start, len(self._buffer), DIGEST_SIZE)
+        ]
+
+    def get_proof(self, node: MerkleTreeLeaf) -> List[bytes]:
+        for index, leaf in enumerate(self._leaves):
+            if leaf == node:
+                return self.get_proof_by_index(index)
+        raise ValueError("Node is not part of this tree")
+
+    def get_proof_by_index(self, index: int) -> List[bytes]:
+        if not 0 <= index < len(self._leaves):
+            raise IndexError("Leaf index out of range")
+        proof = [
+            self.node_digest(level, (index >> level) ^ 1)
+            for level in range(self._depth)
+        ]
+        proof.reverse()
+        return proof
+
+    def get_multiproof(self, indices: Iterable[int]) -> MultiProof:
+        return get_multiproof(self.node_digest, self._size, indices)
+
+    validate_proof = staticmethod(MerkleTreeNode.validate_proof)
+    validate_proofs = staticmethod(MerkleTreeNode.validate_proofs)
+
+    @staticmethod
+    def validate_multiproof(
+        root_digest: bytes,
+        nodes: Mapping[int, MerkleTreeNode],
+        proof: MultiProof,
+        depth: int,
+    ) -> bool:
+        if not nodes:
+            return False
+        siblings: Dict[Tuple[int, int], bytes] = {
+            (level, index): digest for level, index, digest in proof
+        }
+        packed = leaf_digests_pack(list(nodes.values()))
+        digests = {
+            index: packed[i * DIGEST_SIZE : (i + 1) * DIGEST_SIZE]
+            for i, index in enumerate(nodes)
+        }
+        if len(packed) != len(digests) * DIGEST_SIZE:
+            return False
+        for level in range(depth):
+            # the pairs of a level are hashed in one batch
+            parents: List[int] = []
+            pairs: List[bytes] = []
+            for index in sorted(digests):
+                if parents and parents[-1] == index >> 1:
+                    continue
+                for i in (index & ~1, index | 1):
+                    digest = digests.get(i, siblings.get((level, i)))
+                    if digest is None or len(digest) != DIGEST_SIZE:
+                        return False
+                    pairs.append(digest)
+                parents.append(index >> 1)
+            hashed = hash_many(b"".join(pairs))
+            digests = {
+                parent: hashed[i * DIGEST_SIZE : (i + 1) * DIGEST_SIZE]
+                for i, parent in enumerate(parents)
+            }
+        return digests == {0: root_digest}
+
+    def __repr__(self) -> str:
+        return "<%s.%s %s>" % (__name__, FlatMerkleTree.__name__, self.digest.hex())
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, (FlatMerkleTree, MerkleTreeNode)):
+            return self.digest == other.digest
+        else:
+            return NotImplemented
+
+    def __ne__(self, other: Any) -> bool:
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+
+MerkleTree = Union[MerkleTreeNode, FlatMerkleTree]
+
+
+def get_multiproof(
+    node_digest: Callable[[int, int], bytes], leaf_count: int, indices: Iterable[int]
+) -> MultiProof:
+    # shared by all trees offering node_digest(level, index)
+    known: Set[int] = set(indices)
+    if not all(0 <= index < leaf_count for index in known):
+        raise IndexError("Leaf index out of range")
+    proof: MultiProof = []
+    for level in range(leaf_count.bit_length() - 1):
+        for index in sorted(known):
+            if index ^ 1 not in known:
+                proof.append((level, index ^ 1, node_digest(level, index ^ 1)))
+        known = {index >> 1 for index in known}
+    return proof
+
+
+def from_leaves(
+    leaves: List[MerkleTreeLeaf],
+    workers: Optional[int] = None,
+    threshold: Optional[int] = None,
+    size: Optional[int] = None,
+) -> FlatMerkleTree:
+    return FlatMerkleTree(leaves, workers=workers, threshold=threshold, size=size)
+
+
+def from_bytes(
+    data: bytes, slices_count: int = 2, profile: Optional[EncodingProfile] = None
+) -> FlatMerkleTree:
+    # the profile takes precedence over slices_count, full leaves are views
+    # into data instead of copies of their slices
+    if profile is None:
+        profile = EncodingProfile(slices_count=slices_count)
+    size, _ = profile.layout(len(data))
+    return from_leaves(
+        [MerkleTreeLeaf(leaf) for leaf in profile.split(data)], size=size
+    )
+
+
+def from_list(items: List[bytes]) -> FlatMerkleTree:
+    return from_leaves([MerkleTreeLeaf(item) for item in items])
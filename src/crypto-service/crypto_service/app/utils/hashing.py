@@ -0,0 +1,330 @@
+"""Fast-path SHA-256 hashing for fixed-width values.
+
+For ``bytes32`` values ``eth_abi.packed.encode_packed`` is a plain
+concatenation, so the digests below are byte-identical to the ABI based
+implementation without going through the ABI machinery or web3.
+
+Hashing many independent messages of the same size, like the nodes of a tree
+level, the leaves of a tree or the pads of a keystream, goes through
+``hash_many``. It is served by a pluggable backend, hashlib by default. The
+``threads`` provider hashes large messages on several threads, the
+``processes`` provider spreads large batches of small messages like tree
+levels and keystream blocks over worker processes. Other providers can be
+registered with ``register_backend``, the backend is picked at startup with
+``configure_backend``.
+"""
+import functools
+import hashlib
+import importlib
+import itertools
+import logging
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence
+
+
+DIGEST_SIZE = 32
+
+log = logging.getLogger(__name__)
+
+
+class HashBackend(object):
+    """SHA-256 of many messages of equal size in one call.
+
+    The default implementation hashes the messages one by one with hashlib,
+    which uses the SHA extensions of the CPU where OpenSSL supports them.
+    Providers override hash_many and hash_each, the name is used in log
+    messages. Providers holding pools release them in close.
+
+    """
+
+    name = "hashlib"
+
+    def hash_many(self, messages: bytes, size: int = 2 * DIGEST_SIZE) -> bytes:
+        """Hash every size bytes of messages.
+
+        Args:
+            messages (bytes): Concatenated messages of size bytes each.
+            size (int): Size of a message in bytes.
+
+        Returns:
+            The concatenated 32 byte digests of the messages.
+
+        """
+        sha256 = hashlib.sha256
+        view = memoryview(messages)
+        return b"".join(
+            [sha256(view[i : i + size]).digest() for i in range(0, len(view), size)]
+        )
+
+    def hash_each(self, messages: Sequence[bytes]) -> bytes:
+        """Hash every message of a list without concatenating them.
+
+        Args:
+            messages (Sequence[bytes]): Messages of equal size.
+
+        Returns:
+            The concatenated 32 byte digests of the messages.
+
+        """
+        sha256 = hashlib.sha256
+        return b"".join([sha256(message).digest() for message in messages])
+
+    def close(self) -> None:
+        pass
+
+
+def _hash_serial(messages: bytes, size: int) -> bytes:
+    # task of the processes provider, workers hash with the default backend
+    return HashBackend().hash_many(messages, size)
+
+
+class PoolHashBackend(HashBackend):
+    # base of the providers spreading work over a pool created on first use
+    def __init__(self, workers: Optional[int] = None) -> None:
+        self._workers = workers or os.cpu_count() or 1
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+
+    def _create_executor(self) -> Executor:
+        raise NotImplementedError
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._create_executor()
+            return self._executor
+
+    def close(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+class ThreadedHashBackend(PoolHashBackend):
+    """SHA-256 of many messages spread over threads.
+
+    hashlib releases the GIL while hashing messages larger than 2 KiB, so
+    large leaves are hashed in parallel. Smaller messages are hashed on the
+    calling thread as by the default backend, use ProcessHashBackend for them.
+
+    """
+
+    name = "threads"
+    min_size = 2048
+
+    def _create_executor(self) -> Executor:
+        return ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="hash")
+
+    def hash_each(self, messages: Sequence[bytes]) -> bytes:
+        serial = super(ThreadedHashBackend, self).hash_each
+        if self._workers < 2 or len(messages) < 2 or len(messages[0]) < self.min_size:
+            return serial(messages)
+
+        chunk_size = -(-len(messages) // self._workers)
+        chunks = [
+            messages[i : i + chunk_size] for i in range(0, len(messages), chunk_size)
+        ]
+        return b"".join(self._get_executor().map(serial, chunks))
+
+
+class ProcessHashBackend(PoolHashBackend):
+    """SHA-256 of large batches spread over worker processes.
+
+    hashlib keeps the GIL for small messages, so tree levels and keystream
+    blocks of 64 byte messages are only hashed in parallel by processes.
+    Batches of at least min_bytes are split into one chunk per worker, smaller
+    ones are hashed on the calling thread. Inside pool workers of the
+    application, which are parallel already, every batch is hashed serially.
+
+    """
+
+    name = "processes"
+    min_bytes = 256 * 1024
+
+    def _create_executor(self) -> Executor:
+        # imported here, flat_merkle depends on this module
+        from crypto_service.app.utils.flat_merkle import mp_context
+
+        return ProcessPoolExecutor(max_workers=self._workers, mp_context=mp_context())
+
+    def hash_many(self, messages: bytes, size: int = 2 * DIGEST_SIZE) -> bytes:
+        if self._workers < 2 or len(messages) < self.min_bytes or _pool_worker:
+            return super(ProcessHashBackend, self).hash_many(messages, size)
+
+        chunk_size = -(-len(messages) // size // self._workers) * size
+        view = memoryview(messages)
+        # memoryviews cannot be pickled, every chunk is copied once
+        chunks = [
+            bytes(view[i : i + chunk_size]) for i in range(0, len(view), chunk_size)
+        ]
+        executor = self._get_executor()
+        return b"".join(executor.map(_hash_serial, chunks, itertools.repeat(size)))
+
+
+_providers: Dict[str, Callable[[], HashBackend]] = {
+    "hashlib": HashBackend,
+    "threads": ThreadedHashBackend,
+    "processes": ProcessHashBackend,
+}
+_backend = HashBackend()
+_backend_name = "hashlib"
+# set in worker processes of the application pools
+_pool_worker = False
+
+
+def register_backend(name: str, factory: Callable[[], HashBackend]) -> None:
+    _providers[name] = factory
+
+
+def get_backend() -> HashBackend:
+    return _backend
+
+
+def get_backend_name() -> str:
+    # name the active backend was configured with
+    return _backend_name
+
+
+def configure_backend(name: str = "hashlib") -> HashBackend:
+    """Select the backend of hash_many.
+
+    Args:
+        name (str): Name of a registered provider or ``module:attribute`` of a
+            provider factory, which is imported first.
+
+    Returns:
+        The selected backend. Providers that cannot be loaded or do not hash
+        like hashlib are skipped in favour of the hashlib backend. The pools of
+        the previous backend are shut down.
+
+    Raises:
+        ValueError: If the provider is unknown.
+
+    """
+    global _backend, _backend_name
+    factory = _providers.get(name)
+    if factory is None and ":" in name:
+        module, _, attribute = name.partition(":")
+        try:
+            factory = getattr(importlib.import_module(module), attribute)
+        except (ImportError, AttributeError):
+            log.warning("Hash backend %s is not installed, using hashlib.", name)
+            factory = HashBackend
+    if factory is None:
+        raise ValueError("Unknown hash backend %s" % name)
+
+    backend = factory()
+    probe = bytes(range(128))
+    expected = hashlib.sha256(probe[:64]).digest() + hashlib.sha256(probe[64:]).digest()
+    if (
+        backend.hash_many(probe) != expected
+        or backend.hash_each([probe[:64], probe[64:]]) != expected
+    ):
+        log.warning("Hash backend %s hashes incorrectly, using hashlib.", name)
+        backend.close()
+        backend = HashBackend()
+    previous, _backend, _backend_name = _backend, backend, name
+    if previous is not backend:
+        previous.close()
+    return backend
+
+
+def configure_worker_backend(name: str) -> HashBackend:
+    """Select the backend in a worker process of an application pool.
+
+    The processes provider hashes serially in such workers, so pools are not
+    started from within pools.
+
+    Args:
+        name (str): Name the backend of the application was configured with.
+
+    Returns:
+        The selected backend.
+
+    """
+    global _pool_worker
+    _pool_worker = True
+    return configure_backend(name)
+
+
+def shutdown_backend() -> None:
+    # release the pools of the active backend, they are created again on use
+    _backend.close()
+
+
+def hash_many(messages: bytes, size: int = 2 * DIGEST_SIZE) -> bytes:
+    # sha256 of every size bytes of messages, concatenated
+    if size <= 0 or len(messages) % size != 0:
+        raise ValueError("messages must hold a whole number of messages of size bytes")
+    return _backend.hash_many(messages, size)
+
+
+def _bytes32(value: bytes) -> bytes:
+    if len(value) == DIGEST_SIZE:
+        return value
+    if len(value) > DIGEST_SIZE:
+        raise ValueError("bytes32 value must not be longer than 32 bytes")
+    # encode_packed right pads shorter bytes32 values with zeros
+    return bytes(value).ljust(DIGEST_SIZE, b"\x00")
+
+
+def hash_pair(left: bytes, right: bytes) -> bytes:
+    # sha256(encode_packed(["bytes32", "bytes32"], [left, right]))
+    return hashlib.sha256(b"".join((_bytes32(left), _bytes32(right)))).digest()
+
+
+def hash_leaf(data: bytes) -> bytes:
+    # sha256(encode_packed(["bytes[n]"], [32 byte slices of data])), a trailing
+    # partial slice is not part of the list and therefore not hashed
+    remainder = len(data) % DIGEST_SIZE
+    if remainder:
+        data = data[:-remainder]
+    return hashlib.sha256(data).digest()
+
+
+def hash_leaves(leaves: Sequence[bytes]) -> bytes:
+    # hash_leaf of every leaf, concatenated, consecutive leaves of the same
+    # hashed size go to the backend in one call
+    digests: List[bytes] = []
+    for length, run in itertools.groupby(leaves, len):
+        messages = list(run)
+        size = length - length % DIGEST_SIZE
+        if size != length:
+            messages = [memoryview(data)[:size] for data in messages]
+        digests.append(_backend.hash_each(messages))
+    return b"".join(digests)
+
+
+def hash_pairs(digests: bytes) -> bytes:
+    # hash_pair of every two consecutive 32 byte digests, concatenated
+    if len(digests) % (2 * DIGEST_SIZE) != 0:
+        raise ValueError("digests must hold an even number of 32 byte digests")
+    return hash_many(digests)
+
+
+# zero bytes hashed block by block, so zero leaves are never allocated
+_ZERO_BLOCK = bytes(64 * 1024)
+
+
+@functools.lru_cache(maxsize=64)
+def zero_leaf_digest(size: int) -> bytes:
+    # hash_leaf(bytes(size))
+    digest = hashlib.sha256()
+    remaining = size - size % DIGEST_SIZE
+    while remaining:
+        chunk = min(remaining, len(_ZERO_BLOCK))
+        digest.update(memoryview(_ZERO_BLOCK)[:chunk])
+        remaining -= chunk
+    return digest.digest()
+
+
+@functools.lru_cache(maxsize=1024)
+def zero_subtree_digest(leaf_digest: bytes, height: int) -> bytes:
+    # root of a perfect subtree of 2^height leaves that all have leaf_digest
+    if height == 0:
+        return leaf_digest
+    child = zero_subtree_digest(leaf_digest, height - 1)
+    return hash_pair(child, child)
@@ -0,0 +1,90 @@
+"""Keystream derivation for the FairSwap encoding.
+
+The pad of element ``index`` is ``sha256(uint256(index) || bytes32(key))``,
+which is what ``encode_packed(["uint256", "bytes32"], [index, key])`` produces.
+Pads for a whole index range are derived in one loop and kept in a size bounded
+LRU cache, so repeated requests for the same key and range skip derivation.
+"""
+import threading
+from collections import OrderedDict
+from typing import Tuple
+
+from crypto_service.app.utils.hashing import hash_many
+
+
+PAD_SIZE = 32
+KEYSTREAM_CACHE_BYTES = 64 * 1024 * 1024
+# pads derived per hash_many call, bounds the size of the message buffer
+DERIVE_BLOCK_SIZE = 4096
+
+
+def _packed_key(key: bytes) -> bytes:
+    if len(key) > 32:
+        raise ValueError("key must not be longer than 32 bytes")
+    # bytes32 values are right padded with zeros
+    return key.ljust(32, b"\x00")
+
+
+def pad(index: int, key: bytes) -> bytes:
+    return hash_many(index.to_bytes(32, "big") + _packed_key(key))
+
+
+def derive(key: bytes, start: int, stop: int) -> bytes:
+    if start < 0 or stop < start:
+        raise ValueError("Invalid index range")
+    key = _packed_key(key)
+    return b"".join(
+        hash_many(
+            b"".join(
+                [
+                    index.to_bytes(32, "big") + key
+                    for index in range(block, min(block + DERIVE_BLOCK_SIZE, stop))
+                ]
+            )
+        )
+        for block in range(start, stop, DERIVE_BLOCK_SIZE)
+    )
+
+
+class KeystreamCache(object):
+    def __init__(self, max_bytes: int = KEYSTREAM_CACHE_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self._size = 0
+        self._entries: "OrderedDict[Tuple[bytes, int, int], bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: bytes, start: int, stop: int) -> bytes:
+        cache_key = (key, start, stop)
+        with self._lock:
+            if cache_key in self._entries:
+                self._entries.move_to_end(cache_key)
+                return self._entries[cache_key]
+
+        keystream = derive(key, start, stop)
+        if len(keystream) > self.max_bytes:
+            return keystream
+
+        with self._lock:
+            if cache_key not in self._entries:
+                self._entries[cache_key] = keystream
+                self._size += len(keystream)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+        return keystream
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+cache = KeystreamCache()
+
+
+def keystream(key: bytes, start: int, stop: int) -> bytes:
+    """Return the concatenated pads of all indices in [start, stop)."""
+    return cache.get(key, start, stop)
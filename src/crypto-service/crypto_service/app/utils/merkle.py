@@ -17,73 +17,131 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
 import itertools
 import math
-from typing import Any, List, Tuple
-from eth_abi.packed import encode_packed
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
 import hashlib
-from web3 import Web3
+from crypto_service.app.utils.hashing import (
+    DIGEST_SIZE,
+    hash_leaf,
+    hash_leaves,
+    hash_pair,
+    zero_leaf_digest,
+    zero_subtree_digest,
+)
+from crypto_service.app.utils.profile import EncodingProfile
 
 
 class MerkleTreeNode(object):
+    # trees have a node per leaf and per inner node, slots keep them small
+    __slots__ = ("_children", "_parents", "_digest", "_leaves", "__weakref__")
+
     def __init__(self, *children: "MerkleTreeNode") -> None:
         if len(children) > 2:
             raise ValueError("Cannot have more than two children")
-        self._children = list(children)
+        self._children = children
+        # parents are weakly referenced, so trees are not reference cycles
+        self._parents: Tuple["weakref.ref[MerkleTreeNode]", ...] = ()
+        self._digest: Optional[bytes] = None
+        # leaves below this node, collected on first access
+        self._leaves: Optional[Tuple["MerkleTreeLeaf", ...]] = None
+        for child in children:
+            child._add_parent(self)
+
+    def _add_parent(self, parent: "MerkleTreeNode") -> None:
+        self._parents += (weakref.ref(parent),)
 
     @property
-    def children(self) -> List["MerkleTreeNode"]:
+    def children(self) -> Tuple["MerkleTreeNode", ...]:
         return self._children
 
     @property
     def leaves(self) -> List["MerkleTreeLeaf"]:
-        return list(itertools.chain.from_iterable([c.leaves for c in self.children]))
+        if self._leaves is None:
+            self._leaves = tuple(self.iter_leaves())
+        return list(self._leaves)
+
+    def iter_leaves(self) -> Iterator["MerkleTreeLeaf"]:
+        # left to right, reusing the leaves already collected by subtrees but
+        # without caching them there, which would take n log n references
+        stack: List[MerkleTreeNode] = [self]
+        while stack:
+            node = stack.pop()
+            if node._leaves is not None:
+                yield from node._leaves
+            elif isinstance(node, MerkleTreeLeaf):
+                yield node
+            else:
+                stack.extend(reversed(node.children))
+
+    def invalidate(self) -> None:
+        # A cached digest implies cached digests below it, so the walk up can
+        # stop at the first node that has nothing cached.
+        stack: List[MerkleTreeNode] = [self]
+        while stack:
+            node = stack.pop()
+            if node._digest is None:
+                continue
+            node._digest = None
+            for ref in node._parents:
+                parent = ref()
+                if parent is not None:
+                    stack.append(parent)
 
     @property
     def digest(self) -> bytes:
-        keccak_inputs: List[Tuple[str, bytes]] = []
-        for child in self.children:
-            keccak_inputs.append(("bytes32", child.digest))
-        _, args = zip(*keccak_inputs)
-        return hashlib.sha256(
-            encode_packed(
-                ["bytes32", "bytes32"],
-                [
-                    Web3.toBytes(hexstr=args[0].hex()),
-                    Web3.toBytes(hexstr=args[1].hex()),
-                ],
-            )
-        ).digest()
+        if self._digest is None:
+            self._digest = self._compute_digest()
+        return self._digest
+
+    def _compute_digest(self) -> bytes:
+        return hash_pair(self.children[0].digest, self.children[1].digest)
 
     @property
     def digests_dfs(self) -> List[bytes]:
-        return list(
-            itertools.chain.from_iterable([c.digests_dfs for c in self.children])
-        ) + [self.digest]
+        return list(self.iter_digests_dfs())
+
+    def iter_digests_dfs(self) -> Iterator[bytes]:
+        # inner nodes in post-order, a node is yielded once both children were,
+        # so every digest is computed from memoized child digests
+        stack: List[Tuple[MerkleTreeNode, bool]] = [(self, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if not node.children:
+                continue
+            if expanded:
+                yield node.digest
+            else:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(node.children))
 
     @property
     def digests_pack(self) -> List[bytes]:
-        return [
-            digest
-            for digest, level in sorted(
-                self._digests_pack(0), key=lambda d: d[1], reverse=True
-            )
-        ]
+        # inner nodes grouped by depth, each level ordered from left to right
+        levels: List[List[MerkleTreeNode]] = []
+        level: List[MerkleTreeNode] = [self]
+        while level:
+            levels.append([node for node in level if node.children])
+            level = [child for node in level for child in node.children]
 
-    def _digests_pack(self, level: int) -> List[Tuple[bytes, int]]:
-        return list(
-            itertools.chain.from_iterable(
-                [c._digests_pack(level + 1) for c in self.children]
-            )
-        ) + [(self.digest, level)]
+        # walking the levels bottom-up lets every digest reuse its children's
+        return [node.digest for level in reversed(levels) for node in level]
 
     def has_indirect_child(self, node: "MerkleTreeNode") -> bool:
-        if node in self.children:
-            return True
-
-        for child in self.children:
-            if child.has_indirect_child(node):
+        # zero subtrees hold no leaves of their own and are not searched
+        stack: List[MerkleTreeNode] = [self]
+        while stack:
+            parent = stack.pop()
+            if node in parent.children:
                 return True
+            stack.extend(
+                child
+                for child in parent.children
+                if not isinstance(child, MerkleTreeZeroNode)
+            )
 
         return False
 
@@ -100,25 +158,51 @@ class MerkleTreeNode(object):
         else:
             raise ValueError("Node is not part of this tree")
 
+    def get_proof_by_index(self, index: int) -> List[bytes]:
+        # trees built by from_leaves are perfect, the leftmost path gives the depth
+        depth = 0
+        node = self
+        while node.children:
+            node = node.children[0]
+            depth += 1
+        if not 0 <= index < 1 << depth:
+            raise IndexError("Leaf index out of range")
+
+        proof: List[bytes] = []
+        node = self
+        for level in reversed(range(depth)):
+            bit = (index >> level) & 1
+            proof.append(node.children[1 - bit].digest)
+            node = node.children[bit]
+            # real leaves come first, a zero subtree only holds padding slots
+            if isinstance(node, MerkleTreeZeroNode):
+                raise IndexError("Leaf index out of range")
+        return proof
+
     @staticmethod
     def validate_proof(
         root_digest: bytes, node: "MerkleTreeNode", index: int, proof: List[bytes]
     ) -> bool:
-        tmp_digest = node.digest
-        for i in range(len(proof)):
-            if (index & 1 << i) >> i == 1:
-                tmp_digest = hashlib.sha256(
-                    encode_packed(
-                        ["bytes32", "bytes32"], [proof[len(proof) - i - 1], tmp_digest]
-                    )
-                ).digest()
-            else:
-                tmp_digest = hashlib.sha256(
-                    encode_packed(
-                        ["bytes32", "bytes32"], [tmp_digest, proof[len(proof) - i - 1]]
-                    )
-                ).digest()
-        return tmp_digest == root_digest
+        return _fold_proof(node.digest, index, proof, bytearray(64)) == root_digest
+
+    @staticmethod
+    def validate_proofs(
+        root_digest: bytes,
+        proofs: Sequence[Tuple["MerkleTreeNode", int, List[bytes]]],
+        workers: int = 1,
+    ) -> List[bool]:
+        if workers <= 1 or len(proofs) < 2:
+            return _validate_proofs_chunk(root_digest, proofs)
+
+        # Every chunk gets its own scratch buffer. hashlib only drops the GIL
+        # for large inputs, so threads pay off when leaves carry a lot of data.
+        chunk_size = math.ceil(len(proofs) / workers)
+        chunks = [proofs[i : i + chunk_size] for i in range(0, len(proofs), chunk_size)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                _validate_proofs_chunk, itertools.repeat(root_digest), chunks
+            )
+        return list(itertools.chain.from_iterable(results))
 
     def __repr__(self) -> str:
         return "<%s.%s %s>" % (__name__, MerkleTreeNode.__name__, self.digest.hex())
@@ -134,19 +218,21 @@ class MerkleTreeNode(object):
 
 
 class MerkleTreeLeaf(MerkleTreeNode):
+    __slots__ = ("_data",)
+
+    # data may be a memoryview into a buffer shared with other leaves
     def __init__(self, data: bytes) -> None:
         super(MerkleTreeLeaf, self).__init__()
         if (len(data) % 32) != 0:
             raise ValueError("data length has to be a multiple of 32")
         self._data = data
 
-    @property
-    def digest(self) -> bytes:
-        data_as_list = self.data_as_list()
-        # noinspection PyCallByClass
-        return hashlib.sha256(
-            encode_packed(["bytes[%d]" % len(data_as_list)], [data_as_list])
-        ).digest()
+    def _compute_digest(self) -> bytes:
+        return hash_leaf(self.data)
+
+    def padding_digest(self) -> bytes:
+        # digest of a leaf like this one holding only zero bytes
+        return zero_leaf_digest(len(self.data))
 
     @property
     def data(self) -> bytes:
@@ -155,6 +241,7 @@ class MerkleTreeLeaf(MerkleTreeNode):
     @data.setter
     def data(self, data: bytes) -> None:
         self._data = data
+        self.invalidate()
 
     def data_as_list(self, slice_size: int = 32) -> List[bytes]:
         return [
@@ -174,11 +261,8 @@ class MerkleTreeLeaf(MerkleTreeNode):
     def digests_pack(self) -> List[bytes]:
         return []
 
-    def _digests_pack(self, level: int) -> List[Tuple[bytes, int]]:
-        return []
-
     def __repr__(self) -> str:
-        return "<%s.%s %s>" % (__name__, MerkleTreeLeaf.__name__, str(self.data))
+        return "<%s.%s %r>" % (__name__, MerkleTreeLeaf.__name__, bytes(self.data))
 
     def __eq__(self, other: Any) -> bool:
         if isinstance(other, MerkleTreeLeaf):
@@ -194,31 +278,140 @@ class MerkleTreeLeaf(MerkleTreeNode):
 
 
 class MerkleTreeHashLeaf(MerkleTreeLeaf):
+    __slots__ = ()
+
+    def _compute_digest(self) -> bytes:
+        return bytes(self.data)
+
+    def padding_digest(self) -> bytes:
+        return bytes(DIGEST_SIZE)
+
+
+class MerkleTreeZeroNode(MerkleTreeNode):
+    """Root of a subtree of padding leaves.
+
+    The digest is taken from the zero subtree cache and the children are
+    created on demand. Instances are shared, see zero_node.
+    """
+
+    __slots__ = ("_leaf_digest", "_height")
+
+    def __init__(self, leaf_digest: bytes, height: int) -> None:
+        super(MerkleTreeZeroNode, self).__init__()
+        self._leaf_digest = leaf_digest
+        self._height = height
+        self._digest = zero_subtree_digest(leaf_digest, height)
+        self._leaves = ()
+
+    def _add_parent(self, parent: MerkleTreeNode) -> None:
+        # the digest never changes, parents need not be invalidated
+        pass
+
+    def invalidate(self) -> None:
+        pass
+
     @property
-    def digest(self) -> bytes:
-        return self.data
+    def children(self) -> Tuple[MerkleTreeNode, ...]:
+        if self._height == 0:
+            return ()
+        child = zero_node(self._leaf_digest, self._height - 1)
+        return (child, child)
 
+    def has_indirect_child(self, node: MerkleTreeNode) -> bool:
+        return False
+
+
+@functools.lru_cache(maxsize=1024)
+def zero_node(leaf_digest: bytes, height: int) -> MerkleTreeZeroNode:
+    return MerkleTreeZeroNode(leaf_digest, height)
 
-def from_leaves(leaves: List[MerkleTreeLeaf]) -> MerkleTreeNode:
-    if len(leaves) == 0:
+
+def _fold_proof(
+    digest: bytes, index: int, proof: List[bytes], buffer: bytearray
+) -> bytes:
+    # buffer is a reusable 64 byte scratch area holding the pair to hash
+    view = memoryview(buffer)
+    for sibling in reversed(proof):
+        if len(sibling) != 32 or len(digest) != 32:
+            raise ValueError("Proof digests must be 32 bytes long")
+        if index & 1:
+            view[:32] = sibling
+            view[32:] = digest
+        else:
+            view[:32] = digest
+            view[32:] = sibling
+        digest = hashlib.sha256(buffer).digest()
+        index >>= 1
+    return digest
+
+
+def _validate_proofs_chunk(
+    root_digest: bytes, proofs: Sequence[Tuple[MerkleTreeNode, int, List[bytes]]]
+) -> List[bool]:
+    buffer = bytearray(64)
+    return [
+        _check_proof(root_digest, node.digest, index, proof, buffer)
+        for node, index, proof in proofs
+    ]
+
+
+def _check_proof(
+    root_digest: bytes, digest: bytes, index: int, proof: List[bytes], buffer: bytearray
+) -> bool:
+    # a malformed proof is invalid, it does not abort the rest of a batch
+    try:
+        return _fold_proof(digest, index, proof, buffer) == root_digest
+    except ValueError:
+        return False
+
+
+def leaf_digests_pack(leaves: Sequence[MerkleTreeNode]) -> bytes:
+    # digests of leaves, concatenated, data leaves are hashed in batches
+    data = [leaf._data for leaf in leaves if type(leaf) is MerkleTreeLeaf]
+    if len(data) == len(leaves):
+        return hash_leaves(data)
+    return b"".join([leaf.digest for leaf in leaves])
+
+
+def padded_depth(leaf_count: int, size: Optional[int] = None) -> int:
+    # depth of a tree of leaf_count leaves padded to size leaves
+    if leaf_count == 0:
         raise ValueError("Cannot create tree from empty list")
+    if size is None:
+        return (leaf_count - 1).bit_length()
+    if size < leaf_count or size & (size - 1):
+        raise ValueError("size must be a power of 2 not below the number of leaves")
+    return size.bit_length() - 1
+
+
+def from_leaves(
+    leaves: List[MerkleTreeLeaf], size: Optional[int] = None
+) -> MerkleTreeNode:
+    """Build a tree of size leaves, by default the next power of 2.
+
+    Missing leaves are zero leaves like the last leaf. They are not built, the
+    last node of a level with an odd number of nodes is paired with the shared
+    root of a zero subtree instead.
+    """
+    depth = padded_depth(len(leaves), size)
     nodes: List[MerkleTreeNode] = list(leaves)
-    while len(nodes) > 1:
+    for height in range(depth):
+        if len(nodes) % 2:
+            nodes.append(zero_node(leaves[-1].padding_digest(), height))
         nodes = [MerkleTreeNode(*nodes[i : i + 2]) for i in range(0, len(nodes), 2)]
 
     return nodes[0]
 
 
-def from_bytes(data: bytes, slices_count: int = 2) -> MerkleTreeNode:
-    if slices_count < 2 or not math.log2(slices_count).is_integer():
-        raise ValueError("slices_count must be >= 2 integer and power of 2")
-    slice_len = math.ceil(len(data) / slices_count)
-    return from_leaves(
-        [
-            MerkleTreeLeaf(data[slice_len * s : slice_len * (s + 1)])
-            for s in range(slices_count)
-        ]
-    )
+def from_bytes(
+    data: bytes, slices_count: int = 2, profile: Optional[EncodingProfile] = None
+) -> MerkleTreeNode:
+    # the profile takes precedence over slices_count, full leaves are views
+    # into data instead of copies of their slices
+    if profile is None:
+        profile = EncodingProfile(slices_count=slices_count)
+    size, _ = profile.layout(len(data))
+    return from_leaves([MerkleTreeLeaf(leaf) for leaf in profile.split(data)], size)
 
 
 def from_list(items: List[bytes]) -> MerkleTreeNode:
@@ -0,0 +1,121 @@
+"""Encoding profiles: how data is cut into Merkle tree leaves.
+
+A profile fixes the leaf size, the number of leaves and how data that does not
+fill the leaves is padded. Leaves are always hashed as lists of 32 byte words,
+so every leaf size is a multiple of 32 and proofs of any profile verify with
+the on-chain verifier. The default profile cuts data into two leaves, which is
+what ``from_bytes`` always did.
+
+Profiles come from requests, so layouts are bounded: leaves hold at most
+``MAX_LEAF_SIZE`` bytes and the leaves may hold at most ``MAX_PADDING_FACTOR``
+times the bytes the data or a single leaf needs.
+"""
+import enum
+import math
+from typing import List, NamedTuple, Optional, Tuple
+
+
+WORD_SIZE = 32
+MAX_LEAF_SIZE = 64 * 1024
+MAX_PADDING_FACTOR = 4
+
+
+class Padding(str, enum.Enum):
+    # data has to fill the leaves exactly
+    NONE = "none"
+    # missing bytes of the leaves are zero
+    ZERO = "zero"
+
+
+class EncodingProfile(NamedTuple):
+    """Leaf layout of data.
+
+    Attributes:
+        leaf_size (int, optional): Size of a leaf in bytes, a multiple of 32.
+            Derived from the data size and slices_count if None.
+        slices_count (int, optional): Number of leaves, a power of 2. Derived
+            from the data size and leaf_size if None, 2 if both are None.
+        padding (Padding): How data not filling the leaves is handled.
+
+    """
+
+    leaf_size: Optional[int] = None
+    slices_count: Optional[int] = None
+    padding: Padding = Padding.NONE
+
+    def layout(self, data_size: int) -> Tuple[int, int]:
+        """Return slices count and leaf size of data_size bytes of data.
+
+        Raises:
+            ValueError: If the profile is invalid or data does not fit it.
+
+        """
+        slices_count, leaf_size = self.slices_count, self.leaf_size
+        if slices_count is not None and (
+            slices_count < 2 or not math.log2(slices_count).is_integer()
+        ):
+            raise ValueError("slices_count must be >= 2 integer and power of 2")
+        if leaf_size is not None and (leaf_size <= 0 or leaf_size % WORD_SIZE):
+            raise ValueError("leaf_size must be a positive multiple of 32")
+        if leaf_size is not None and leaf_size > MAX_LEAF_SIZE:
+            raise ValueError("leaf_size must not exceed %d bytes" % MAX_LEAF_SIZE)
+
+        if leaf_size is None:
+            slices_count = slices_count or 2
+            leaf_size = math.ceil(data_size / slices_count)
+            if self.padding == Padding.ZERO:
+                leaf_size = max(WORD_SIZE, -(-leaf_size // WORD_SIZE) * WORD_SIZE)
+            elif leaf_size % WORD_SIZE or data_size % WORD_SIZE:
+                raise ValueError("data length has to be a multiple of 32 per leaf")
+        elif slices_count is None:
+            slices_count = max(2, math.ceil(data_size / leaf_size))
+            if self.padding == Padding.ZERO:
+                slices_count = 1 << (slices_count - 1).bit_length()
+            elif not math.log2(slices_count).is_integer():
+                raise ValueError("Data does not fill 2^x leaves of leaf_size bytes")
+
+        if data_size > slices_count * leaf_size:
+            raise ValueError("Data does not fit into the leaves of the profile")
+        # checked before any leaf is allocated, the data takes at least two words
+        needed = max(-(-data_size // WORD_SIZE), 2) * WORD_SIZE
+        if slices_count * leaf_size > MAX_PADDING_FACTOR * max(needed, leaf_size):
+            raise ValueError("The profile pads the data too much")
+        if self.padding == Padding.NONE and self.leaf_size is not None:
+            if data_size != slices_count * leaf_size:
+                raise ValueError("Data does not fill the leaves of the profile")
+        return slices_count, leaf_size
+
+    def split(self, data: bytes) -> List[bytes]:
+        """Cut data into the leaf data of the profile.
+
+        Full leaves are views into data, only a partially filled leaf is copied
+        to pad it. With zero padding, leaves past the end of data are left out,
+        trees pad them with zero subtrees instead (see ``from_leaves``).
+        """
+        slices_count, leaf_size = self.layout(len(data))
+        if self.padding == Padding.ZERO:
+            slices_count = max(1, -(-len(data) // leaf_size))
+        view = memoryview(data)
+        leaves: List[bytes] = [
+            view[leaf_size * s : leaf_size * (s + 1)] for s in range(slices_count)
+        ]
+        if len(leaves[-1]) < leaf_size and self.padding == Padding.ZERO:
+            leaves[-1] = bytes(leaves[-1]).ljust(leaf_size, b"\0")
+        return leaves
+
+    def check(self, leaf_sizes: List[int]) -> None:
+        """Check the sizes of the data leaves of a tree against the profile.
+
+        Raises:
+            ValueError: If the leaves do not match the profile.
+
+        """
+        if self.slices_count is not None and len(leaf_sizes) != self.slices_count:
+            raise ValueError("Number of leaves does not match the profile")
+        if self.leaf_size is not None and any(
+            size != self.leaf_size for size in leaf_sizes
+        ):
+            raise ValueError("Leaf sizes do not match the profile")
+
+
+DEFAULT_PROFILE = EncodingProfile()
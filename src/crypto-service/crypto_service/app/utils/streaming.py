@@ -0,0 +1,188 @@
+"""Streaming FairSwap encoder.
+
+``StreamingEncoder`` produces the same encoding as ``encoding.encode`` but
+consumes the plaintext one leaf at a time. Tree levels are folded with
+frontiers of pending subtree digests, so apart from the output only O(log n)
+digests per level are kept in memory.
+
+The encoded vector is ``leaves || digests_pack || B032``. Within
+``digests_pack`` every tree level is contiguous and its digests become final
+from left to right, so each level of the encoded tree's right half can be
+folded by its own frontier as well.
+"""
+import math
+from typing import (
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from crypto_service.app.utils.hashing import DIGEST_SIZE, hash_leaf, hash_pair
+from crypto_service.app.utils.keystream import pad
+from crypto_service.app.utils.xor import xor_crypt
+
+
+B032 = b"\x00" * 32
+
+# (position in the encoded vector, encrypted leaf data or digest)
+Emitted = List[Tuple[int, bytes]]
+
+
+class Frontier(object):
+    """Fold a left to right stream of digests into a perfect Merkle tree.
+
+    Only the roots of the completed subtrees not yet paired up are kept.
+    ``on_node`` is called with (level, index, digest) of every inner node.
+    """
+
+    def __init__(
+        self, on_node: Optional[Callable[[int, int, bytes], None]] = None
+    ) -> None:
+        self._pending: List[Optional[bytes]] = []
+        self._counts: Dict[int, int] = {}
+        self._on_node = on_node
+
+    def append(self, digest: bytes) -> None:
+        level = 0
+        while level < len(self._pending):
+            left = self._pending[level]
+            if left is None:
+                break
+            digest = hash_pair(left, digest)
+            self._pending[level] = None
+            level += 1
+            if self._on_node is not None:
+                index = self._counts.get(level, 0)
+                self._counts[level] = index + 1
+                self._on_node(level, index, digest)
+        if level == len(self._pending):
+            self._pending.append(None)
+        self._pending[level] = digest
+
+    @property
+    def root(self) -> bytes:
+        pending = [digest for digest in self._pending if digest is not None]
+        if len(pending) != 1:
+            raise ValueError("Number of appended digests is not a power of 2")
+        return pending[0]
+
+
+class StreamingEncoder(object):
+    def __init__(self, key: bytes, leaf_count: int) -> None:
+        if leaf_count < 1 or not math.log2(leaf_count).is_integer():
+            raise ValueError("leaf_count must be a power of 2")
+        self._key = key
+        self._leaf_count = leaf_count
+        self._depth = int(math.log2(leaf_count))
+        self._leaf_size: Optional[int] = None
+        self._received = 0
+        self._emitted: Emitted = []
+        self._digest: Optional[bytes] = None
+        self._plain = Frontier(on_node=self._on_plain_node)
+        self._encoded_leaves = Frontier()
+        # one frontier per plaintext level, they form the encoded right half
+        self._encoded_levels = [Frontier() for _ in range(self._depth)]
+
+    @property
+    def leaf_count(self) -> int:
+        return self._leaf_count
+
+    @property
+    def leaf_size(self) -> Optional[int]:
+        return self._leaf_size
+
+    def position_offset(self, position: int) -> int:
+        """Return the byte offset of a vector position in the encoding."""
+        if self._leaf_size is None:
+            raise ValueError("No leaf has been received yet")
+        if position < self._leaf_count:
+            return position * self._leaf_size
+        return (
+            self._leaf_count * self._leaf_size
+            + (position - self._leaf_count) * DIGEST_SIZE
+        )
+
+    def _on_plain_node(self, level: int, index: int, digest: bytes) -> None:
+        # digests_pack position of the node, levels are stored bottom-up
+        pack_index = self._leaf_count - (self._leaf_count >> (level - 1)) + index
+        encrypted = xor_crypt(digest, pad(2 * self._leaf_count + pack_index, self._key))
+        self._encoded_levels[level - 1].append(encrypted)
+        self._emitted.append((self._leaf_count + pack_index, encrypted))
+
+    def update(self, chunk: bytes) -> Emitted:
+        if self._received == self._leaf_count:
+            raise ValueError("All leaves have already been received")
+        if self._leaf_size is None:
+            if len(chunk) == 0 or len(chunk) % 32 != 0:
+                raise ValueError("data length has to be a multiple of 32")
+            self._leaf_size = len(chunk)
+        elif len(chunk) != self._leaf_size:
+            raise ValueError("All leaves must have the same size")
+
+        encrypted = xor_crypt(chunk, pad(self._received, self._key))
+        self._emitted.append((self._received, encrypted))
+        self._encoded_leaves.append(hash_leaf(encrypted))
+        self._plain.append(hash_leaf(chunk))
+        self._received += 1
+
+        emitted, self._emitted = self._emitted, []
+        return emitted
+
+    def finalize(self) -> Emitted:
+        if self._received != self._leaf_count:
+            raise ValueError(
+                "Expected %d leaves, got %d" % (self._leaf_count, self._received)
+            )
+        right = B032
+        for level in reversed(self._encoded_levels):
+            right = hash_pair(level.root, right)
+        self._digest = hash_pair(self._encoded_leaves.root, right)
+        return [(2 * self._leaf_count - 1, B032)]
+
+    @property
+    def digest(self) -> bytes:
+        if self._digest is None:
+            raise ValueError("Encoder has not been finalized")
+        return self._digest
+
+
+def encode_stream(
+    chunks: Iterable[bytes], key: bytes, leaf_count: int
+) -> Iterator[Tuple[int, bytes]]:
+    encoder = StreamingEncoder(key, leaf_count)
+    for chunk in chunks:
+        yield from encoder.update(chunk)
+    yield from encoder.finalize()
+
+
+def read_chunks(source: BinaryIO, leaf_size: int) -> Iterator[bytes]:
+    while True:
+        chunk = source.read(leaf_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def encode_file(
+    source: BinaryIO, target: BinaryIO, key: bytes, leaf_size: int
+) -> bytes:
+    """Encode a seekable plaintext file into target and return the root."""
+    size = source.seek(0, 2)
+    source.seek(0)
+    if size % leaf_size != 0:
+        raise ValueError("File size has to be a multiple of leaf_size")
+    encoder = StreamingEncoder(key, size // leaf_size)
+    start = target.tell()
+    for chunk in read_chunks(source, leaf_size):
+        for position, value in encoder.update(chunk):
+            target.seek(start + encoder.position_offset(position))
+            target.write(value)
+    for position, value in encoder.finalize():
+        target.seek(start + encoder.position_offset(position))
+        target.write(value)
+    return encoder.digest
@@ -0,0 +1,350 @@
+"""File backed store of Merkle trees addressed by root hash.
+
+Every tree is written to a single file which is mapped back with mmap, so
+proofs, roots and leaf ranges are read from the page cache instead of
+rebuilding or loading the whole tree. The file layout is::
+
+    header   magic "MKTS" | uint32 version | uint64 leaf count |
+             uint64 padded leaf count
+    digests  all levels of the tree padded to the padded leaf count, a power
+             of 2, bottom level first, 32 bytes per node
+    offsets  leaf count + 1 uint64 offsets into the leaf data
+    data     concatenated leaf data
+
+All integers are big endian. The digests section is the buffer layout of
+``FlatMerkleTree``. Version 1 files lack the padded leaf count, their trees are
+padded to the next power of 2.
+
+A store keeps its files within a byte budget, least recently used trees are
+removed first.
+"""
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Iterable, List, Optional
+
+from crypto_service.app.utils.flat_merkle import (
+    DIGEST_SIZE,
+    FlatMerkleTree,
+    MultiProof,
+    get_multiproof,
+)
+
+
+MAGIC = b"MKTS"
+VERSION = 2
+HEADER = struct.Struct(">4sIQQ")
+HEADER_V1 = struct.Struct(">4sIQ")
+OFFSET = struct.Struct(">Q")
+SUFFIX = ".tree"
+TREE_STORE_BYTES = 1024 * 1024 * 1024
+
+
+class TreeStoreError(Exception):
+    pass
+
+
+class MappedMerkleTree(object):
+    """Read-only view of a stored tree.
+
+    Offers the query API of ``FlatMerkleTree`` on top of a memory map of the
+    tree file.
+    """
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_size < HEADER_V1.size:
+                raise TreeStoreError("Tree file is truncated")
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._check()
+        except TreeStoreError:
+            self._map.close()
+            raise
+
+    def _check(self) -> None:
+        magic, version, leaf_count = HEADER_V1.unpack_from(self._map, 0)
+        if magic != MAGIC or version not in (1, VERSION):
+            raise TreeStoreError("Not a tree file")
+        if leaf_count < 1:
+            raise TreeStoreError("Tree file has no leaves")
+        if version == 1:
+            self._header_size = HEADER_V1.size
+            size = 1 << (leaf_count - 1).bit_length()
+        elif len(self._map) < HEADER.size:
+            raise TreeStoreError("Tree file is truncated")
+        else:
+            self._header_size = HEADER.size
+            size = HEADER.unpack_from(self._map, 0)[3]
+            if size < leaf_count or size & (size - 1):
+                raise TreeStoreError("Invalid padded leaf count")
+        self._leaf_count = leaf_count
+        # padding leaves only have digests
+        self._size = size
+        self._depth = size.bit_length() - 1
+        self._offsets_start = self._header_size + (2 * size - 1) * DIGEST_SIZE
+        self._data_start = self._offsets_start + (leaf_count + 1) * OFFSET.size
+        if len(self._map) < self._data_start or len(self._map) != (
+            self._data_start + self._leaf_offset(leaf_count)
+        ):
+            raise TreeStoreError("Tree file is truncated")
+
+    @property
+    def leaf_count(self) -> int:
+        return self._leaf_count
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    @property
+    def digest(self) -> bytes:
+        return self.node_digest(self._depth, 0)
+
+    def node_digest(self, level: int, index: int) -> bytes:
+        if not 0 <= level <= self._depth:
+            raise IndexError("Level out of range")
+        if not 0 <= index < self._size >> level:
+            raise IndexError("Node index out of range")
+        # levels are stored bottom-up, level l starts after 2n - 2n / 2^l nodes
+        node = 2 * self._size - (2 * self._size >> level) + index
+        start = self._header_size + node * DIGEST_SIZE
+        return self._map[start : start + DIGEST_SIZE]
+
+    def get_proof_by_index(self, index: int) -> List[bytes]:
+        if not 0 <= index < self._leaf_count:
+            raise IndexError("Leaf index out of range")
+        proof = [
+            self.node_digest(level, (index >> level) ^ 1)
+            for level in range(self._depth)
+        ]
+        proof.reverse()
+        return proof
+
+    def get_multiproof(self, indices: Iterable[int]) -> MultiProof:
+        return get_multiproof(self.node_digest, self._size, indices)
+
+    def _leaf_offset(self, index: int) -> int:
+        position = self._offsets_start + index * OFFSET.size
+        return OFFSET.unpack_from(self._map, position)[0]
+
+    def leaf_data(self, index: int) -> bytes:
+        if not 0 <= index < self._leaf_count:
+            raise IndexError("Leaf index out of range")
+        return self.leaves_range(index, index + 1)[0]
+
+    def leaves_range(self, start: int, stop: int) -> List[bytes]:
+        """Return the data of the leaves in [start, stop)."""
+        if not 0 <= start <= stop <= self._leaf_count:
+            raise IndexError("Leaf range out of range")
+        offsets = [self._leaf_offset(i) for i in range(start, stop + 1)]
+        return [
+            self._map[self._data_start + begin : self._data_start + end]
+            for begin, end in zip(offsets, offsets[1:])
+        ]
+
+    def close(self) -> None:
+        self._map.close()
+
+    def __enter__(self) -> "MappedMerkleTree":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def __repr__(self) -> str:
+        return "<%s.%s %s>" % (__name__, MappedMerkleTree.__name__, self.digest.hex())
+
+
+def write_tree(tree: FlatMerkleTree, path: str) -> None:
+    """Write tree to path, the file is replaced atomically."""
+    leaves = tree.leaves
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(HEADER.pack(MAGIC, VERSION, len(leaves), 1 << tree.depth))
+            for level in range(tree.depth + 1):
+                file.write(tree.level(level))
+            offset = 0
+            file.write(OFFSET.pack(offset))
+            for leaf in leaves:
+                offset += len(leaf.data)
+                file.write(OFFSET.pack(offset))
+            for leaf in leaves:
+                file.write(leaf.data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class TreeStore(object):
+    """Directory of tree files named after their root hash.
+
+    Opened trees are kept in a small LRU, evicted maps are closed once the
+    last reference to them is gone. Tree files are removed least recently
+    used first once they take more than max_bytes. The order is rebuilt from
+    the file times on startup, reads touch the files to keep it across
+    restarts.
+    """
+
+    def __init__(
+        self, directory: str, max_bytes: int = TREE_STORE_BYTES, max_open: int = 64
+    ) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_open = max_open
+        self._open: "OrderedDict[bytes, MappedMerkleTree]" = OrderedDict()
+        self._size = 0
+        self._files: "OrderedDict[bytes, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        files = []
+        for entry in os.scandir(directory):
+            root = self._root(entry.name)
+            if entry.is_file() and root is not None:
+                stat = entry.stat()
+                files.append((stat.st_mtime, root, stat.st_size))
+        with self._lock:
+            for _, root, size in sorted(files):
+                self._files[root] = size
+                self._size += size
+            self._evict()
+
+    @staticmethod
+    def _root(name: str) -> Optional[bytes]:
+        # root of a tree file name, None for other files like partial writes
+        if not name.endswith(SUFFIX) or len(name) != 2 * DIGEST_SIZE + len(SUFFIX):
+            return None
+        try:
+            return bytes.fromhex(name[: -len(SUFFIX)])
+        except ValueError:
+            return None
+
+    def path(self, root: bytes) -> str:
+        return os.path.join(self.directory, root.hex() + SUFFIX)
+
+    def put(self, tree: FlatMerkleTree) -> bytes:
+        """Store tree unless a tree with the same root is stored already.
+
+        A tree file larger than max_bytes is removed again right away.
+        """
+        root = tree.digest
+        if root in self:
+            self._touch(root)
+            return root
+        path = self.path(root)
+        write_tree(tree, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._size -= self._files.pop(root, 0)
+            self._files[root] = size
+            self._size += size
+            self._evict()
+        return root
+
+    def _touch(self, root: bytes) -> None:
+        try:
+            os.utime(self.path(root))
+            size = os.path.getsize(self.path(root))
+        except FileNotFoundError:
+            return
+        with self._lock:
+            # trees written by other processes are adopted on first use
+            if root not in self._files:
+                self._files[root] = size
+                self._size += size
+            self._files.move_to_end(root)
+            self._evict()
+
+    def _evict(self) -> None:
+        # called with the lock held, open maps of removed files stay readable
+        while self._size > self.max_bytes:
+            root, size = self._files.popitem(last=False)
+            self._size -= size
+            self._open.pop(root, None)
+            try:
+                os.remove(self.path(root))
+            except FileNotFoundError:
+                pass
+
+    def get(self, root: bytes) -> MappedMerkleTree:
+        """Return the stored tree with the given root.
+
+        Raises:
+            KeyError: If no such tree is stored.
+
+        """
+        with self._lock:
+            tree: Optional[MappedMerkleTree] = self._open.get(root)
+            if tree is not None:
+                self._open.move_to_end(root)
+                if root in self._files:
+                    self._files.move_to_end(root)
+                return tree
+
+        try:
+            tree = MappedMerkleTree(self.path(root))
+        except FileNotFoundError:
+            raise KeyError(root.hex())
+        self._touch(root)
+
+        with self._lock:
+            self._open[root] = tree
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        return tree
+
+    def __contains__(self, root: bytes) -> bool:
+        return os.path.exists(self.path(root))
+
+
+class StoredTrees(object):
+    """Tree store utility.
+
+    Utility class holding the TreeStore for whole FastAPI application scope.
+
+    Attributes:
+        store (TreeStore, optional): TreeStore object instance, None if trees
+            are not stored.
+
+    """
+
+    store: Optional[TreeStore] = None
+
+    @classmethod
+    def configure(
+        cls, directory: Optional[str], max_bytes: int = TREE_STORE_BYTES
+    ) -> None:
+        """Set the store directory, None disables storing trees.
+
+        Args:
+            directory (typing.Optional[str]): Directory of the tree files.
+            max_bytes (int): Size limit of the tree files.
+
+        """
+        cls.store = TreeStore(directory, max_bytes) if directory else None
+
+    @classmethod
+    def open(cls, directory: str) -> TreeStore:
+        """Return the store of directory.
+
+        WorkExecutor workers are handed the directory instead of the store.
+        Worker processes open the store once and reuse it afterwards, worker
+        threads use the store of the application.
+
+        Args:
+            directory (str): Directory of the tree files.
+
+        Returns:
+            The TreeStore of directory.
+
+        """
+        if cls.store is None or cls.store.directory != directory:
+            cls.store = TreeStore(directory)
+        return cls.store
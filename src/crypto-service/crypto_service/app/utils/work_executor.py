@@ -0,0 +1,147 @@
+"""Executor utility for CPU-bound work."""
+import asyncio
+import functools
+import logging
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+from crypto_service.config import settings
+from crypto_service.app.utils import flat_merkle, hashing
+from crypto_service.app.utils.tree_store import StoredTrees
+
+
+T = TypeVar("T")
+
+EXECUTOR_TYPES = ("thread", "process")
+
+
+class ExecutorSaturatedError(Exception):
+    """Raised when the executor already holds the maximum number of tasks."""
+
+
+def init_process_worker() -> None:
+    # process workers are not forked, so the startup configuration of the
+    # server is applied again in each of them
+    hashing.configure_worker_backend(settings.HASH_BACKEND)
+    flat_merkle.configure_parallelism(
+        settings.MERKLE_WORKERS, settings.MERKLE_PARALLEL_THRESHOLD
+    )
+    StoredTrees.configure(settings.TREE_STORE_DIR, settings.TREE_STORE_DIR_BYTES)
+
+
+class WorkExecutor(object):
+    """CPU-bound work executor utility.
+
+    Utility class for running Merkle tree and encoding work outside of the
+    asyncio event loop for whole FastAPI application scope. Work is submitted to
+    a thread or process pool. Tasks beyond the pool size wait in its queue, and
+    once ``workers + queue_size`` tasks are pending new ones are rejected with
+    ExecutorSaturatedError instead of piling up. The process pool is created
+    from the threaded server process, so its workers are started by a fork
+    server (spawned where that is not available) instead of being forked.
+
+    Attributes:
+        executor_type (str): Either "thread" or "process".
+        workers (int): Number of pool workers.
+        queue_size (int): Number of tasks allowed to wait for a free worker.
+        pending (int): Number of submitted tasks not finished yet.
+        executor (concurrent.futures.Executor, optional): Pool object instance.
+
+    """
+
+    executor_type: str = "thread"
+    workers: int = 4
+    queue_size: int = 64
+    pending: int = 0
+    executor: Optional[Executor] = None
+    log: logging.Logger = logging.getLogger(__name__)
+
+    @classmethod
+    def configure(cls, executor_type: str, workers: int, queue_size: int) -> None:
+        """Set the pool parameters, a running pool is shut down first.
+
+        Args:
+            executor_type (str): Either "thread" or "process".
+            workers (int): Number of pool workers.
+            queue_size (int): Number of tasks allowed to wait for a free worker.
+
+        Raises:
+            ValueError: If any of the parameters is invalid.
+
+        """
+        if executor_type not in EXECUTOR_TYPES:
+            raise ValueError("executor_type must be one of %s" % (EXECUTOR_TYPES,))
+        if workers < 1 or queue_size < 0:
+            raise ValueError("workers must be >= 1 and queue_size >= 0")
+        cls.shutdown_executor()
+        cls.executor_type = executor_type
+        cls.workers = workers
+        cls.queue_size = queue_size
+
+    @classmethod
+    def get_executor(cls) -> Executor:
+        """Create pool object instance.
+
+        Returns:
+            concurrent.futures.Executor: Executor object instance.
+
+        """
+        if cls.executor is None:
+            cls.log.debug(
+                "Initialize WorkExecutor %s pool with %d workers.",
+                cls.executor_type,
+                cls.workers,
+            )
+            if cls.executor_type == "process":
+                cls.executor = ProcessPoolExecutor(
+                    max_workers=cls.workers,
+                    mp_context=flat_merkle.mp_context(),
+                    initializer=init_process_worker,
+                )
+            else:
+                cls.executor = ThreadPoolExecutor(
+                    max_workers=cls.workers, thread_name_prefix="work-executor"
+                )
+
+        return cls.executor
+
+    @classmethod
+    def shutdown_executor(cls) -> None:
+        """Shut down pool, waiting for running tasks."""
+        if cls.executor:
+            cls.log.debug("Shut down WorkExecutor pool.")
+            cls.executor.shutdown()
+            cls.executor = None
+
+    @classmethod
+    async def run(cls, func: Callable[..., T], *args: Any) -> T:
+        """Run function in the pool and wait for its result.
+
+        With the process pool the function, its arguments and its result have to
+        be picklable.
+
+        Args:
+            func (typing.Callable): Function to run.
+            *args (typing.Any): Positional arguments of the function.
+
+        Returns:
+            The function result.
+
+        Raises:
+            ExecutorSaturatedError: If there are already workers + queue_size
+                pending tasks.
+
+        """
+        if cls.pending >= cls.workers + cls.queue_size:
+            raise ExecutorSaturatedError("Too many pending tasks")
+
+        # The counter is only touched from the event loop thread, so it does
+        # not need a lock.
+        cls.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                cls.get_executor(), functools.partial(func, *args)
+            )
+        finally:
+            cls.pending -= 1
@@ -16,9 +16,38 @@
 # limitations under the License.
 
 
+# XOR block size, bounds the temporary integers of large buffers
+XOR_BLOCK_SIZE = 64 * 1024
+
+
+def xor_into(buffer: memoryview, keystream: bytes) -> None:
+    """XOR keystream into the writable buffer in place."""
+    if len(buffer) != len(keystream):
+        raise ValueError("keystream must have the same length as data")
+    stream = memoryview(keystream)
+    # XOR each block as one big integer instead of byte by byte
+    for start in range(0, len(buffer), XOR_BLOCK_SIZE):
+        stop = min(start + XOR_BLOCK_SIZE, len(buffer))
+        buffer[start:stop] = (
+            int.from_bytes(buffer[start:stop], "big")
+            ^ int.from_bytes(stream[start:stop], "big")
+        ).to_bytes(stop - start, "big")
+
+
+def xor_bytes(data: bytes, keystream: bytes) -> bytes:
+    if len(data) != len(keystream):
+        raise ValueError("keystream must have the same length as data")
+    if len(data) <= XOR_BLOCK_SIZE:
+        return (
+            int.from_bytes(data, "big") ^ int.from_bytes(keystream, "big")
+        ).to_bytes(len(data), "big")
+    buffer = bytearray(data)
+    xor_into(memoryview(buffer), keystream)
+    return bytes(buffer)
+
+
 def xor_crypt(data: bytes, key: bytes) -> bytes:
-    result = bytearray()
-    for i in range(0, len(data), len(key)):
-        for x, y in zip(data[i : i + len(key)], key):
-            result.append(x ^ y)
-    return bytes(result)
+    if len(key) == 0:
+        raise ValueError("key must not be empty")
+    repeats = -(-len(data) // len(key))
+    return xor_bytes(data, (key * repeats)[: len(data)])
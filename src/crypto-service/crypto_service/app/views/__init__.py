@@ -3,15 +3,27 @@ from crypto_service.app.views.error import ErrorResponse
 from crypto_service.app.views.ready import ReadyResponse
 from crypto_service.app.views.encoding import (
     EncodingResponse,
+    EncodingBatchResponse,
     RootHashResponse,
     ComputationResultResponse,
 )
+from crypto_service.app.views.trees import (
+    MultiProofNode,
+    MultiProofResponse,
+    ProofBatchResponse,
+    ProofResponse,
+)
 
 
 __all__ = (
     "ErrorResponse",
     "ReadyResponse",
     "EncodingResponse",
+    "EncodingBatchResponse",
     "RootHashResponse",
     "ComputationResultResponse",
+    "MultiProofNode",
+    "MultiProofResponse",
+    "ProofBatchResponse",
+    "ProofResponse",
 )
@@ -137,3 +137,43 @@ class ComputationResultResponse(BaseModel):
                 {"status": {"title": "Status", "type": "string"}}
             )
             schema["required"].append("status")
+
+
+class EncodingBatchResponse(BaseModel):
+    """Define batch encoding model for the response.
+
+    Attributes:
+        encodings (List[EncodingResponse]): encoding vector and root hash of
+            every computation result, in request order.
+
+    Raises:
+        pydantic.error_wrappers.ValidationError: If any of provided attribute
+            doesn't pass type validation.
+
+    """
+
+    encodings: List[EncodingResponse]
+
+    class Config:
+        """Config sub-class needed to extend/override the generated JSON schema.
+
+        More details can be found in pydantic documentation:
+        https://pydantic-docs.helpmanual.io/usage/schema/#schema-customization
+
+        """
+
+        @staticmethod
+        def schema_extra(schema: Dict[str, Any]) -> None:
+            """Post-process the generated schema.
+
+            Method can have one or two positional arguments. The first will be
+            the schema dictionary. The second, if accepted, will be the model
+            class. The callable is expected to mutate the schema dictionary
+            in-place; the return value is not used.
+
+            Args:
+                schema (typing.Dict[str, typing.Any]): The schema dictionary.
+
+            """
+            # Override schema description, by default is taken from docstring.
+            schema["description"] = "Encoding batch response model."
@@ -0,0 +1,162 @@
+"""Application implementation - tree proof responses."""
+from typing import Any, Dict, List
+
+from pydantic import BaseModel
+
+
+class ProofResponse(BaseModel):
+    """Define Merkle proof model for the response.
+
+    Attributes:
+        root (str): root hash of the tree.
+        index (int): leaf index.
+        leaf (str): leaf data.
+        leaf_digest (str): leaf digest the proof starts from.
+        proof (List[str]): sibling digests from the root down to the leaf.
+
+    Raises:
+        pydantic.error_wrappers.ValidationError: If any of provided attribute
+            doesn't pass type validation.
+
+    """
+
+    root: str
+    index: int
+    leaf: str
+    leaf_digest: str
+    proof: List[str]
+
+    class Config:
+        """Config sub-class needed to extend/override the generated JSON schema.
+
+        More details can be found in pydantic documentation:
+        https://pydantic-docs.helpmanual.io/usage/schema/#schema-customization
+
+        """
+
+        @staticmethod
+        def schema_extra(schema: Dict[str, Any]) -> None:
+            """Post-process the generated schema.
+
+            Method can have one or two positional arguments. The first will be
+            the schema dictionary. The second, if accepted, will be the model
+            class. The callable is expected to mutate the schema dictionary
+            in-place; the return value is not used.
+
+            Args:
+                schema (typing.Dict[str, typing.Any]): The schema dictionary.
+
+            """
+            # Override schema description, by default is taken from docstring.
+            schema["description"] = "Merkle proof response model."
+
+
+class ProofBatchResponse(BaseModel):
+    """Define Merkle proof batch model for the response.
+
+    Attributes:
+        root (str): root hash of the tree.
+        proofs (List[ProofResponse]): proof of every requested leaf, in
+            request order.
+
+    Raises:
+        pydantic.error_wrappers.ValidationError: If any of provided attribute
+            doesn't pass type validation.
+
+    """
+
+    root: str
+    proofs: List[ProofResponse]
+
+    class Config:
+        """Config sub-class needed to extend/override the generated JSON schema.
+
+        More details can be found in pydantic documentation:
+        https://pydantic-docs.helpmanual.io/usage/schema/#schema-customization
+
+        """
+
+        @staticmethod
+        def schema_extra(schema: Dict[str, Any]) -> None:
+            """Post-process the generated schema.
+
+            Method can have one or two positional arguments. The first will be
+            the schema dictionary. The second, if accepted, will be the model
+            class. The callable is expected to mutate the schema dictionary
+            in-place; the return value is not used.
+
+            Args:
+                schema (typing.Dict[str, typing.Any]): The schema dictionary.
+
+            """
+            # Override schema description, by default is taken from docstring.
+            schema["description"] = "Merkle proof batch response model."
+
+
+class MultiProofNode(BaseModel):
+    """Define Merkle multiproof node model.
+
+    Attributes:
+        level (int): tree level of the node, 0 are the leaves.
+        index (int): node index within its level.
+        digest (str): node digest.
+
+    Raises:
+        pydantic.error_wrappers.ValidationError: If any of provided attribute
+            doesn't pass type validation.
+
+    """
+
+    level: int
+    index: int
+    digest: str
+
+
+class MultiProofResponse(BaseModel):
+    """Define Merkle multiproof model for the response.
+
+    Attributes:
+        root (str): root hash of the tree.
+        depth (int): depth of the tree.
+        indices (List[int]): requested leaf indices, sorted and deduplicated.
+        leaves (List[str]): leaf data of the requested leaves.
+        leaf_digests (List[str]): leaf digests of the requested leaves.
+        nodes (List[MultiProofNode]): digests a verifier cannot derive from the
+            requested leaves.
+
+    Raises:
+        pydantic.error_wrappers.ValidationError: If any of provided attribute
+            doesn't pass type validation.
+
+    """
+
+    root: str
+    depth: int
+    indices: List[int]
+    leaves: List[str]
+    leaf_digests: List[str]
+    nodes: List[MultiProofNode]
+
+    class Config:
+        """Config sub-class needed to extend/override the generated JSON schema.
+
+        More details can be found in pydantic documentation:
+        https://pydantic-docs.helpmanual.io/usage/schema/#schema-customization
+
+        """
+
+        @staticmethod
+        def schema_extra(schema: Dict[str, Any]) -> None:
+            """Post-process the generated schema.
+
+            Method can have one or two positional arguments. The first will be
+            the schema dictionary. The second, if accepted, will be the model
+            class. The callable is expected to mutate the schema dictionary
+            in-place; the return value is not used.
+
+            Args:
+                schema (typing.Dict[str, typing.Any]): The schema dictionary.
+
+            """
+            # Override schema description, by default is taken from docstring.
+            schema["description"] = "Merkle multiproof response model."
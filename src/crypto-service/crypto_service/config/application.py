@@ -1,4 +1,6 @@
 """Application configuration - FastAPI."""
+from typing import Optional
+
 from pydantic import BaseSettings
 from crypto_service.version import __version__
 
@@ -16,6 +18,20 @@ class Application(BaseSettings):
         * FASTAPI_VERSION
         * FASTAPI_DOCS_URL
         * FASTAPI_USE_REDIS
+        * FASTAPI_MERKLE_WORKERS
+        * FASTAPI_MERKLE_PARALLEL_THRESHOLD
+        * FASTAPI_HASH_BACKEND
+        * FASTAPI_EXECUTOR_TYPE
+        * FASTAPI_EXECUTOR_WORKERS
+        * FASTAPI_EXECUTOR_QUEUE_SIZE
+        * FASTAPI_ENCODING_CACHE_BYTES
+        * FASTAPI_ENCODING_CACHE_DIR
+        * FASTAPI_ENCODING_CACHE_DIR_BYTES
+        * FASTAPI_ENCODING_CACHE_TTL
+        * FASTAPI_REDIS_URL
+        * FASTAPI_TREE_STORE_DIR
+        * FASTAPI_TREE_STORE_DIR_BYTES
+        * FASTAPI_TREE_PROOF_MAX_INDICES
 
     Attributes:
         DEBUG (bool): FastAPI logging level. You should disable this for
@@ -24,6 +40,33 @@ class Application(BaseSettings):
         VERSION (str): Application version.
         DOCS_URL (str): Path where swagger ui will be served at.
         USE_REDIS (bool): Whether or not to use Redis.
+        MERKLE_WORKERS (int): Number of processes used to hash large Merkle
+            trees. 1 disables parallel hashing.
+        MERKLE_PARALLEL_THRESHOLD (int): Minimum number of leaves for a Merkle
+            tree to be hashed in parallel.
+        HASH_BACKEND (str): Provider hashing tree leaves, tree levels and
+            keystreams, "hashlib", "threads", "processes" or
+            "module:attribute" of a provider factory.
+        EXECUTOR_TYPE (str): Pool running encoding work off the event loop,
+            either "thread" or "process".
+        EXECUTOR_WORKERS (int): Number of pool workers.
+        EXECUTOR_QUEUE_SIZE (int): Number of requests allowed to wait for a
+            free worker before new ones are rejected with 503.
+        ENCODING_CACHE_BYTES (int): Size limit of the in-memory encoding cache.
+            0 disables it.
+        ENCODING_CACHE_DIR (Optional[str]): Directory persisting encoding cache
+            entries. Ignored if USE_REDIS is enabled.
+        ENCODING_CACHE_DIR_BYTES (int): Size limit of the entries in
+            ENCODING_CACHE_DIR, least recently used ones are removed first.
+        ENCODING_CACHE_TTL (int): Expiry of Redis encoding cache entries in
+            seconds. 0 never expires.
+        REDIS_URL (str): Redis server URL used if USE_REDIS is enabled.
+        TREE_STORE_DIR (Optional[str]): Directory storing encoded trees for the
+            proof endpoints. None disables storing trees.
+        TREE_STORE_DIR_BYTES (int): Size limit of the tree files in
+            TREE_STORE_DIR, least recently used ones are removed first.
+        TREE_PROOF_MAX_INDICES (int): Maximum number of leaf indices of a
+            proof batch or multiproof request.
 
     """
 
@@ -32,6 +75,20 @@ class Application(BaseSettings):
     VERSION: str = __version__
     DOCS_URL: str = "/"
     USE_REDIS: bool = False
+    MERKLE_WORKERS: int = 1
+    MERKLE_PARALLEL_THRESHOLD: int = 16384
+    HASH_BACKEND: str = "hashlib"
+    EXECUTOR_TYPE: str = "thread"
+    EXECUTOR_WORKERS: int = 4
+    EXECUTOR_QUEUE_SIZE: int = 64
+    ENCODING_CACHE_BYTES: int = 64 * 1024 * 1024
+    ENCODING_CACHE_DIR: Optional[str] = None
+    ENCODING_CACHE_DIR_BYTES: int = 1024 * 1024 * 1024
+    ENCODING_CACHE_TTL: int = 0
+    REDIS_URL: str = "redis://127.0.0.1:6379/0"
+    TREE_STORE_DIR: Optional[str] = None
+    TREE_STORE_DIR_BYTES: int = 1024 * 1024 * 1024
+    TREE_PROOF_MAX_INDICES: int = 1024
     # All your additional application configuration should go either here or in
     # separate file in this submodule.
 
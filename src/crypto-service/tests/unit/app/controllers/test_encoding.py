@@ -0,0 +1,365 @@
+from unittest import mock
+
+import pytest
+from crypto_service.app.utils import WorkExecutor
+
+
+KEY = "22" * 32
+ENCODING = [
+    "ee4b0e933b56cdf12a42b1e3f3b9ed1aa70cf9f3cf37325693255c8bfbcb8b82",
+    "0e7cfd344c7fe993a2e41292dc829ffa9dbb77ca43da4f1d749f9e0a3e051b11",
+    "ffc25db14c37234efb7eee6722ab1eee85fc2da82bebd051b996d7da7bac7d4a",
+    "0000000000000000000000000000000000000000000000000000000000000000",
+]
+ROOT = "5c3e2ece206e60e41629e22a98d04c673556ef881a0e7be43213b612eff8efaa"
+
+
+class TestEncodingController:
+
+    def test_should_return_encoding(self, app_runner):
+        # given / when
+        response = app_runner.post(
+            "/api/encoding", json={"result": 42, "nonce": "11" * 32, "key": KEY}
+        )
+
+        # then
+        assert response.status_code == 200
+        assert response.json() == {"encoding": ENCODING, "root": ROOT}
+
+    def test_should_return_root(self, app_runner):
+        # given / when
+        response = app_runner.post(
+            "/api/root", json={"leafs": ENCODING[:2], "hash_leafs": ENCODING[2:]}
+        )
+
+        # then
+        assert response.status_code == 200
+        assert response.json() == {"root": ROOT}
+
+    def test_should_return_decoded_result(self, app_runner):
+        # given / when
+        response = app_runner.post(
+            "/api/decode",
+            json={"leafs": ENCODING[:2], "hash_leafs": ENCODING[2:], "key": KEY},
+        )
+
+        # then
+        assert response.status_code == 200
+        assert response.json() == {
+            "encoding": ENCODING,
+            "decoded": ["%064x" % 42, "11" * 32],
+            "result": 42,
+        }
+
+
+class TestEncodingControllerProfile:
+
+    def test_should_encode_with_profile(self, app_runner):
+        # given
+        body = {
+            "result": 42,
+            "nonce": "11" * 32,
+            "key": KEY,
+            "profile": {"leaf_size": 64, "padding": "zero"},
+        }
+
+        # when
+        response = app_runner.post("/api/encoding/binary", json=body)
+
+        # then
+        assert response.status_code == 200
+        assert response.headers["x-leaf-count"] == "2"
+        assert response.headers["x-leaf-size"] == "64"
+
+        # when
+        decoded = app_runner.post(
+            "/api/decode/binary",
+            content=response.content,
+            headers={
+                "Content-Type": "application/octet-stream",
+                "X-Key": KEY,
+                "X-Leaf-Count": "2",
+                "X-Leaf-Size": "64",
+            },
+        )
+
+        # then
+        assert decoded.status_code == 200
+        assert decoded.headers["x-result"] == "42"
+
+    def test_should_decode_with_profile(self, app_runner):
+        # given
+        profile = {"slices_count": 4, "padding": "zero"}
+        body = {"result": 42, "nonce": "11" * 32, "key": KEY, "profile": profile}
+        encoded = app_runner.post("/api/encoding", json=body).json()["encoding"]
+
+        # when
+        response = app_runner.post(
+            "/api/decode",
+            json={
+                "leafs": encoded[:4],
+                "hash_leafs": encoded[4:],
+                "key": KEY,
+                "profile": profile,
+            },
+        )
+
+        # then
+        assert response.status_code == 200
+        assert response.json()["result"] == 42
+        assert response.json()["decoded"][:2] == ["%064x" % 42, "11" * 32]
+
+    def test_should_return_bad_request_when_decoded_leaves_do_not_fit(self, app_runner):
+        # given
+        body = {
+            "leafs": ENCODING[:2],
+            "hash_leafs": ENCODING[2:],
+            "key": KEY,
+            "profile": {"slices_count": 4},
+        }
+
+        # when
+        response = app_runner.post("/api/decode", json=body)
+
+        # then
+        assert response.status_code == 400
+
+    def test_should_decode_binary_with_profile(self, app_runner):
+        # given
+        profile = {"slices_count": 4, "padding": "zero"}
+        body = {"result": 42, "nonce": "11" * 32, "key": KEY, "profile": profile}
+        encoded = app_runner.post("/api/encoding/binary", json=body)
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "X-Key": KEY,
+            "X-Leaf-Count": encoded.headers["x-leaf-count"],
+            "X-Leaf-Size": encoded.headers["x-leaf-size"],
+        }
+
+        # when
+        decoded = app_runner.post(
+            "/api/decode/binary",
+            content=encoded.content,
+            headers={**headers, "X-Slices-Count": "4", "X-Padding": "zero"},
+        )
+        mismatched = app_runner.post(
+            "/api/decode/binary",
+            content=encoded.content,
+            headers={**headers, "X-Slices-Count": "8"},
+        )
+
+        # then
+        assert decoded.status_code == 200
+        assert decoded.headers["x-result"] == "42"
+        assert mismatched.status_code == 400
+
+    @pytest.mark.parametrize(
+        "profile",
+        [
+            {"leaf_size": 48},
+            {"slices_count": 2**20, "padding": "zero"},
+            {"leaf_size": 2**30, "padding": "zero"},
+        ],
+    )
+    def test_should_return_bad_request_when_data_does_not_fit(
+        self, app_runner, profile
+    ):
+        # given
+        body = {"result": 42, "nonce": "11" * 32, "key": KEY, "profile": profile}
+
+        # when
+        response = app_runner.post("/api/encoding", json=body)
+
+        # then
+        assert response.status_code == 400
+
+
+class TestBinaryEncodingController:
+
+    def test_should_return_binary_encoding(self, app_runner):
+        # given / when
+        response = app_runner.post(
+            "/api/encoding/binary",
+            json={"result": 42, "nonce": "11" * 32, "key": KEY},
+        )
+
+        # then
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/octet-stream"
+        assert response.headers["x-merkle-root"] == ROOT
+        assert response.headers["x-leaf-count"] == "2"
+        assert response.headers["x-leaf-size"] == "32"
+        assert response.content == bytes.fromhex("".join(ENCODING))
+
+    def test_should_return_binary_root(self, app_runner):
+        # given / when
+        response = app_runner.post(
+            "/api/root/binary",
+            content=bytes.fromhex("".join(ENCODING)),
+            headers={"Content-Type": "application/octet-stream", "X-Leaf-Count": "2"},
+        )
+
+        # then
+        assert response.status_code == 200
+        assert response.content == bytes.fromhex(ROOT)
+
+    def test_should_return_binary_decoded_result(self, app_runner):
+        # given / when
+        response = app_runner.post(
+            "/api/decode/binary",
+            content=bytes.fromhex("".join(ENCODING)),
+            headers={
+                "Content-Type": "application/octet-stream",
+                "X-Leaf-Count": "2",
+                "X-Leaf-Size": "32",
+                "X-Key": KEY,
+            },
+        )
+
+        # then
+        assert response.status_code == 200
+        assert response.headers["x-result"] == "42"
+        assert response.content == (42).to_bytes(32, "big") + b"\x11" * 32
+
+    @pytest.mark.parametrize(
+        "body, leaf_count",
+        [
+            (b"\x00" * 96, 4),
+            (b"\x00" * 80, 2),
+            (b"\x00" * 96, 3),
+        ],
+    )
+    def test_should_reject_malformed_body(self, app_runner, body, leaf_count):
+        # given / when
+        response = app_runner.post(
+            "/api/decode/binary",
+            content=body,
+            headers={"X-Leaf-Count": str(leaf_count), "X-Key": KEY},
+        )
+
+        # then
+        assert response.status_code == 400
+        assert response.json()["error"]["code"] == 400
+
+
+class TestEncodingControllerBackpressure:
+
+    def test_should_return_503_when_executor_saturated(self, app_runner):
+        # given
+        with mock.patch.object(WorkExecutor, "pending", 68):
+            # when
+            response = app_runner.post(
+                "/api/encoding", json={"result": 42, "nonce": "11" * 32, "key": KEY}
+            )
+
+        # then
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "1"
+        assert response.json()["error"]["code"] == 503
+
+    def test_should_answer_ready_when_executor_saturated(self, app_runner):
+        # given
+        with mock.patch.object(WorkExecutor, "pending", 68):
+            # when
+            response = app_runner.get("/api/ready")
+
+        # then
+        assert response.status_code == 200
+
+
+class TestBatchEncodingController:
+
+    def test_should_return_encodings_in_request_order(self, app_runner):
+        # given
+        results = [
+            {"result": i, "nonce": "%064x" % i, "key": key}
+            for i, key in enumerate(["33" * 32, KEY, "33" * 32, KEY, KEY])
+        ]
+        results.append({"result": 42, "nonce": "11" * 32, "key": KEY})
+
+        # when
+        response = app_runner.post("/api/encoding/batch", json={"results": results})
+
+        # then
+        assert response.status_code == 200
+        encodings = response.json()["encodings"]
+        assert len(encodings) == len(results)
+        assert encodings[-1] == {"encoding": ENCODING, "root": ROOT}
+        for result, batch_encoding in zip(results, encodings):
+            single = app_runner.post("/api/encoding", json=result)
+            assert batch_encoding == single.json()
+
+    def test_should_accept_empty_batch(self, app_runner):
+        # given / when
+        response = app_runner.post("/api/encoding/batch", json={"results": []})
+
+        # then
+        assert response.status_code == 200
+        assert response.json() == {"encodings": []}
+
+    def test_should_spread_batch_over_workers(self, app_runner):
+        # given
+        results = [
+            {"result": i, "nonce": "11" * 32, "key": "%064x" % (i % 2)}
+            for i in range(8)
+        ]
+
+        # when
+        with mock.patch.object(WorkExecutor, "run", wraps=WorkExecutor.run) as run:
+            response = app_runner.post("/api/encoding/batch", json={"results": results})
+
+        # then
+        assert response.status_code == 200
+        assert run.call_count == WorkExecutor.workers
+        for call in run.call_args_list:
+            chunk = call.args[1]
+            # results sharing a key end up in the same chunk
+            assert len({key for _, key, _ in chunk}) == 1
+
+
+class TestEncodingControllerCache:
+
+    def test_should_serve_retried_encoding_from_cache(self, app_runner):
+        # given
+        body = {"result": 42, "nonce": "11" * 32, "key": KEY}
+        app_runner.post("/api/encoding", json=body)
+
+        # when
+        with mock.patch(
+            "crypto_service.app.controllers.encoding.encode_data"
+        ) as encode_data:
+            response = app_runner.post("/api/encoding", json=body)
+
+        # then
+        encode_data.assert_not_called()
+        assert response.json() == {"encoding": ENCODING, "root": ROOT}
+
+    def test_should_serve_known_root_from_cache(self, app_runner):
+        # given
+        body = {"leafs": ENCODING[:2], "hash_leafs": ENCODING[2:]}
+        app_runner.post("/api/root", json=body)
+
+        # when
+        with mock.patch(
+            "crypto_service.app.controllers.encoding.compute_root"
+        ) as compute_root:
+            response = app_runner.post("/api/root", json=body)
+
+        # then
+        compute_root.assert_not_called()
+        assert response.json() == {"root": ROOT}
+
+    def test_should_fill_cache_from_batch(self, app_runner):
+        # given
+        body = {"result": 42, "nonce": "11" * 32, "key": KEY}
+        app_runner.post("/api/encoding/batch", json={"results": [body]})
+
+        # when
+        with mock.patch(
+            "crypto_service.app.controllers.encoding.encode_data"
+        ) as encode_data:
+            response = app_runner.post("/api/encoding/binary", json=body)
+
+        # then
+        encode_data.assert_not_called()
+        assert response.content == bytes.fromhex("".join(ENCODING))
@@ -0,0 +1,141 @@
+from unittest import mock
+
+import pytest
+from crypto_service.config import settings
+from crypto_service.app.utils import StoredTrees
+from crypto_service.app.utils.flat_merkle import FlatMerkleTree
+from crypto_service.app.utils.merkle import MerkleTreeHashLeaf, MerkleTreeNode
+
+
+KEY = "22" * 32
+ENCODING = [
+    "ee4b0e933b56cdf12a42b1e3f3b9ed1aa70cf9f3cf37325693255c8bfbcb8b82",
+    "0e7cfd344c7fe993a2e41292dc829ffa9dbb77ca43da4f1d749f9e0a3e051b11",
+    "ffc25db14c37234efb7eee6722ab1eee85fc2da82bebd051b996d7da7bac7d4a",
+    "0000000000000000000000000000000000000000000000000000000000000000",
+]
+ROOT = "5c3e2ece206e60e41629e22a98d04c673556ef881a0e7be43213b612eff8efaa"
+
+
+class TestTreesController:
+
+    @pytest.fixture
+    def client(self, app_runner, tmp_path):
+        StoredTrees.configure(str(tmp_path))
+        app_runner.post(
+            "/api/encoding", json={"result": 42, "nonce": "11" * 32, "key": KEY}
+        )
+        yield app_runner
+        StoredTrees.configure(None)
+
+    @pytest.mark.parametrize("index", range(4))
+    def test_should_return_valid_proof(self, client, index):
+        # given / when
+        response = client.get("/api/trees/%s/proof" % ROOT, params={"index": index})
+
+        # then
+        assert response.status_code == 200
+        body = response.json()
+        assert body["leaf"] == ENCODING[index]
+        assert MerkleTreeNode.validate_proof(
+            bytes.fromhex(ROOT),
+            MerkleTreeHashLeaf(bytes.fromhex(body["leaf_digest"])),
+            index,
+            [bytes.fromhex(digest) for digest in body["proof"]],
+        )
+
+    def test_should_return_proofs_in_request_order(self, client):
+        # given / when
+        response = client.post(
+            "/api/trees/%s/proofs" % ROOT, json={"indices": [3, 0, 3]}
+        )
+
+        # then
+        assert response.status_code == 200
+        proofs = response.json()["proofs"]
+        assert [proof["index"] for proof in proofs] == [3, 0, 3]
+        single = client.get("/api/trees/%s/proof" % ROOT, params={"index": 0})
+        assert proofs[1] == single.json()
+
+    def test_should_return_valid_multiproof(self, client):
+        # given / when
+        response = client.post(
+            "/api/trees/%s/multiproof" % ROOT, json={"indices": [2, 0]}
+        )
+
+        # then
+        assert response.status_code == 200
+        body = response.json()
+        assert body["indices"] == [0, 2]
+        assert body["leaves"] == [ENCODING[0], ENCODING[2]]
+        nodes = {
+            index: MerkleTreeHashLeaf(bytes.fromhex(digest))
+            for index, digest in zip(body["indices"], body["leaf_digests"])
+        }
+        proof = [
+            (node["level"], node["index"], bytes.fromhex(node["digest"]))
+            for node in body["nodes"]
+        ]
+        assert FlatMerkleTree.validate_multiproof(
+            bytes.fromhex(ROOT), nodes, proof, body["depth"]
+        )
+
+    @pytest.mark.parametrize("root", ["00" * 32, "not hex"])
+    def test_should_return_404_for_unknown_tree(self, client, root):
+        # given / when
+        response = client.get("/api/trees/%s/proof" % root, params={"index": 0})
+
+        # then
+        assert response.status_code == 404
+        assert response.json()["error"]["code"] == 404
+
+    def test_should_return_404_without_store(self, app_runner):
+        # given / when
+        response = app_runner.get("/api/trees/%s/proof" % ROOT, params={"index": 0})
+
+        # then
+        assert response.status_code == 404
+
+    @pytest.mark.parametrize("indices", [[4], [0, -1]])
+    def test_should_return_400_for_invalid_index(self, client, indices):
+        # given / when
+        response = client.post("/api/trees/%s/proofs" % ROOT, json={"indices": indices})
+
+        # then
+        assert response.status_code == 400
+
+    def test_should_return_500_for_unreadable_tree(self, client):
+        # given
+        with open(StoredTrees.store.path(bytes.fromhex(ROOT)), "wb") as file:
+            file.write(b"MKTS" + bytes(16))
+
+        # when
+        response = client.get("/api/trees/%s/proof" % ROOT, params={"index": 0})
+
+        # then
+        assert response.status_code == 500
+        assert response.json()["error"]["message"] == "Tree %s cannot be read." % ROOT
+
+    @pytest.mark.parametrize("endpoint", ["proofs", "multiproof"])
+    def test_should_return_400_for_too_many_indices(self, client, endpoint):
+        # given
+        with mock.patch.object(settings, "TREE_PROOF_MAX_INDICES", 2):
+            # when
+            response = client.post(
+                "/api/trees/%s/%s" % (ROOT, endpoint), json={"indices": [0, 1, 2]}
+            )
+
+        # then
+        assert response.status_code == 400
+
+    def test_should_store_tree_of_cached_encoding(self, client, tmp_path):
+        # given
+        StoredTrees.configure(str(tmp_path / "other"))
+
+        # when
+        client.post(
+            "/api/encoding", json={"result": 42, "nonce": "11" * 32, "key": KEY}
+        )
+
+        # then
+        assert bytes.fromhex(ROOT) in StoredTrees.store
@@ -0,0 +1,250 @@
+from unittest import mock
+
+import pytest
+from crypto_service.app.utils import encoding, flat_merkle
+from crypto_service.app.utils.bytes import generate_bytes
+
+
+def make_tree(count, size=64, seed=0):
+    return flat_merkle.from_list(
+        [generate_bytes(size, seed=seed + i) for i in range(count)]
+    )
+
+
+class TestDecodeMismatches:
+
+    @pytest.mark.parametrize("count", [1, 2, 8, 32])
+    def test_should_decode_without_mismatches(self, count):
+        # given
+        plain = make_tree(count)
+        key = generate_bytes(32, seed=99)
+
+        # when
+        decoded, mismatches = encoding.decode_mismatches(
+            encoding.encode(plain, key), key
+        )
+
+        # then
+        assert decoded == plain
+        assert [leaf.data for leaf in decoded.leaves] == [
+            leaf.data for leaf in plain.leaves
+        ]
+        assert mismatches == []
+
+    def test_should_report_forged_leaf(self):
+        # given
+        plain = make_tree(4)
+        key = generate_bytes(32, seed=99)
+
+        # when
+        _, mismatches = encoding.decode_mismatches(
+            encoding.encode_forge_first_leaf(plain, key), key
+        )
+
+        # then
+        assert mismatches == [encoding.DigestMismatch(index_in=0, index_out=4)]
+
+    def test_should_report_forged_hash(self):
+        # given
+        plain = make_tree(4)
+        key = generate_bytes(32, seed=99)
+
+        # when
+        _, mismatches = encoding.decode_mismatches(
+            encoding.encode_forge_first_leaf_first_hash(plain, key), key
+        )
+
+        # then
+        assert mismatches == [encoding.DigestMismatch(index_in=4, index_out=6)]
+
+    def test_should_raise_when_not_encoded(self):
+        # given
+        plain = make_tree(4)
+
+        # when / then
+        with pytest.raises(ValueError):
+            encoding.decode_mismatches(plain, b"\x01" * 32)
+
+
+class TestMismatchError:
+
+    @pytest.mark.parametrize(
+        "forge, error_type",
+        [
+            (encoding.encode_forge_first_leaf, encoding.LeafDigestMismatchError),
+            (
+                encoding.encode_forge_first_leaf_first_hash,
+                encoding.NodeDigestMismatchError,
+            ),
+        ],
+    )
+    def test_should_build_error_on_request(self, forge, error_type):
+        # given
+        plain = make_tree(4)
+        key = generate_bytes(32, seed=99)
+        encoded = forge(plain, key)
+        _, [mismatch] = encoding.decode_mismatches(encoded, key)
+
+        # when
+        error = encoding.mismatch_error(encoded, key, mismatch)
+
+        # then
+        assert type(error) is error_type
+        assert (error.index_in, error.index_out) == mismatch
+        assert error.in1 == encoded.leaves[mismatch.index_in]
+        assert error.in2 == encoded.leaves[mismatch.index_in + 1]
+        assert error.out == encoded.leaves[mismatch.index_out]
+        assert error.expected_digest != error.actual_digest
+
+    def test_should_build_forged_leaf_digests(self):
+        # given
+        plain = make_tree(4)
+        key = generate_bytes(32, seed=99)
+        encoded = encoding.encode_forge_first_leaf(plain, key)
+
+        # when
+        _, [error] = encoding.decode(encoded, key)
+
+        # then
+        assert error.expected_digest == plain.node_digest(1, 0)
+        forged = flat_merkle.from_list(
+            [b"\x00" * 64] + [leaf.data for leaf in plain.leaves[1:]]
+        )
+        assert error.actual_digest == forged.node_digest(1, 0)
+
+
+class TestDecodeModes:
+
+    def make_corrupted(self, count, key):
+        # corrupt two leaves so that full mode reports two leaf mismatches
+        leaves = encoding.encode(make_tree(count), key).leaves
+        leaves[0] = type(leaves[0])(b"\x00" * 64)
+        leaves[count - 1] = type(leaves[count - 1])(b"\x00" * 64)
+        return flat_merkle.from_leaves(leaves)
+
+    @pytest.mark.parametrize("block_size", [1, 3, 1024])
+    def test_should_report_all_mismatches_in_full_mode(self, block_size):
+        # given
+        key = generate_bytes(32, seed=99)
+        encoded = self.make_corrupted(8, key)
+
+        # when
+        with mock.patch.object(encoding, "MISMATCH_BLOCK_SIZE", block_size):
+            decoded, mismatches = encoding.decode_mismatches(
+                encoded, key, encoding.DecodeMode.FULL
+            )
+
+        # then
+        assert decoded is not None
+        assert mismatches == [(0, 8), (6, 11)]
+
+    @pytest.mark.parametrize("block_size", [1, 3, 1024])
+    def test_should_stop_at_first_mismatch(self, block_size):
+        # given
+        key = generate_bytes(32, seed=99)
+        encoded = self.make_corrupted(8, key)
+
+        # when
+        with mock.patch.object(encoding, "MISMATCH_BLOCK_SIZE", block_size):
+            decoded, errors = encoding.decode(
+                encoded, key, encoding.DecodeMode.FIRST_ERROR
+            )
+
+        # then
+        assert decoded is not None
+        assert len(errors) == 1
+        assert type(errors[0]) is encoding.LeafDigestMismatchError
+        assert (errors[0].index_in, errors[0].index_out) == (0, 8)
+
+    def test_should_report_node_mismatch_first(self):
+        # given
+        plain = make_tree(4)
+        key = generate_bytes(32, seed=99)
+        encoded = encoding.encode_forge_first_leaf_first_hash(plain, key)
+
+        # when
+        _, mismatches = encoding.decode_mismatches(
+            encoded, key, encoding.DecodeMode.FIRST_ERROR
+        )
+
+        # then
+        assert mismatches == [(4, 6)]
+
+    @pytest.mark.parametrize("count", [1, 2, 16])
+    def test_should_verify_without_plaintext_tree(self, count):
+        # given
+        key = generate_bytes(32, seed=99)
+        encoded = encoding.encode(make_tree(count), key)
+
+        # when
+        with mock.patch.object(encoding, "from_leaves") as from_leaves:
+            decoded, mismatches = encoding.decode_mismatches(
+                encoded, key, encoding.DecodeMode.VERIFY_ONLY
+            )
+
+        # then
+        from_leaves.assert_not_called()
+        assert decoded is None
+        assert mismatches == []
+        assert encoding.verify(encoded, key)
+
+    def test_should_reject_in_verify_mode(self):
+        # given
+        key = generate_bytes(32, seed=99)
+        encoded = self.make_corrupted(8, key)
+
+        # when
+        _, mismatches = encoding.decode_mismatches(
+            encoded, key, encoding.DecodeMode.VERIFY_ONLY
+        )
+
+        # then
+        assert mismatches == [(0, 8)]
+        assert not encoding.verify(encoded, key)
+
+
+class TestCryptZeros:
+
+    @pytest.mark.parametrize("size", [1, 32, 33, 100])
+    def test_should_match_crypt_of_zero_leaves(self, size):
+        # given
+        key = generate_bytes(32, seed=99)
+        zeros = [bytes(size)] * 5
+
+        # when
+        result = encoding.crypt_zeros(5, size, 3, key)
+
+        # then
+        assert result == encoding.crypt_all(zeros, 3, key)
+
+
+class TestCryptAll:
+
+    def test_should_match_crypt_per_value(self):
+        # given
+        values = [generate_bytes(size, seed=size) for size in (32, 64, 32, 96)]
+        key = generate_bytes(32, seed=2)
+
+        # when
+        result = encoding.split(
+            encoding.crypt_all(values, 5, key), map(len, values)
+        )
+
+        # then
+        assert result == [
+            encoding.crypt(value, 5 + index, key)
+            for index, value in enumerate(values)
+        ]
+
+    def test_should_return_views_into_one_buffer(self):
+        # given
+        values = [generate_bytes(32, seed=seed) for seed in range(4)]
+        key = generate_bytes(32, seed=2)
+
+        # when
+        buffer = encoding.crypt_all(values, 0, key)
+        chunks = encoding.split(buffer, [32] * 4)
+
+        # then
+        assert all(chunk.obj is buffer for chunk in chunks)
+        assert chunks == [encoding.crypt(v, i, key) for i, v in enumerate(values)]
@@ -0,0 +1,191 @@
+import os
+from unittest import mock
+
+import pytest
+from crypto_service.app.utils import EncodingCache, encoding_cache
+from crypto_service.app.utils.merkle import MerkleTreeHashLeaf, MerkleTreeLeaf
+
+
+class TestCacheKeys:
+
+    def test_should_depend_on_data_and_key(self):
+        # given / when
+        keys = {
+            encoding_cache.encoding_key(b"\x01" * 64, b"\x02" * 32),
+            encoding_cache.encoding_key(b"\x01" * 64, b"\x03" * 32),
+            encoding_cache.encoding_key(b"\x01" * 32, b"\x01" * 32 + b"\x02" * 32),
+        }
+
+        # then
+        assert len(keys) == 3
+
+    def test_should_distinguish_hash_leaves(self):
+        # given
+        data = [b"\x01" * 32, b"\x02" * 32]
+
+        # when
+        plain = encoding_cache.root_key([MerkleTreeLeaf(x) for x in data])
+        mixed = encoding_cache.root_key(
+            [MerkleTreeLeaf(data[0]), MerkleTreeHashLeaf(data[1])]
+        )
+
+        # then
+        assert plain != mixed
+
+    @pytest.mark.parametrize("leaf_size, leaf_count", [(32, 1), (32, 2), (64, 4)])
+    def test_should_pack_and_unpack_encoding(self, leaf_size, leaf_count):
+        # given
+        leaves = [bytes([i]) * leaf_size for i in range(leaf_count)]
+        leaves += [bytes([100 + i]) * 32 for i in range(leaf_count)]
+        root = b"\xff" * 32
+
+        # when
+        unpacked = encoding_cache.unpack_encoding(
+            encoding_cache.pack_encoding((leaves, root))
+        )
+
+        # then
+        assert unpacked == (leaves, root)
+
+
+class TestMemoryTier:
+
+    def test_should_evict_least_recently_used(self):
+        # given
+        tier = encoding_cache.MemoryTier(max_bytes=64)
+        tier.set("a", b"\x00" * 32)
+        tier.set("b", b"\x00" * 32)
+        tier.get("a")
+
+        # when
+        tier.set("c", b"\x00" * 32)
+
+        # then
+        assert tier.get("a") is not None
+        assert tier.get("b") is None
+        assert tier.get("c") is not None
+
+    def test_should_skip_oversized_values(self):
+        # given
+        tier = encoding_cache.MemoryTier(max_bytes=16)
+
+        # when
+        tier.set("a", b"\x00" * 32)
+
+        # then
+        assert len(tier) == 0
+
+
+def disk_key(i):
+    return ("%x" % i) * 64
+
+
+class TestDiskTier:
+
+    @pytest.mark.asyncio
+    async def test_should_evict_least_recently_used(self, tmp_path):
+        # given
+        tier = encoding_cache.DiskTier(str(tmp_path), max_bytes=64)
+        await tier.set(disk_key(1), b"a" * 32)
+        await tier.set(disk_key(2), b"b" * 32)
+        await tier.get(disk_key(1))
+
+        # when
+        await tier.set(disk_key(3), b"c" * 32)
+
+        # then
+        assert await tier.get(disk_key(2)) is None
+        assert await tier.get(disk_key(1)) == b"a" * 32
+        assert sorted(os.listdir(tmp_path)) == [disk_key(1), disk_key(3)]
+
+    @pytest.mark.asyncio
+    async def test_should_skip_oversized_values(self, tmp_path):
+        # given
+        tier = encoding_cache.DiskTier(str(tmp_path), max_bytes=16)
+
+        # when
+        await tier.set(disk_key(1), b"a" * 32)
+
+        # then
+        assert await tier.get(disk_key(1)) is None
+        assert os.listdir(tmp_path) == []
+
+    @pytest.mark.asyncio
+    async def test_should_remove_temporary_file_on_failed_write(self, tmp_path):
+        # given
+        tier = encoding_cache.DiskTier(str(tmp_path))
+
+        # when
+        with mock.patch.object(encoding_cache.os, "replace", side_effect=OSError):
+            with pytest.raises(OSError):
+                await tier.set(disk_key(1), b"a" * 32)
+
+        # then
+        assert os.listdir(tmp_path) == []
+        assert len(tier) == 0
+
+    @pytest.mark.asyncio
+    async def test_should_evict_existing_entries_on_startup(self, tmp_path):
+        # given
+        tier = encoding_cache.DiskTier(str(tmp_path))
+        for i in range(1, 4):
+            await tier.set(disk_key(i), b"x" * 32)
+            os.utime(tmp_path / disk_key(i), (i, i))
+
+        # when
+        tier = encoding_cache.DiskTier(str(tmp_path), max_bytes=64)
+
+        # then
+        assert len(tier) == 2
+        assert sorted(os.listdir(tmp_path)) == [disk_key(2), disk_key(3)]
+
+
+class TestEncodingCache:
+
+    @pytest.fixture(autouse=True)
+    def reset(self):
+        yield
+        EncodingCache.store = None
+        EncodingCache.memory = encoding_cache.MemoryTier()
+
+    @pytest.mark.asyncio
+    async def test_should_store_on_disk(self, tmp_path):
+        # given
+        await EncodingCache.configure(directory=str(tmp_path))
+        await EncodingCache.set("key", b"value")
+
+        # when
+        await EncodingCache.configure(directory=str(tmp_path))
+
+        # then
+        assert len(EncodingCache.memory) == 0
+        assert await EncodingCache.get("key") == b"value"
+        assert EncodingCache.memory.get("key") == b"value"
+        assert await EncodingCache.get("other") is None
+
+    @pytest.mark.asyncio
+    async def test_should_treat_store_failures_as_miss(self):
+        # given
+        await EncodingCache.configure()
+        EncodingCache.store = mock.Mock(
+            get=mock.AsyncMock(side_effect=ConnectionError),
+            set=mock.AsyncMock(side_effect=ConnectionError),
+            close=mock.AsyncMock(),
+        )
+
+        # when
+        await EncodingCache.set("key", b"value")
+        EncodingCache.memory.clear()
+
+        # then
+        assert await EncodingCache.get("key") is None
+
+    @pytest.mark.asyncio
+    async def test_should_skip_redis_without_package(self):
+        # given
+        with mock.patch.dict("sys.modules", {"redis": None}):
+            # when
+            await EncodingCache.configure(redis_url="redis://localhost")
+
+        # then
+        assert EncodingCache.store is None
@@ -0,0 +1,363 @@
+import hashlib
+from unittest import mock
+
+import pytest
+from crypto_service.app.utils import encoding, flat_merkle, hashing, merkle
+from crypto_service.app.utils.bytes import generate_bytes
+
+
+def make_leaves(count, size=32):
+    return [merkle.MerkleTreeLeaf(generate_bytes(size, seed=i)) for i in range(count)]
+
+
+class TestFlatMerkleTree:
+
+    @pytest.mark.parametrize("count, size", [(1, 32), (2, 32), (8, 64), (32, 32)])
+    def test_should_match_object_tree(self, count, size):
+        # given
+        leaves = make_leaves(count, size)
+        expected = merkle.from_leaves(leaves)
+
+        # when
+        tree = flat_merkle.from_leaves(leaves)
+
+        # then
+        assert tree.digest == expected.digest
+        assert tree.leaves == expected.leaves
+        assert tree.digests_pack == expected.digests_pack
+        assert tree.digests_dfs == expected.digests_dfs
+        assert tree == expected
+
+    def test_should_match_object_tree_from_bytes(self):
+        # given
+        data = generate_bytes(256, seed=1)
+
+        # when
+        tree = flat_merkle.from_bytes(data, slices_count=4)
+
+        # then
+        assert tree.digest == merkle.from_bytes(data, slices_count=4).digest
+
+    def test_should_hash_hash_leaves_as_is(self):
+        # given
+        leaves = make_leaves(2) + [
+            merkle.MerkleTreeHashLeaf(generate_bytes(32, seed=5)),
+            merkle.MerkleTreeHashLeaf(b"\x00" * 32),
+        ]
+
+        # when
+        tree = flat_merkle.from_leaves(leaves)
+
+        # then
+        assert tree.digest == merkle.from_leaves(leaves).digest
+
+    @pytest.mark.parametrize("index", [0, 3, 6])
+    def test_should_create_valid_proof(self, index):
+        # given
+        leaves = make_leaves(8)
+        tree = flat_merkle.from_leaves(leaves)
+
+        # when
+        proof = tree.get_proof(leaves[index])
+
+        # then
+        assert proof == merkle.from_leaves(leaves).get_proof(leaves[index])
+        assert flat_merkle.FlatMerkleTree.validate_proof(
+            tree.digest, leaves[index], index, proof
+        )
+
+    @pytest.mark.parametrize("index", [0, 1, 6, 7])
+    def test_should_create_proof_by_index(self, index):
+        # given
+        leaves = make_leaves(8)
+        tree = flat_merkle.from_leaves(leaves)
+
+        # when
+        proof = tree.get_proof_by_index(index)
+
+        # then
+        assert proof == tree.get_proof(leaves[index])
+        assert proof == merkle.from_leaves(leaves).get_proof_by_index(index)
+
+    @pytest.mark.parametrize("index", [-1, 8])
+    def test_should_raise_when_proof_index_out_of_range(self, index):
+        # given
+        tree = flat_merkle.from_leaves(make_leaves(8))
+
+        # when / then
+        with pytest.raises(IndexError):
+            tree.get_proof_by_index(index)
+
+    @pytest.mark.parametrize(
+        "indices, size",
+        [
+            ([3], 3),
+            ([0, 1], 2),
+            ([0, 7], 4),
+            ([2, 3, 4, 5], 2),
+            (list(range(8)), 0),
+        ],
+    )
+    def test_should_create_deduplicated_multiproof(self, indices, size):
+        # given
+        leaves = make_leaves(8)
+        tree = flat_merkle.from_leaves(leaves)
+
+        # when
+        proof = tree.get_multiproof(indices)
+
+        # then
+        assert len(proof) == size
+        assert flat_merkle.FlatMerkleTree.validate_multiproof(
+            tree.digest, {i: leaves[i] for i in indices}, proof, tree.depth
+        )
+
+    def test_should_reject_multiproof_for_other_leaf(self):
+        # given
+        leaves = make_leaves(8)
+        tree = flat_merkle.from_leaves(leaves)
+        proof = tree.get_multiproof([1, 4])
+
+        # when
+        valid = flat_merkle.FlatMerkleTree.validate_multiproof(
+            tree.digest, {1: leaves[1], 4: leaves[5]}, proof, tree.depth
+        )
+
+        # then
+        assert not valid
+
+    def test_should_reject_incomplete_multiproof(self):
+        # given
+        leaves = make_leaves(8)
+        tree = flat_merkle.from_leaves(leaves)
+        proof = tree.get_multiproof([1, 4])
+
+        # when
+        valid = flat_merkle.FlatMerkleTree.validate_multiproof(
+            tree.digest, {1: leaves[1], 4: leaves[4]}, proof[1:], tree.depth
+        )
+
+        # then
+        assert not valid
+
+    def test_should_raise_when_leaf_not_in_tree(self):
+        # given
+        tree = flat_merkle.from_leaves(make_leaves(4))
+
+        # when / then
+        with pytest.raises(ValueError):
+            tree.get_proof(merkle.MerkleTreeLeaf(b"\x01" * 32))
+
+    @pytest.mark.parametrize("count, size", [(0, None), (3, 2), (3, 6)])
+    def test_should_raise_when_invalid_leaf_count(self, count, size):
+        # given / when / then
+        with pytest.raises(ValueError):
+            flat_merkle.from_leaves(make_leaves(count), size=size)
+
+
+class TestPaddedMerkleTree:
+
+    @pytest.mark.parametrize("module", [merkle, flat_merkle])
+    @pytest.mark.parametrize("count", [1, 3, 5, 6, 7])
+    def test_should_match_tree_of_zero_leaves(self, module, count):
+        # given
+        leaves = make_leaves(count)
+        size = 1 << (count - 1).bit_length()
+        zeros = [merkle.MerkleTreeLeaf(bytes(32)) for _ in range(size - count)]
+        expected = flat_merkle.from_leaves(leaves + zeros)
+
+        # when
+        tree = module.from_leaves(leaves)
+
+        # then
+        assert tree.digest == expected.digest
+        assert tree.leaves == leaves
+        assert tree.digests_pack == expected.digests_pack
+        assert tree.digests_dfs == expected.digests_dfs
+        for index in range(count):
+            assert tree.get_proof_by_index(index) == expected.get_proof_by_index(index)
+
+    @pytest.mark.parametrize("module", [merkle, flat_merkle])
+    def test_should_pad_to_given_size(self, module):
+        # given
+        leaves = make_leaves(3, size=64)
+        zeros = [merkle.MerkleTreeLeaf(bytes(64)) for _ in range(13)]
+
+        # when
+        tree = module.from_leaves(leaves, size=16)
+
+        # then
+        assert tree.digest == flat_merkle.from_leaves(leaves + zeros).digest
+
+    @pytest.mark.parametrize("module", [merkle, flat_merkle])
+    def test_should_not_hash_padding(self, module):
+        # given
+        module.from_leaves(make_leaves(5))
+
+        # when
+        with mock.patch.object(hashlib, "sha256", wraps=hashlib.sha256) as sha256:
+            module.from_leaves(make_leaves(5)).digest
+
+        # then
+        # 5 leaves and 3 + 2 + 1 inner nodes with a given leaf below them
+        assert sha256.call_count == 11
+
+    @pytest.mark.parametrize("count, workers", [(5, 2), (13, 4), (3, 8)])
+    def test_should_build_same_padded_tree_in_parallel(self, count, workers):
+        # given
+        leaves = make_leaves(count)
+        expected = flat_merkle.from_leaves(leaves, workers=1)
+
+        # when
+        try:
+            tree = flat_merkle.from_leaves(leaves, workers=workers, threshold=1)
+        finally:
+            flat_merkle.shutdown_pool()
+
+        # then
+        assert tree.digests_pack == expected.digests_pack
+        assert tree.level(0) == expected.level(0)
+
+    def test_should_encode_and_decode_padded_tree(self):
+        # given
+        leaves = make_leaves(5)
+        key = generate_bytes(32, seed=8)
+
+        # when
+        encoded = encoding.encode(flat_merkle.from_leaves(leaves), key)
+        decoded, errors = encoding.decode(encoded, key)
+
+        # then
+        assert len(encoded.leaves) == 16
+        assert errors == []
+        assert decoded.leaves[:5] == leaves
+        assert [leaf.data for leaf in decoded.leaves[5:]] == [bytes(32)] * 3
+        assert decoded.digest == flat_merkle.from_leaves(leaves).digest
+
+
+class TestEncodingWithFlatMerkleTree:
+
+    def test_should_encode_like_object_tree(self):
+        # given
+        data = generate_bytes(128, seed=7)
+        key = generate_bytes(32, seed=8)
+
+        # when
+        encoded = encoding.encode(flat_merkle.from_bytes(data, 4), key)
+
+        # then
+        expected = encoding.encode(merkle.from_bytes(data, 4), key)
+        assert encoded.digest == expected.digest
+        assert [leaf.data for leaf in encoded.leaves] == [
+            leaf.data for leaf in expected.leaves
+        ]
+
+    def test_should_decode_encoding(self):
+        # given
+        plain = flat_merkle.from_bytes(generate_bytes(256, seed=9), 8)
+        key = generate_bytes(32, seed=10)
+
+        # when
+        decoded, errors = encoding.decode(encoding.encode(plain, key), key)
+
+        # then
+        assert errors == []
+        assert decoded.digest == plain.digest
+        assert decoded.leaves == plain.leaves
+
+    def test_should_report_forged_leaf(self):
+        # given
+        plain = flat_merkle.from_bytes(generate_bytes(128, seed=11), 4)
+        key = generate_bytes(32, seed=12)
+
+        # when
+        _, errors = encoding.decode(
+            encoding.encode_forge_first_leaf(plain, key), key
+        )
+
+        # then
+        assert len(errors) == 1
+        assert isinstance(errors[0], encoding.LeafDigestMismatchError)
+        assert (errors[0].index_in, errors[0].index_out) == (0, 4)
+
+    def test_should_report_forged_node(self):
+        # given
+        plain = flat_merkle.from_bytes(generate_bytes(128, seed=13), 4)
+        key = generate_bytes(32, seed=14)
+
+        # when
+        _, errors = encoding.decode(
+            encoding.encode_forge_first_leaf_first_hash(plain, key), key
+        )
+
+        # then
+        assert len(errors) == 1
+        assert type(errors[0]) is encoding.NodeDigestMismatchError
+        assert (errors[0].index_in, errors[0].index_out) == (4, 6)
+
+
+class TestParallelFlatMerkleTree:
+
+    @pytest.fixture(autouse=True)
+    def pool(self):
+        yield
+        flat_merkle.shutdown_pool()
+
+    @pytest.mark.parametrize("count, workers", [(2, 2), (16, 2), (64, 3), (4, 8)])
+    def test_should_build_same_tree_in_parallel(self, count, workers):
+        # given
+        leaves = make_leaves(count)
+        expected = flat_merkle.from_leaves(leaves)
+
+        # when
+        tree = flat_merkle.from_leaves(leaves, workers=workers, threshold=2)
+
+        # then
+        assert tree.digest == expected.digest
+        assert tree.digests_pack == expected.digests_pack
+
+    def test_should_stay_serial_below_threshold(self):
+        # given
+        flat_merkle.configure_parallelism(workers=4, threshold=64)
+
+        # when
+        with mock.patch.object(flat_merkle, "_get_pool") as get_pool:
+            flat_merkle.from_leaves(make_leaves(32))
+
+        # then
+        get_pool.assert_not_called()
+        flat_merkle.configure_parallelism(workers=1)
+
+    def test_should_not_fork_pool_workers(self):
+        # given
+        flat_merkle.configure_parallelism(workers=2)
+
+        # when
+        with mock.patch.object(flat_merkle, "ProcessPoolExecutor") as executor:
+            flat_merkle._get_pool()
+
+        # then
+        context = executor.call_args.kwargs["mp_context"]
+        assert context.get_start_method() in ("forkserver", "spawn")
+        flat_merkle.configure_parallelism(workers=1)
+
+    def test_should_configure_hash_backend_in_pool_workers(self):
+        # given
+        flat_merkle.configure_parallelism(workers=2)
+        hashing.configure_backend("threads")
+
+        # when
+        with mock.patch.object(flat_merkle, "ProcessPoolExecutor") as executor:
+            flat_merkle._get_pool()
+
+        # then
+        kwargs = executor.call_args.kwargs
+        assert kwargs["initializer"] is hashing.configure_worker_backend
+        assert kwargs["initargs"] == ("threads",)
+        hashing.configure_backend()
+        flat_merkle.configure_parallelism(workers=1)
+
+    def test_should_raise_when_workers_invalid(self):
+        # given / when / then
+        with pytest.raises(ValueError):
+            flat_merkle.configure_parallelism(workers=0)
@@ -0,0 +1,291 @@
+import hashlib
+import subprocess
+import sys
+
+import pytest
+from eth_abi.packed import encode_packed
+from web3 import Web3
+from crypto_service.app.utils import flat_merkle, hashing, merkle
+from crypto_service.app.utils.bytes import generate_bytes
+
+
+def reference_hash_pair(left, right):
+    return hashlib.sha256(
+        encode_packed(
+            ["bytes32", "bytes32"],
+            [Web3.toBytes(hexstr=left.hex()), Web3.toBytes(hexstr=right.hex())],
+        )
+    ).digest()
+
+
+def reference_hash_leaf(data):
+    data_as_list = [data[i * 32 : (i + 1) * 32] for i in range(len(data) // 32)]
+    return hashlib.sha256(
+        encode_packed(["bytes[%d]" % len(data_as_list)], [data_as_list])
+    ).digest()
+
+
+def reference_root(leaves):
+    nodes = [reference_hash_leaf(leaf) for leaf in leaves]
+    while len(nodes) > 1:
+        nodes = [
+            reference_hash_pair(nodes[i], nodes[i + 1])
+            for i in range(0, len(nodes), 2)
+        ]
+    return nodes[0]
+
+
+class TestHashingConformance:
+
+    @pytest.mark.parametrize("seed", range(8))
+    def test_should_hash_pair_like_encode_packed(self, seed):
+        # given
+        left = generate_bytes(32, seed=seed)
+        right = generate_bytes(32, seed=seed + 100)
+
+        # when
+        digest = hashing.hash_pair(left, right)
+
+        # then
+        assert digest == reference_hash_pair(left, right)
+
+    def test_should_pad_short_values_like_encode_packed(self):
+        # given
+        left, right = b"\x01" * 20, b"\x02" * 32
+
+        # when
+        digest = hashing.hash_pair(left, right)
+
+        # then
+        assert digest == hashlib.sha256(
+            encode_packed(["bytes32", "bytes32"], [left, right])
+        ).digest()
+
+    def test_should_raise_when_value_too_long(self):
+        # given / when / then
+        with pytest.raises(ValueError):
+            hashing.hash_pair(b"\x01" * 33, b"\x02" * 32)
+
+    @pytest.mark.parametrize("size", [32, 64, 96, 1024, 40])
+    def test_should_hash_leaf_like_encode_packed(self, size):
+        # given
+        data = generate_bytes(size, seed=size)
+
+        # when
+        digest = hashing.hash_leaf(data)
+
+        # then
+        assert digest == reference_hash_leaf(data)
+
+    @pytest.mark.parametrize("count, size", [(2, 32), (8, 64), (64, 32)])
+    def test_should_build_same_roots_as_encode_packed(self, count, size):
+        # given
+        leaves = [generate_bytes(size, seed=i) for i in range(count)]
+
+        # when
+        roots = [merkle.from_list(leaves).digest, flat_merkle.from_list(leaves).digest]
+
+        # then
+        assert roots == [reference_root(leaves)] * 2
+
+    def test_should_not_import_web3_with_merkle(self):
+        # given
+        code = (
+            "import sys; import crypto_service.app.utils.merkle; "
+            "sys.exit('web3' in sys.modules or 'eth_abi' in sys.modules)"
+        )
+
+        # when
+        result = subprocess.run([sys.executable, "-c", code])
+
+        # then
+        assert result.returncode == 0
+
+
+class TestHashPairs:
+
+    @pytest.mark.parametrize("count", [0, 1, 4])
+    def test_should_hash_consecutive_pairs(self, count):
+        # given
+        digests = [generate_bytes(32, seed=i) for i in range(2 * count)]
+
+        # when
+        hashed = hashing.hash_pairs(b"".join(digests))
+
+        # then
+        assert hashed == b"".join(
+            hashing.hash_pair(digests[i], digests[i + 1])
+            for i in range(0, len(digests), 2)
+        )
+
+    def test_should_raise_on_odd_digest_count(self):
+        # given / when / then
+        with pytest.raises(ValueError):
+            hashing.hash_pairs(b"\x00" * 96)
+
+
+class CountingBackend(hashing.HashBackend):
+    name = "counting"
+
+    def __init__(self):
+        self.calls = 0
+        self.leaf_calls = 0
+
+    def hash_many(self, messages, size=64):
+        self.calls += 1
+        return super(CountingBackend, self).hash_many(messages, size)
+
+    def hash_each(self, messages):
+        self.leaf_calls += 1
+        return super(CountingBackend, self).hash_each(messages)
+
+
+class BrokenBackend(hashing.HashBackend):
+    name = "broken"
+
+    def hash_many(self, messages, size=64):
+        return bytes(len(messages) // size * 32)
+
+
+class BrokenEachBackend(hashing.HashBackend):
+    name = "broken-each"
+
+    def hash_each(self, messages):
+        return bytes(len(messages) * 32)
+
+
+class TestHashBackend:
+
+    @pytest.fixture(autouse=True)
+    def restore_backend(self, monkeypatch):
+        monkeypatch.setattr(hashing, "_providers", dict(hashing._providers))
+        monkeypatch.setattr(hashing, "_pool_worker", False)
+        yield
+        hashing.configure_backend()
+
+    @pytest.mark.parametrize("size", [1, 64, 100])
+    def test_should_hash_every_message(self, size):
+        # given
+        messages = [generate_bytes(size, seed=i) for i in range(5)]
+
+        # when
+        digests = hashing.hash_many(b"".join(messages), size)
+
+        # then
+        assert digests == b"".join(hashlib.sha256(m).digest() for m in messages)
+
+    def test_should_hash_leaves_like_hash_leaf(self):
+        # given
+        sizes = [64, 64, 0, 40, 64, 96, 96, 10]
+        leaves = [generate_bytes(size, seed=i) for i, size in enumerate(sizes)]
+
+        # when
+        digests = hashing.hash_leaves(leaves)
+
+        # then
+        assert digests == b"".join(hashing.hash_leaf(leaf) for leaf in leaves)
+
+    def test_should_hash_large_messages_on_threads(self):
+        # given
+        messages = [generate_bytes(4096, seed=i) for i in range(7)]
+
+        # when
+        backend = hashing.configure_backend("threads")
+        digests = hashing.hash_many(b"".join(messages), 4096)
+
+        # then
+        assert isinstance(backend, hashing.ThreadedHashBackend)
+        assert digests == b"".join(hashlib.sha256(m).digest() for m in messages)
+
+    def test_should_hash_large_batches_in_processes(self, monkeypatch):
+        # given
+        monkeypatch.setattr(hashing.ProcessHashBackend, "min_bytes", 64)
+        backend = hashing.ProcessHashBackend(workers=2)
+        messages = [generate_bytes(64, seed=i) for i in range(7)]
+
+        # when
+        digests = backend.hash_many(b"".join(messages))
+        backend.close()
+
+        # then
+        assert digests == b"".join(hashlib.sha256(m).digest() for m in messages)
+
+    def test_should_hash_serially_in_pool_workers(self, monkeypatch):
+        # given
+        monkeypatch.setattr(hashing.ProcessHashBackend, "min_bytes", 64)
+        backend = hashing.configure_worker_backend("processes")
+        backend._workers = 2
+
+        # when
+        hashing.hash_many(bytes(256))
+
+        # then
+        assert backend._executor is None
+
+    def test_should_shut_down_previous_backend(self):
+        # given
+        backend = hashing.configure_backend("threads")
+        backend._workers = 2
+        hashing.hash_leaves([bytes(4096)] * 2)
+        assert backend._executor is not None
+
+        # when
+        hashing.configure_backend()
+
+        # then
+        assert backend._executor is None
+
+    @pytest.mark.parametrize("size", [0, 3])
+    def test_should_raise_on_partial_message(self, size):
+        # given / when / then
+        with pytest.raises(ValueError):
+            hashing.hash_many(b"\x00" * 64, size)
+
+    def test_should_use_configured_backend(self):
+        # given
+        hashing.register_backend("counting", CountingBackend)
+        leaves = [generate_bytes(32, seed=i) for i in range(8)]
+
+        # when
+        backend = hashing.configure_backend("counting")
+        backend.calls = backend.leaf_calls = 0
+        root = flat_merkle.from_list(leaves).digest
+
+        # then
+        assert hashing.get_backend() is backend
+        assert backend.calls == 3
+        assert backend.leaf_calls == 1
+        assert root == reference_root(leaves)
+
+    def test_should_import_backend_by_path(self):
+        # when
+        backend = hashing.configure_backend("%s:CountingBackend" % __name__)
+
+        # then
+        assert isinstance(backend, CountingBackend)
+
+    @pytest.mark.parametrize(
+        "name", ["missing_hash_provider:Backend", "%s:Missing" % __name__]
+    )
+    def test_should_fall_back_to_hashlib_if_not_installed(self, name):
+        # when
+        backend = hashing.configure_backend(name)
+
+        # then
+        assert type(backend) is hashing.HashBackend
+
+    @pytest.mark.parametrize("factory", [BrokenBackend, BrokenEachBackend])
+    def test_should_fall_back_to_hashlib_if_incorrect(self, factory):
+        # given
+        hashing.register_backend("broken", factory)
+
+        # when
+        backend = hashing.configure_backend("broken")
+
+        # then
+        assert type(backend) is hashing.HashBackend
+
+    def test_should_raise_on_unknown_backend(self):
+        # given / when / then
+        with pytest.raises(ValueError):
+            hashing.configure_backend("unknown")
@@ -0,0 +1,73 @@
+from unittest import mock
+
+import pytest
+from eth_abi.packed import encode_packed
+import hashlib
+from crypto_service.app.utils import keystream
+from crypto_service.app.utils.bytes import generate_bytes
+
+
+def reference_pad(index, key):
+    return hashlib.sha256(encode_packed(["uint256", "bytes32"], [index, key])).digest()
+
+
+class TestKeystream:
+
+    @pytest.mark.parametrize("key_size", [32, 16])
+    def test_should_match_encode_packed_pads(self, key_size):
+        # given
+        key = generate_bytes(key_size, seed=1)
+
+        # when
+        stream = keystream.derive(key, 3, 9)
+
+        # then
+        assert stream == b"".join(reference_pad(i, key) for i in range(3, 9))
+        assert keystream.pad(5, key) == reference_pad(5, key)
+
+    def test_should_raise_when_key_too_long(self):
+        # given / when / then
+        with pytest.raises(ValueError):
+            keystream.derive(b"\x01" * 33, 0, 1)
+
+    def test_should_serve_repeated_range_from_cache(self):
+        # given
+        cache = keystream.KeystreamCache()
+        key = generate_bytes(32, seed=2)
+        first = cache.get(key, 0, 8)
+
+        # when
+        with mock.patch.object(keystream, "derive") as derive:
+            second = cache.get(key, 0, 8)
+
+        # then
+        derive.assert_not_called()
+        assert second == first
+
+    def test_should_evict_least_recently_used_ranges(self):
+        # given
+        cache = keystream.KeystreamCache(max_bytes=3 * 32)
+        key = generate_bytes(32, seed=3)
+        cache.get(key, 0, 1)
+        cache.get(key, 1, 2)
+        cache.get(key, 2, 3)
+        cache.get(key, 0, 1)
+
+        # when
+        cache.get(key, 3, 4)
+
+        # then
+        assert len(cache) == 3
+        assert (key, 1, 2) not in cache._entries
+        assert (key, 0, 1) in cache._entries
+
+    def test_should_not_cache_ranges_larger_than_limit(self):
+        # given
+        cache = keystream.KeystreamCache(max_bytes=32)
+
+        # when
+        stream = cache.get(b"\x01" * 32, 0, 2)
+
+        # then
+        assert len(stream) == 64
+        assert len(cache) == 0
@@ -0,0 +1,407 @@
+import gc
+import hashlib
+import weakref
+from unittest import mock
+
+import pytest
+from crypto_service.app.utils import hashing, merkle
+
+
+def make_leaves(count):
+    return [merkle.MerkleTreeLeaf(i.to_bytes(32, "big")) for i in range(count)]
+
+
+class TestMerkleTreeDigestMemoization:
+    def test_should_hash_each_node_once(self):
+        # given
+        root = merkle.from_leaves(make_leaves(16))
+
+        # when
+        with mock.patch.object(
+            hashing.hashlib, "sha256", wraps=hashlib.sha256
+        ) as sha256:
+            root.digest
+            root.digest
+            root.leaves[3].digest
+
+        # then
+        assert sha256.call_count == 31
+
+    @pytest.mark.parametrize("index", [0, 5, 15])
+    def test_should_invalidate_path_on_leaf_update(self, index):
+        # given
+        leaves = make_leaves(16)
+        root = merkle.from_leaves(leaves)
+        root.digest
+
+        # when
+        with mock.patch.object(
+            hashing.hashlib, "sha256", wraps=hashlib.sha256
+        ) as sha256:
+            leaves[index].data = b"\xff" * 32
+            digest = root.digest
+
+        # then
+        assert sha256.call_count == 5
+        expected = make_leaves(16)
+        expected[index] = merkle.MerkleTreeLeaf(b"\xff" * 32)
+        assert digest == merkle.from_leaves(expected).digest
+
+    def test_should_invalidate_every_tree_sharing_a_leaf(self):
+        # given
+        leaves = make_leaves(4)
+        first = merkle.from_leaves(leaves)
+        second = merkle.from_leaves(leaves[:2])
+        first.digest, second.digest
+
+        # when
+        leaves[1].data = b"\xff" * 32
+
+        # then
+        updated = [leaves[0], merkle.MerkleTreeLeaf(b"\xff" * 32)] + make_leaves(4)[2:]
+        assert first.digest == merkle.from_leaves(updated).digest
+        assert second.digest == merkle.from_leaves(updated[:2]).digest
+
+    def test_should_return_hash_leaf_data_as_digest(self):
+        # given
+        leaf = merkle.MerkleTreeHashLeaf(b"\x01" * 32)
+        leaf.digest
+
+        # when
+        leaf.data = b"\x02" * 32
+
+        # then
+        assert leaf.digest == b"\x02" * 32
+
+    def test_should_free_trees_without_cycle_collection(self):
+        # given
+        leaves = make_leaves(8)
+        root = merkle.from_leaves(leaves)
+        ref = weakref.ref(root)
+        root.digest
+
+        # when
+        gc.disable()
+        try:
+            del root
+            freed = ref() is None
+        finally:
+            gc.enable()
+
+        # then
+        assert freed
+
+    def test_should_invalidate_deep_trees(self):
+        # given
+        leaves = make_leaves(5001)
+        root = leaves[0]
+        for leaf in leaves[1:]:
+            root = merkle.MerkleTreeNode(root, leaf)
+        root.digests_dfs
+
+        # when
+        leaves[0].data = b"\xff" * 32
+
+        # then
+        assert root._digest is None
+
+    def test_should_keep_zero_subtree_digests(self):
+        # given
+        leaves = make_leaves(3)
+        root = merkle.from_leaves(leaves)
+        zero = root.children[1].children[1]
+        root.digest
+
+        # when
+        leaves[2].data = b"\xff" * 32
+
+        # then
+        assert zero._digest == hashing.zero_subtree_digest(zero._leaf_digest, 0)
+        expected = merkle.from_list([leaf.data for leaf in leaves] + [bytes(32)])
+        assert root.digest == expected.digest
+
+
+class TestMerkleTreeProofValidation:
+
+    @pytest.mark.parametrize("index", [0, 5, 15])
+    def test_should_validate_proof(self, index):
+        # given
+        leaves = make_leaves(16)
+        root = merkle.from_leaves(leaves)
+
+        # when
+        valid = merkle.MerkleTreeNode.validate_proof(
+            root.digest, leaves[index], index, root.get_proof(leaves[index])
+        )
+
+        # then
+        assert valid
+
+    def test_should_reject_proof_for_wrong_index(self):
+        # given
+        leaves = make_leaves(16)
+        root = merkle.from_leaves(leaves)
+
+        # when
+        valid = merkle.MerkleTreeNode.validate_proof(
+            root.digest, leaves[2], 3, root.get_proof(leaves[2])
+        )
+
+        # then
+        assert not valid
+
+    @pytest.mark.parametrize("index", [-1, 5, 7, 8])
+    def test_should_raise_when_proof_index_out_of_range(self, index):
+        # given
+        root = merkle.from_leaves(make_leaves(5))
+
+        # when / then
+        with pytest.raises(IndexError):
+            root.get_proof_by_index(index)
+
+    def test_should_raise_when_proof_digest_has_wrong_size(self):
+        # given
+        leaves = make_leaves(4)
+        root = merkle.from_leaves(leaves)
+        proof = root.get_proof(leaves[0])
+
+        # when / then
+        with pytest.raises(ValueError):
+            merkle.MerkleTreeNode.validate_proof(
+                root.digest, leaves[0], 0, [proof[0][:31], proof[1]]
+            )
+
+    @pytest.mark.parametrize("workers", [1, 3])
+    def test_should_validate_proofs_in_batch(self, workers):
+        # given
+        leaves = make_leaves(16)
+        root = merkle.from_leaves(leaves)
+        proofs = [(leaf, i, root.get_proof_by_index(i)) for i, leaf in enumerate(leaves)]
+        proofs[7] = (leaves[7], 6, proofs[7][2])
+
+        # when
+        results = merkle.MerkleTreeNode.validate_proofs(
+            root.digest, proofs, workers=workers
+        )
+
+        # then
+        assert results == [i != 7 for i in range(16)]
+
+    @pytest.mark.parametrize("workers", [1, 3])
+    def test_should_reject_malformed_proof_in_batch(self, workers):
+        # given
+        leaves = make_leaves(8)
+        root = merkle.from_leaves(leaves)
+        proofs = [
+            (leaf, i, root.get_proof_by_index(i)) for i, leaf in enumerate(leaves)
+        ]
+        proofs[2] = (leaves[2], 2, [proofs[2][2][0][:31]] + proofs[2][2][1:])
+
+        # when
+        results = merkle.MerkleTreeNode.validate_proofs(
+            root.digest, proofs, workers=workers
+        )
+
+        # then
+        assert results == [i != 2 for i in range(8)]
+
+
+def reference_digests_pack(root):
+    def collect(node, level):
+        if not node.children:
+            return []
+        nested = [collect(child, level + 1) for child in node.children]
+        return [item for items in nested for item in items] + [(node.digest, level)]
+
+    return [digest for digest, _ in sorted(collect(root, 0), key=lambda d: -d[1])]
+
+
+class TestMerkleTreeDigestsPack:
+
+    @pytest.mark.parametrize("count", [1, 2, 4, 32])
+    def test_should_order_digests_by_level(self, count):
+        # given
+        root = merkle.from_leaves(make_leaves(count))
+
+        # when
+        digests = root.digests_pack
+
+        # then
+        assert digests == reference_digests_pack(root)
+
+    def test_should_hash_each_inner_node_once(self):
+        # given
+        root = merkle.from_leaves(make_leaves(64))
+
+        # when
+        with mock.patch.object(
+            hashing.hashlib, "sha256", wraps=hashlib.sha256
+        ) as sha256:
+            root.digests_pack
+
+        # then
+        assert sha256.call_count == 127
+
+
+class TestMerkleTreeFromBytes:
+
+    def test_should_share_data_between_leaves(self):
+        # given
+        data = bytes(range(128))
+
+        # when
+        root = merkle.from_bytes(data, slices_count=4)
+
+        # then
+        for index, leaf in enumerate(root.leaves):
+            assert isinstance(leaf.data, memoryview)
+            assert leaf.data.obj is data
+            assert leaf.data == data[index * 32 : (index + 1) * 32]
+
+    def test_should_hash_views_like_bytes(self):
+        # given
+        data = bytes(range(128))
+
+        # when
+        root = merkle.from_bytes(data, slices_count=4)
+
+        # then
+        expected = merkle.from_list([data[i : i + 32] for i in range(0, 128, 32)])
+        assert root.digest == expected.digest
+
+    def test_should_hash_hash_leaf_views(self):
+        # given
+        data = bytes(range(64))
+        view = memoryview(data)
+
+        # when
+        root = merkle.from_leaves(
+            [merkle.MerkleTreeHashLeaf(view[:32]), merkle.MerkleTreeHashLeaf(view[32:])]
+        )
+
+        # then
+        assert root.digest == hashlib.sha256(data).digest()
+
+
+class TestMerkleTreeNodeLayout:
+
+    @pytest.mark.parametrize(
+        "node",
+        [
+            merkle.MerkleTreeNode(),
+            merkle.MerkleTreeLeaf(bytes(32)),
+            merkle.MerkleTreeHashLeaf(bytes(32)),
+            merkle.zero_node(bytes(32), 1),
+        ],
+    )
+    def test_should_not_have_instance_dict(self, node):
+        # then
+        assert not hasattr(node, "__dict__")
+
+    def test_should_keep_children_in_tuple(self):
+        # given
+        leaves = make_leaves(2)
+
+        # when
+        root = merkle.MerkleTreeNode(*leaves)
+
+        # then
+        assert root.children == tuple(leaves)
+
+    def test_should_cache_leaves_of_queried_node_only(self):
+        # given
+        leaves = make_leaves(8)
+        root = merkle.from_leaves(leaves)
+
+        # when
+        result = root.leaves
+
+        # then
+        assert result == leaves
+        assert all(a is b for a, b in zip(result, leaves))
+        assert root._leaves is not None
+        assert root.children[0]._leaves is None
+
+    def test_should_reuse_leaves_of_subtree(self):
+        # given
+        leaves = make_leaves(8)
+        root = merkle.from_leaves(leaves)
+        left = root.children[0].leaves
+
+        # when
+        result = root.leaves
+
+        # then
+        assert left == leaves[:4]
+        assert result == leaves
+
+    def test_should_leave_out_padding_from_leaves(self):
+        # given
+        leaves = make_leaves(5)
+
+        # when
+        root = merkle.from_leaves(leaves)
+
+        # then
+        assert root.leaves == leaves
+
+
+def make_chain(depth):
+    # unbalanced tree, every inner node has a leaf as its right child
+    leaves = make_leaves(depth + 1)
+    root = leaves[0]
+    for leaf in leaves[1:]:
+        root = merkle.MerkleTreeNode(root, leaf)
+    return root, leaves
+
+
+class TestMerkleTreeTraversal:
+
+    def test_should_order_digests_dfs_in_post_order(self):
+        # given
+        leaves = make_leaves(4)
+        left = merkle.MerkleTreeNode(leaves[0], leaves[1])
+        right = merkle.MerkleTreeNode(leaves[2], leaves[3])
+        root = merkle.MerkleTreeNode(left, right)
+
+        # when
+        digests = root.digests_dfs
+
+        # then
+        assert digests == [left.digest, right.digest, root.digest]
+
+    def test_should_include_zero_subtrees_in_digests_dfs(self):
+        # given
+        root = merkle.from_leaves(make_leaves(5))
+        zero = merkle.zero_node(hashing.zero_leaf_digest(32), 1)
+
+        # when
+        digests = root.digests_dfs
+
+        # then
+        assert len(digests) == 7
+        assert digests[4] == zero.digest
+        assert digests[-1] == root.digest
+
+    def test_should_traverse_deep_trees(self):
+        # given
+        root, leaves = make_chain(5000)
+
+        # when
+        digests = root.digests_dfs
+
+        # then
+        assert len(digests) == 5000
+        assert digests[-1] == root.digest
+        assert root.leaves == leaves
+        assert root.has_indirect_child(leaves[0])
+
+    def test_should_find_indirect_children(self):
+        # given
+        leaves = make_leaves(5)
+        root = merkle.from_leaves(leaves[:4])
+
+        # when / then
+        assert root.has_indirect_child(leaves[3])
+        assert root.has_indirect_child(root.children[1])
+        assert not root.has_indirect_child(leaves[4])
@@ -0,0 +1,122 @@
+import pytest
+from crypto_service.app.utils import encoding, flat_merkle, merkle
+from crypto_service.app.utils.bytes import generate_bytes
+from crypto_service.app.utils.profile import DEFAULT_PROFILE, EncodingProfile, Padding
+
+
+class TestEncodingProfileLayout:
+
+    @pytest.mark.parametrize(
+        "profile, data_size, expected",
+        [
+            (DEFAULT_PROFILE, 64, (2, 32)),
+            (EncodingProfile(slices_count=4), 256, (4, 64)),
+            (EncodingProfile(leaf_size=64), 512, (8, 64)),
+            (EncodingProfile(leaf_size=64, padding=Padding.ZERO), 300, (8, 64)),
+            (EncodingProfile(leaf_size=64, padding=Padding.ZERO), 10, (2, 64)),
+            (EncodingProfile(slices_count=4, padding=Padding.ZERO), 100, (4, 32)),
+            (EncodingProfile(64, 4, Padding.ZERO), 100, (4, 64)),
+        ],
+    )
+    def test_should_lay_out_leaves(self, profile, data_size, expected):
+        # given / when
+        layout = profile.layout(data_size)
+
+        # then
+        assert layout == expected
+
+    @pytest.mark.parametrize(
+        "profile, data_size",
+        [
+            (EncodingProfile(slices_count=3), 96),
+            (EncodingProfile(leaf_size=48), 96),
+            (EncodingProfile(leaf_size=32), 96),
+            (EncodingProfile(leaf_size=64), 100),
+            (EncodingProfile(slices_count=4), 100),
+            (EncodingProfile(64, 2, Padding.ZERO), 200),
+            (EncodingProfile(slices_count=2**20, padding=Padding.ZERO), 64),
+            (EncodingProfile(32, 2**20, Padding.ZERO), 64),
+            (EncodingProfile(leaf_size=2**30, padding=Padding.ZERO), 64),
+        ],
+    )
+    def test_should_raise_when_data_does_not_fit(self, profile, data_size):
+        # given / when / then
+        with pytest.raises(ValueError):
+            profile.layout(data_size)
+
+
+class TestEncodingProfileSplit:
+
+    def test_should_split_like_from_bytes_by_default(self):
+        # given
+        data = generate_bytes(64, seed=1)
+
+        # when
+        leaves = DEFAULT_PROFILE.split(data)
+
+        # then
+        assert leaves == [data[:32], data[32:]]
+        assert all(leaf.obj is data for leaf in leaves)
+
+    def test_should_pad_with_zeros(self):
+        # given
+        data = generate_bytes(80, seed=2)
+
+        # when
+        leaves = EncodingProfile(leaf_size=32, padding=Padding.ZERO).split(data)
+
+        # then
+        assert b"".join(leaves) == data + bytes(16)
+        assert [len(leaf) for leaf in leaves] == [32] * 3
+        assert leaves[0].obj is data
+
+    def test_should_check_leaf_sizes(self):
+        # given
+        profile = EncodingProfile(leaf_size=64, slices_count=2)
+
+        # when / then
+        profile.check([64, 64])
+        with pytest.raises(ValueError):
+            profile.check([64, 32])
+        with pytest.raises(ValueError):
+            profile.check([64, 64, 64, 64])
+
+
+class TestEncodingProfileTrees:
+
+    @pytest.mark.parametrize("module", [merkle, flat_merkle])
+    def test_should_keep_default_tree(self, module):
+        # given
+        data = generate_bytes(64, seed=3)
+
+        # when
+        tree = module.from_bytes(data, profile=DEFAULT_PROFILE)
+
+        # then
+        assert tree.digest == module.from_bytes(data).digest
+
+    def test_should_build_fewer_nodes_with_larger_leaves(self):
+        # given
+        data = generate_bytes(1024, seed=4)
+        key = generate_bytes(32, seed=5)
+
+        # when
+        small = encoding.encode_bytes(data, key, EncodingProfile(leaf_size=32))
+        large = encoding.encode_bytes(data, key, EncodingProfile(leaf_size=256))
+
+        # then
+        assert len(small.leaves) == 64
+        assert len(large.leaves) == 8
+        decoded, errors = encoding.decode(large, key)
+        assert errors == []
+        assert b"".join(leaf.data for leaf in decoded.leaves) == data
+
+    def test_should_reject_encoding_of_another_profile(self):
+        # given
+        data = generate_bytes(1024, seed=4)
+        key = generate_bytes(32, seed=5)
+        encoded = encoding.encode_bytes(data, key, EncodingProfile(leaf_size=256))
+
+        # when / then
+        with pytest.raises(ValueError):
+            encoding.decode(encoded, key, profile=EncodingProfile(leaf_size=128))
@@ -0,0 +1,95 @@
+import io
+
+import pytest
+from crypto_service.app.utils import encoding, flat_merkle, streaming
+from crypto_service.app.utils.bytes import generate_bytes
+
+
+def make_chunks(count, size=32):
+    return [generate_bytes(size, seed=i) for i in range(count)]
+
+
+class TestStreamingEncoder:
+
+    @pytest.mark.parametrize("count, size", [(1, 32), (2, 32), (8, 64), (64, 32)])
+    def test_should_match_encode(self, count, size):
+        # given
+        chunks = make_chunks(count, size)
+        key = generate_bytes(32, seed=100)
+        expected = encoding.encode(flat_merkle.from_list(chunks), key)
+
+        # when
+        encoder = streaming.StreamingEncoder(key, count)
+        emitted = []
+        for chunk in chunks:
+            emitted.extend(encoder.update(chunk))
+        emitted.extend(encoder.finalize())
+
+        # then
+        assert encoder.digest == expected.digest
+        assert [value for _, value in sorted(emitted)] == [
+            leaf.data for leaf in expected.leaves
+        ]
+
+    def test_should_emit_digests_once_final(self):
+        # given
+        encoder = streaming.StreamingEncoder(b"\x01" * 32, 4)
+
+        # when
+        emitted = [
+            [position for position, _ in encoder.update(chunk)]
+            for chunk in make_chunks(4)
+        ]
+
+        # then
+        assert emitted == [[0], [1, 4], [2], [3, 5, 6]]
+
+    def test_should_encode_file(self):
+        # given
+        chunks = make_chunks(16, 64)
+        key = generate_bytes(32, seed=101)
+        source, target = io.BytesIO(b"".join(chunks)), io.BytesIO()
+        expected = encoding.encode(flat_merkle.from_list(chunks), key)
+
+        # when
+        root = streaming.encode_file(source, target, key, 64)
+
+        # then
+        assert root == expected.digest
+        assert target.getvalue() == b"".join(leaf.data for leaf in expected.leaves)
+
+    def test_should_stream_records(self):
+        # given
+        chunks = make_chunks(4)
+        key = generate_bytes(32, seed=102)
+
+        # when
+        records = dict(streaming.encode_stream(iter(chunks), key, 4))
+
+        # then
+        expected = encoding.encode(flat_merkle.from_list(chunks), key)
+        assert [records[i] for i in range(8)] == [leaf.data for leaf in expected.leaves]
+
+    @pytest.mark.parametrize("count", [0, 3])
+    def test_should_raise_when_leaf_count_invalid(self, count):
+        # given / when / then
+        with pytest.raises(ValueError):
+            streaming.StreamingEncoder(b"\x01" * 32, count)
+
+    def test_should_raise_when_leaves_missing(self):
+        # given
+        encoder = streaming.StreamingEncoder(b"\x01" * 32, 4)
+        encoder.update(b"\x00" * 32)
+
+        # when / then
+        with pytest.raises(ValueError):
+            encoder.finalize()
+
+    def test_should_raise_when_leaf_size_changes(self):
+        # given
+        encoder = streaming.StreamingEncoder(b"\x01" * 32, 4)
+        encoder.update(b"\x00" * 32)
+
+        # when / then
+        with pytest.raises(ValueError):
+            encoder.update(b"\x00" * 64)
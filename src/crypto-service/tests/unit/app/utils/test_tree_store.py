@@ -0,0 +1,253 @@
+import os
+
+import pytest
+from crypto_service.app.utils import encoding, flat_merkle, merkle, tree_store
+from crypto_service.app.utils.bytes import generate_bytes
+
+
+def make_tree(count, size=32):
+    return flat_merkle.from_list([generate_bytes(size, seed=i) for i in range(count)])
+
+
+class TestMappedMerkleTree:
+
+    @pytest.mark.parametrize(
+        "count, size", [(1, 32), (2, 64), (16, 32), (5, 32), (3, 64)]
+    )
+    def test_should_answer_like_flat_tree(self, tmp_path, count, size):
+        # given
+        tree = make_tree(count, size)
+        path = str(tmp_path / "tree")
+        tree_store.write_tree(tree, path)
+
+        # when
+        with tree_store.MappedMerkleTree(path) as mapped:
+            # then
+            assert mapped.digest == tree.digest
+            assert mapped.leaf_count == count
+            assert mapped.depth == tree.depth
+            for index in range(count):
+                assert mapped.get_proof_by_index(index) == tree.get_proof_by_index(
+                    index
+                )
+                assert mapped.leaf_data(index) == tree.leaves[index].data
+            assert mapped.leaves_range(0, count) == [leaf.data for leaf in tree.leaves]
+
+    @pytest.mark.parametrize("count, size", [(5, 16), (1, 4), (3, 4)])
+    def test_should_read_back_sized_tree(self, tmp_path, count, size):
+        # given
+        leaves = [
+            merkle.MerkleTreeLeaf(generate_bytes(32, seed=i)) for i in range(count)
+        ]
+        tree = flat_merkle.from_leaves(leaves, size=size)
+        path = str(tmp_path / "tree")
+
+        # when
+        tree_store.write_tree(tree, path)
+
+        # then
+        with tree_store.MappedMerkleTree(path) as mapped:
+            assert mapped.digest == tree.digest
+            assert mapped.depth == tree.depth
+            assert mapped.leaf_count == count
+            assert mapped.get_proof_by_index(count - 1) == tree.get_proof_by_index(
+                count - 1
+            )
+            assert mapped.get_multiproof([0]) == tree.get_multiproof([0])
+
+    def test_should_read_version_1_files(self, tmp_path):
+        # given
+        tree = make_tree(5)
+        path = str(tmp_path / "tree")
+        tree_store.write_tree(tree, path)
+        with open(path, "rb") as file:
+            body = file.read()[tree_store.HEADER.size :]
+        with open(path, "wb") as file:
+            file.write(tree_store.HEADER_V1.pack(tree_store.MAGIC, 1, 5) + body)
+
+        # when
+        with tree_store.MappedMerkleTree(path) as mapped:
+            # then
+            assert mapped.digest == tree.digest
+            assert mapped.leaves_range(0, 5) == [leaf.data for leaf in tree.leaves]
+
+    def test_should_raise_on_invalid_padded_leaf_count(self, tmp_path):
+        # given
+        path = str(tmp_path / "tree")
+        tree_store.write_tree(make_tree(5), path)
+        with open(path, "r+b") as file:
+            file.write(tree_store.HEADER.pack(tree_store.MAGIC, 2, 5, 4))
+
+        # when / then
+        with pytest.raises(tree_store.TreeStoreError):
+            tree_store.MappedMerkleTree(path)
+
+    def test_should_store_encoded_tree(self, tmp_path):
+        # given
+        tree = encoding.encode(make_tree(4, 64), generate_bytes(32, seed=9))
+        path = str(tmp_path / "tree")
+
+        # when
+        tree_store.write_tree(tree, path)
+
+        # then
+        with tree_store.MappedMerkleTree(path) as mapped:
+            assert mapped.digest == tree.digest
+            assert mapped.leaves_range(2, 6) == [leaf.data for leaf in tree.leaves[2:6]]
+            assert mapped.node_digest(1, 3) == tree.node_digest(1, 3)
+
+    @pytest.mark.parametrize("start, stop", [(-1, 2), (2, 1), (0, 5)])
+    def test_should_raise_when_range_invalid(self, tmp_path, start, stop):
+        # given
+        path = str(tmp_path / "tree")
+        tree_store.write_tree(make_tree(4), path)
+
+        # when / then
+        with tree_store.MappedMerkleTree(path) as mapped:
+            with pytest.raises(IndexError):
+                mapped.leaves_range(start, stop)
+
+    def test_should_raise_when_file_truncated(self, tmp_path):
+        # given
+        path = str(tmp_path / "tree")
+        tree_store.write_tree(make_tree(4), path)
+        with open(path, "r+b") as file:
+            file.truncate(os.path.getsize(path) - 1)
+
+        # when / then
+        with pytest.raises(tree_store.TreeStoreError):
+            tree_store.MappedMerkleTree(path)
+
+    def test_should_raise_when_not_a_tree_file(self, tmp_path):
+        # given
+        path = tmp_path / "tree"
+        path.write_bytes(b"\x00" * 64)
+
+        # when / then
+        with pytest.raises(tree_store.TreeStoreError):
+            tree_store.MappedMerkleTree(str(path))
+
+    def test_should_raise_when_file_empty(self, tmp_path):
+        # given
+        path = tmp_path / "tree"
+        path.write_bytes(b"")
+
+        # when / then
+        with pytest.raises(tree_store.TreeStoreError):
+            tree_store.MappedMerkleTree(str(path))
+
+
+class TestTreeStore:
+
+    def test_should_address_trees_by_root(self, tmp_path):
+        # given
+        store = tree_store.TreeStore(str(tmp_path))
+        tree = make_tree(8)
+
+        # when
+        root = store.put(tree)
+
+        # then
+        assert root == tree.digest
+        assert root in store
+        assert store.get(root).get_proof_by_index(5) == tree.get_proof_by_index(5)
+        assert store.get(root) is store.get(root)
+
+    def test_should_not_rewrite_stored_tree(self, tmp_path):
+        # given
+        store = tree_store.TreeStore(str(tmp_path))
+        root = store.put(make_tree(8))
+        inode = os.stat(store.path(root)).st_ino
+
+        # when
+        store.put(make_tree(8))
+
+        # then
+        assert os.stat(store.path(root)).st_ino == inode
+
+    def test_should_raise_for_unknown_root(self, tmp_path):
+        # given
+        store = tree_store.TreeStore(str(tmp_path))
+
+        # when / then
+        with pytest.raises(KeyError):
+            store.get(b"\x00" * 32)
+
+    def test_should_limit_open_trees(self, tmp_path):
+        # given
+        store = tree_store.TreeStore(str(tmp_path), max_open=2)
+        roots = [store.put(make_tree(2, 32 * (i + 1))) for i in range(3)]
+
+        # when
+        trees = [store.get(root) for root in roots]
+
+        # then
+        assert len(store._open) == 2
+        assert [tree.digest for tree in trees] == roots
+
+    def test_should_remove_least_recently_used_trees(self, tmp_path):
+        # given
+        trees = [make_tree(2, 32 * (i + 1)) for i in range(3)]
+        sizes = tree_store.TreeStore(str(tmp_path / "sizes"))
+        first_size, third_size = [
+            os.path.getsize(sizes.path(sizes.put(tree))) for tree in trees[::2]
+        ]
+        store = tree_store.TreeStore(
+            str(tmp_path / "trees"), max_bytes=first_size + third_size
+        )
+        first, second = store.put(trees[0]), store.put(trees[1])
+        store.get(first)
+
+        # when
+        third = store.put(trees[2])
+
+        # then
+        assert first in store and third in store
+        assert second not in store
+        with pytest.raises(KeyError):
+            store.get(second)
+
+    def test_should_remove_old_trees_on_startup(self, tmp_path):
+        # given
+        store = tree_store.TreeStore(str(tmp_path))
+        roots = [store.put(make_tree(count)) for count in (2, 3, 4)]
+        for i, root in enumerate(roots):
+            os.utime(store.path(root), (i, i))
+        (tmp_path / "partial.tmp").write_bytes(b"x" * 4096)
+        size = os.path.getsize(store.path(roots[2]))
+
+        # when
+        store = tree_store.TreeStore(str(tmp_path), max_bytes=2 * size)
+
+        # then
+        assert [root in store for root in roots] == [False, True, True]
+        assert (tmp_path / "partial.tmp").exists()
+
+
+class TestStoredTrees:
+
+    @pytest.fixture(autouse=True)
+    def reset(self):
+        yield
+        tree_store.StoredTrees.configure(None)
+
+    def test_should_reuse_store_of_directory(self, tmp_path):
+        # given
+        tree_store.StoredTrees.configure(str(tmp_path))
+
+        # when
+        store = tree_store.StoredTrees.open(str(tmp_path))
+
+        # then
+        assert store is tree_store.StoredTrees.store
+
+    def test_should_open_store_in_worker(self, tmp_path):
+        # given
+        root = tree_store.TreeStore(str(tmp_path)).put(make_tree(4))
+
+        # when
+        store = tree_store.StoredTrees.open(str(tmp_path))
+
+        # then
+        assert store.get(root).digest == root
+        assert tree_store.StoredTrees.open(str(tmp_path)) is store
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+from crypto_service.config import settings
+from crypto_service.app.utils import (
+    StoredTrees,
+    WorkExecutor,
+    flat_merkle,
+    hashing,
+    work_executor,
+)
+from crypto_service.app.utils.work_executor import ExecutorSaturatedError
+
+
+def square(value):
+    return value * value
+
+
+class TestWorkExecutor:
+
+    @pytest.fixture(autouse=True)
+    def reset(self):
+        yield
+        WorkExecutor.configure("thread", 4, 64)
+
+    @pytest.mark.parametrize(
+        "executor_type, expected",
+        [("thread", ThreadPoolExecutor), ("process", ProcessPoolExecutor)],
+    )
+    @pytest.mark.asyncio
+    async def test_should_run_in_pool(self, executor_type, expected):
+        # given
+        WorkExecutor.configure(executor_type, 1, 0)
+
+        # when
+        result = await WorkExecutor.run(square, 7)
+
+        # then
+        assert result == 49
+        assert isinstance(WorkExecutor.executor, expected)
+        assert WorkExecutor.pending == 0
+
+    @pytest.mark.asyncio
+    async def test_should_run_off_event_loop_thread(self):
+        # given / when
+        thread = await WorkExecutor.run(threading.get_ident)
+
+        # then
+        assert thread != threading.get_ident()
+
+    @pytest.mark.asyncio
+    async def test_should_reject_when_saturated(self):
+        # given
+        WorkExecutor.configure("thread", 1, 1)
+        release = threading.Event()
+        running = [
+            asyncio.ensure_future(WorkExecutor.run(release.wait)) for _ in range(2)
+        ]
+        await asyncio.sleep(0)
+
+        # when
+        with pytest.raises(ExecutorSaturatedError):
+            await WorkExecutor.run(square, 2)
+
+        # then
+        release.set()
+        assert await asyncio.gather(*running) == [True, True]
+        assert WorkExecutor.pending == 0
+
+    @pytest.mark.asyncio
+    async def test_should_propagate_exceptions(self):
+        # given / when / then
+        with pytest.raises(ValueError):
+            await WorkExecutor.run(int, "not a number")
+        assert WorkExecutor.pending == 0
+
+    def test_should_not_fork_process_workers(self):
+        # given
+        WorkExecutor.configure("process", 2, 0)
+
+        # when
+        with mock.patch.object(work_executor, "ProcessPoolExecutor") as executor:
+            WorkExecutor.get_executor()
+
+        # then
+        kwargs = executor.call_args.kwargs
+        assert kwargs["mp_context"].get_start_method() in ("forkserver", "spawn")
+        assert kwargs["initializer"] is work_executor.init_process_worker
+        WorkExecutor.executor = None
+
+    def test_should_configure_process_workers_from_settings(
+        self, tmp_path, monkeypatch
+    ):
+        # given
+        monkeypatch.setattr(hashing, "_pool_worker", False)
+        patches = {
+            "HASH_BACKEND": "threads",
+            "MERKLE_WORKERS": 3,
+            "MERKLE_PARALLEL_THRESHOLD": 64,
+            "TREE_STORE_DIR": str(tmp_path),
+            "TREE_STORE_DIR_BYTES": 4096,
+        }
+
+        # when
+        with mock.patch.multiple(settings, **patches):
+            work_executor.init_process_worker()
+
+        # then
+        assert isinstance(hashing.get_backend(), hashing.ThreadedHashBackend)
+        assert hashing._pool_worker
+        assert flat_merkle.PARALLEL_WORKERS == 3
+        assert flat_merkle.PARALLEL_THRESHOLD == 64
+        assert StoredTrees.store.directory == str(tmp_path)
+        assert StoredTrees.store.max_bytes == 4096
+        hashing.configure_backend()
+        flat_merkle.configure_parallelism(1)
+        StoredTrees.configure(None)
+
+    def test_should_shutdown_executor(self):
+        # given
+        WorkExecutor.get_executor()
+
+        # when
+        WorkExecutor.shutdown_executor()
+
+        # then
+        assert WorkExecutor.executor is None
+
+    @pytest.mark.parametrize(
+        "executor_type, workers, queue_size",
+        [("fiber", 1, 0), ("thread", 0, 0), ("process", 1, -1)],
+    )
+    def test_should_raise_when_configuration_invalid(
+        self, executor_type, workers, queue_size
+    ):
+        # given / when / then
+        with pytest.raises(ValueError):
+            WorkExecutor.configure(executor_type, workers, queue_size)
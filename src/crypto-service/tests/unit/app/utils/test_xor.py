@@ -0,0 +1,70 @@
+from unittest import mock
+
+import pytest
+from crypto_service.app.utils import xor
+from crypto_service.app.utils.bytes import generate_bytes
+from crypto_service.app.utils.xor import xor_bytes, xor_crypt
+
+
+def reference_xor_crypt(data, key):
+    return bytes(x ^ key[i % len(key)] for i, x in enumerate(data))
+
+
+class TestXor:
+
+    @pytest.mark.parametrize("length", [0, 1, 31, 32, 33, 64, 1000])
+    def test_should_xor_with_repeated_key(self, length):
+        # given
+        data = generate_bytes(length, seed=length) if length else b""
+        key = generate_bytes(32, seed=1)
+
+        # when
+        result = xor_crypt(data, key)
+
+        # then
+        assert result == reference_xor_crypt(data, key)
+        assert xor_crypt(result, key) == data
+
+    def test_should_keep_leading_zero_bytes(self):
+        # given / when
+        result = xor_bytes(b"\x00\x00\x01", b"\x00\x00\x01")
+
+        # then
+        assert result == b"\x00\x00\x00"
+
+    def test_should_raise_when_keystream_length_differs(self):
+        # given / when / then
+        with pytest.raises(ValueError):
+            xor_bytes(b"\x00" * 4, b"\x00" * 3)
+
+    def test_should_raise_when_key_empty(self):
+        # given / when / then
+        with pytest.raises(ValueError):
+            xor_crypt(b"\x00", b"")
+
+
+class TestXorInto:
+
+    @pytest.mark.parametrize("length", [0, 31, 64, 100])
+    def test_should_xor_in_blocks(self, length):
+        # given
+        data = generate_bytes(length, seed=3) if length else b""
+        stream = generate_bytes(length, seed=4) if length else b""
+        buffer = bytearray(data)
+
+        # when
+        with mock.patch.object(xor, "XOR_BLOCK_SIZE", 32):
+            xor.xor_into(memoryview(buffer), stream)
+
+        # then
+        assert buffer == bytes(x ^ y for x, y in zip(data, stream))
+
+    def test_should_xor_into_view(self):
+        # given
+        buffer = bytearray(b"\x00" * 8)
+
+        # when
+        xor.xor_into(memoryview(buffer)[2:4], b"\xff\xff")
+
+        # then
+        assert buffer == b"\x00\x00\xff\xff\x00\x00\x00\x00"
@@ -0,0 +1,17 @@
+from crypto_service.app.views.encoding import EncodingBatchResponse, EncodingResponse
+
+
+class TestEncodingBatchResponse:
+
+    def test_should_create_encoding_batch_response(self):
+        # given / when
+        response = EncodingBatchResponse(
+            encodings=[EncodingResponse(encoding=["00" * 32], root="11" * 32)]
+        )
+
+        # then
+        assert response.encodings[0].root == "11" * 32
+        schema = response.schema()
+        assert schema["description"] == "Encoding batch response model."
+        assert set(schema["properties"]) == {"encodings"}
+        assert schema["required"] == ["encodings"]
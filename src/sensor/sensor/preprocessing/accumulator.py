@@ -0,0 +1,98 @@
+import hashlib
+
+CHUNK_SIZE = 32
+DIGEST_SIZE = 32
+
+
+def hash_chunk(numbers: list[int]):
+    "Calculates the leaf digest of 32 numbers, packed as 32 bit integers."
+    return hashlib.sha256(b"".join([int.to_bytes(num, 4, "big") for num in numbers])).digest()
+
+
+def hash_pair(left: bytes, right: bytes):
+    return hashlib.sha256(left + right).digest()
+
+
+class MerkleAccumulator:
+    """Append-only Merkle tree over chunks of 32 numbers.
+
+    Only the roots of the perfect subtrees not yet paired up (the peaks) are
+    kept, one per set bit of the leaf count. For power of two leaf counts the
+    root equals the one computed by createMerkleRoot on all numbers. For other
+    counts the peaks are folded from right to left. Numbers passed to extend
+    that do not fill a chunk are kept until the next call completes it; like
+    createMerkleRoot, the root leaves them out.
+    """
+
+    def __init__(self):
+        self.count = 0
+        # peaks[level] is the root of a subtree with 2^level leaves or None
+        self.peaks: list[bytes | None] = []
+        # numbers of the chunk not completed yet
+        self.pending: list[int] = []
+
+    def append(self, numbers: list[int]):
+        "Adds one chunk of 32 numbers and returns the current root."
+        if len(numbers) != CHUNK_SIZE:
+            raise ValueError("A chunk has to hold exactly %d numbers" % CHUNK_SIZE)
+        if self.pending:
+            raise ValueError("The pending numbers have to be completed with extend first")
+        return self.append_leaf(hash_chunk(numbers))
+
+    def append_leaf(self, digest: bytes):
+        "Adds a leaf digest and returns the current root."
+        level = 0
+        while level < len(self.peaks) and self.peaks[level] is not None:
+            digest = hash_pair(self.peaks[level], digest)
+            self.peaks[level] = None
+            level += 1
+        if level == len(self.peaks):
+            self.peaks.append(None)
+        self.peaks[level] = digest
+        self.count += 1
+        return self.root()
+
+    def extend(self, numbers: list[int]):
+        "Adds numbers chunk by chunk and returns the current root, None before the first chunk."
+        numbers = self.pending + list(numbers)
+        complete = len(numbers) - len(numbers) % CHUNK_SIZE
+        self.pending = numbers[complete:]
+        for i in range(0, complete, CHUNK_SIZE):
+            self.append_leaf(hash_chunk(numbers[i:i + CHUNK_SIZE]))
+        return self.root() if self.count else None
+
+    def root(self):
+        if self.count == 0:
+            raise ValueError("No chunk has been appended yet")
+        root = None
+        for peak in self.peaks:
+            if peak is not None:
+                root = peak if root is None else hash_pair(peak, root)
+        return root
+
+    def checkpoint(self):
+        "Serializes the accumulator as leaf count, peaks and pending numbers."
+        return (
+            self.count.to_bytes(8, "big")
+            + b"".join([peak for peak in self.peaks if peak is not None])
+            + b"".join([int.to_bytes(num, 4, "big") for num in self.pending])
+        )
+
+    @classmethod
+    def from_checkpoint(cls, data: bytes):
+        accumulator = cls()
+        accumulator.count = int.from_bytes(data[:8], "big")
+        levels = accumulator.count.bit_length()
+        pending = len(data) - 8 - bin(accumulator.count).count("1") * DIGEST_SIZE
+        if not 0 <= pending < 4 * CHUNK_SIZE or pending % 4:
+            raise ValueError("Invalid checkpoint")
+        offset = 8
+        accumulator.peaks = [None] * levels
+        for level in range(levels):
+            if accumulator.count >> level & 1:
+                accumulator.peaks[level] = data[offset:offset + DIGEST_SIZE]
+                offset += DIGEST_SIZE
+        accumulator.pending = [
+            int.from_bytes(data[i:i + 4], "big") for i in range(offset, len(data), 4)
+        ]
+        return accumulator
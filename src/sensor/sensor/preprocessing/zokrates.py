@@ -23,6 +23,12 @@ def get_sha_256(val: bytes):
     "Calculates a SHA256 hash for the input."
     return hashlib.sha256(val).digest()
 
+def hash_many(messages: bytes, size: int = 64):
+    "Calculates the SHA256 hashes of every size bytes of the input, concatenated."
+    sha256 = hashlib.sha256
+    view = memoryview(messages)
+    return b"".join([sha256(view[i:i+size]).digest() for i in range(0, len(view), size)])
+
 def write_zokrates_input(numbers: list[int]):
     sha256_hash = get_sha_256(get_bytes_packed(numbers))
     sha256_hash += sha256_hash
@@ -33,15 +39,19 @@ def write_zokrates_input(numbers: list[int]):
     ]
 
 def createMerkleRoot(numbers: list[int]):
-    num_bytes = [int.to_bytes(num, 4, "big") for num in numbers]
-    leafs = [hashlib.sha256(b"".join(num_bytes[i*32:i*32+32])).digest() for i in range(len(numbers)//32)]
-    offset = 0
+    num_bytes = b"".join([int_to_bytes(num) for num in numbers])
+    # leaves hash 32 numbers each, a trailing partial chunk is left out
+    digests = hash_many(num_bytes[:len(numbers)//32*128], 128)
+    if not digests:
+        raise IndexError("At least 32 numbers are needed")
 
-    for _ in range(len(leafs)-1):
-        leafs.append(hashlib.sha256(b"".join([leafs[offset], leafs[offset+1]])).digest())
-        offset += 2
+    # digests are paired in the order they were computed, an unpaired one is
+    # paired with the first digest of the next pass
+    while len(digests) > 32:
+        paired = len(digests) - len(digests) % 64
+        digests = digests[paired:] + hash_many(digests[:paired])
 
-    msg = leafs[len(leafs)-1] + leafs[len(leafs)-1]
+    msg = digests + digests
     signature = signKey.sign(msg)
     return [
         " ".join([str(i) for i in struct.unpack(">%dI" % len(numbers), get_bytes_packed(numbers))][-len(numbers):]),
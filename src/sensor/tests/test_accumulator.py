@@ -0,0 +1,92 @@
+import random
+
+import pytest
+
+from sensor.preprocessing.accumulator import CHUNK_SIZE, MerkleAccumulator
+
+
+def make_numbers(chunks, seed=0):
+    generator = random.Random(seed)
+    return [generator.randrange(2**32) for _ in range(chunks * CHUNK_SIZE)]
+
+
+def reference_root(numbers):
+    zokrates = pytest.importorskip("sensor.preprocessing.zokrates")
+    # the first 8 words of the signed message are the root
+    words = zokrates.createMerkleRoot(numbers)[1].split()[-8:]
+    return b"".join([int(word).to_bytes(4, "big") for word in words])
+
+
+def feed(accumulator, numbers, batch_size):
+    for i in range(0, len(numbers), batch_size):
+        accumulator.extend(numbers[i:i + batch_size])
+
+
+class TestMerkleAccumulator:
+
+    @pytest.mark.parametrize("batch_size", [1, 31, 32, 40, 100, 256])
+    def test_should_match_create_merkle_root_for_any_batches(self, batch_size):
+        # given
+        numbers = make_numbers(8)
+        accumulator = MerkleAccumulator()
+
+        # when
+        feed(accumulator, numbers, batch_size)
+
+        # then
+        assert accumulator.count == 8
+        assert accumulator.pending == []
+        assert accumulator.root() == reference_root(numbers)
+
+    @pytest.mark.parametrize("split", [0, 40, 128, 250])
+    def test_should_resume_from_checkpoint(self, split):
+        # given
+        numbers = make_numbers(8, seed=split)
+        accumulator = MerkleAccumulator()
+        feed(accumulator, numbers[:split], 40)
+
+        # when
+        resumed = MerkleAccumulator.from_checkpoint(accumulator.checkpoint())
+        feed(resumed, numbers[split:], 40)
+
+        # then
+        assert resumed.count == 8
+        assert resumed.root() == reference_root(numbers)
+
+    def test_should_keep_partial_chunk_pending(self):
+        # given
+        numbers = make_numbers(2)
+        accumulator = MerkleAccumulator()
+
+        # when
+        first = accumulator.extend(numbers[:40])
+        second = accumulator.extend(numbers[40:])
+
+        # then
+        assert first == MerkleAccumulator().extend(numbers[:32])
+        assert accumulator.count == 2
+        assert second == reference_root(numbers)
+
+    def test_should_return_none_before_first_chunk(self):
+        # given
+        accumulator = MerkleAccumulator()
+
+        # when / then
+        assert accumulator.extend(make_numbers(1)[:10]) is None
+        with pytest.raises(ValueError):
+            accumulator.root()
+
+    def test_should_raise_on_append_with_pending_numbers(self):
+        # given
+        accumulator = MerkleAccumulator()
+        accumulator.extend(make_numbers(1)[:10])
+
+        # when / then
+        with pytest.raises(ValueError):
+            accumulator.append(make_numbers(1))
+
+    @pytest.mark.parametrize("data", [b"", bytes(8) + bytes(3), bytes(8) + bytes(128)])
+    def test_should_raise_on_invalid_checkpoint(self, data):
+        # given / when / then
+        with pytest.raises(ValueError):
+            MerkleAccumulator.from_checkpoint(data)